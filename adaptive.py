@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from tt_gpx.gpx import Route
+from tt_globals.globals import Globals
+from tt_file_tools.file_tools import print_file_exists
+
+from binary_cache import read_cache
+from elapsed_time import ElapsedTimeDataframe, elapsed_times_at
+from transit_time import (MinimaFrame, linear_trend, midline_windows, write_transit_times, post_transit_times, aggregate_transit_times,
+                          speed_folder, MIDLINE_WINDOW, NOISE_SIZE)
+from instrumentation import MeasuredJob, section, cache_lookup
+
+#  Transit times of a speed without the elapsed time files. Departures are evaluated on a coarse grid first, then
+#  between neighbours until every gap is settled. A later departure never arrives earlier, so across a gap from a to b
+#  the transit time is at least tts(a) - (b - a - 1) and at most tts(b) + (b - a - 1). A gap is settled when those
+#  bounds lie on one side of the midline and, below it, above the lowest transit time and on one side of the offset
+#  of the windows around it. The minima, ties and offset crossings are then those of every departure evaluated.
+#  The midline is the running mean of the values filled in between. A filled value is off by at most the gap's slack,
+#  so the midline is off by at most the mean slack of its window. Only departures that close to it can be classed
+#  differently, so every window that ends on the midline and every block below or above it that could split, merge or
+#  fall under the noise size has all the departures of its midline evaluated. The benchmark reports any difference
+#  from a full run.
+DEFAULT_STRIDE = 16  # departures between coarse evaluations
+
+
+class TransitChain:  # transit timesteps of any departure rows, each edge's distance sums are built once
+
+    def __init__(self, edges, speed):  # edges are (init velocity file, final velocity file, length, reverse) in route order
+        velocities = {}
+        self.edges = []
+        for init_file, final_file, length, reverse in edges:
+            init_velos = velocities.setdefault(init_file, read_cache(init_file)['velocity'].to_numpy())
+            final_velos = velocities.setdefault(final_file, read_cache(final_file)['velocity'].to_numpy())
+            if reverse:
+                init_velos, final_velos = -init_velos, -final_velos
+            dist = np.insert(ElapsedTimeDataframe.distance(final_velos[1:], init_velos[:-1], speed, Globals.TIMESTEP / 3600), 0, 0.0)
+            self.edges.append((dist, length, np.cumsum(np.abs(dist), dtype=np.float64)))
+
+    def __call__(self, positions):
+        rows = np.array(positions)
+        for dist, length, travelled in self.edges:
+            rows += elapsed_times_at(dist, length, rows, travelled)
+        return rows - positions
+
+
+def unsettled_gaps(exact, values, midline, tts):  # positions between evaluated departures that could change a window
+    a, b = exact[:-1], exact[1:]
+    slack = b - a - 1
+    lower, upper = values[:-1] - slack, values[1:] + slack
+    midline_low, midline_high = np.minimum.reduceat(midline, a), np.maximum.reduceat(midline, a)
+    below = upper < midline_low
+    unsettled = ~below & ~(lower > midline_high)
+
+    keep, start, minimum, end = midline_windows(np.arange(len(tts)), tts, midline)
+    minima = keep[minimum]
+    if len(minima):
+        lowest = tts[minima]
+        offset = (lowest * Globals.TIME_WINDOW_SCALE_FACTOR).astype(int)
+        after = np.searchsorted(minima, a)
+        for w in [np.maximum(after - 1, 0), np.minimum(after, len(minima) - 1)]:  # the windows either side of the gap
+            unsettled |= below & ((lower <= lowest[w]) | ((lower <= offset[w]) & (offset[w] < upper)))
+    unsettled &= slack > 0
+    return (a[unsettled] + b[unsettled]) // 2
+
+
+def interpolation_slack(tts, evaluated):  # largest difference of each filled value from the value of a full run
+    exact = np.flatnonzero(evaluated)
+    after = np.minimum(np.searchsorted(exact, np.arange(len(tts))), len(exact) - 1)
+    a, b = exact[np.maximum(after - 1, 0)], exact[after]
+    return np.where(evaluated, 0, np.abs(tts[b] - tts[a]) + b - a - 1)  # the true value is within the gap's bounds, the filled one between its ends
+
+
+def midline_slack(slack, window):  # largest difference of the midline from that of a full run
+    count, half = len(slack), window // 2
+    total = np.concatenate(([0], np.cumsum(slack)))
+    starts = np.clip(np.arange(count) - (window - 1) // 2, 0, count - window)  # the samples linear_trend averages or fits
+    bound = (total[starts + window] - total[starts]) / window
+    bound[:half] *= 4  # a point of the fits at the ends weighs no sample more than 4 / window
+    bound[count - half:] *= 4
+    return bound
+
+
+def unsettled_midline(tts, midline, evaluated, window, noise_size=NOISE_SIZE):  # departures still to evaluate for an exact midline where it matters
+    slack = midline_slack(interpolation_slack(tts, evaluated), window) + 1  # the rounded midlines differ by at most one more
+    sensitive = (np.abs(tts - midline) <= slack) & (slack > 1)
+    if not sensitive.any():
+        return np.array([], dtype=int)
+    flagged = []
+
+    keep, start, minimum, end = midline_windows(np.arange(len(tts)), tts, midline)
+    offset = (tts[keep[minimum]] * Globals.TIME_WINDOW_SCALE_FACTOR).astype(int)
+    for edge in [keep[start], keep[end]]:  # window ends on the midline or where the offset meets it
+        on_midline = (tts[edge] <= offset) | (np.abs(offset - midline[edge]) <= slack[edge] + 1)
+        flagged.append(edge[on_midline & sensitive[edge]])
+
+    below = tts[keep] < midline[keep]
+    starts = np.concatenate(([0], np.flatnonzero(below[1:] != below[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(keep)))
+    all_sensitive = np.minimum.reduceat(sensitive[keep], starts)
+    any_sensitive = np.maximum.reduceat(sensitive[keep], starts)
+    runs = all_sensitive | (below[starts] & any_sensitive & (lengths <= 2 * noise_size))  # blocks that could vanish or join
+    flagged.append(keep[starts[runs]])
+
+    flagged = np.concatenate(flagged)
+    count, reach = len(tts), window // 2 + noise_size  # a midline sample averages half a window either side
+    first, last = np.maximum(flagged - reach, 0), np.minimum(flagged + reach + 1, count)
+    first, last = np.where(last <= window, 0, first), np.where(first >= count - window, count, last)  # near the ends it is a fit of the whole first or last window
+    cover = np.zeros(count + 1, dtype=int)
+    np.add.at(cover, first, 1)
+    np.add.at(cover, last, -1)
+    return np.flatnonzero((np.cumsum(cover)[:-1] > 0) & ~evaluated)
+
+
+def adaptive_timesteps(chain: TransitChain, count, window=MIDLINE_WINDOW, stride=DEFAULT_STRIDE):  # filled timesteps, midline and evaluated departures
+    evaluated = np.zeros(count, dtype=bool)
+    values = np.zeros(count, dtype=int)
+    positions = np.unique(np.append(np.arange(0, count, stride), count - 1))
+    every = np.arange(count)
+    while len(positions):
+        values[positions] = chain(positions)
+        evaluated[positions] = True
+        exact = np.flatnonzero(evaluated)
+        tts = np.rint(np.interp(every, exact, values[exact])).astype(int)  # between the values either side, never past them
+        midline = linear_trend(tts, window).round()
+        positions = unsettled_gaps(exact, values[exact], midline, tts)
+        if not len(positions):
+            positions = unsettled_midline(tts, midline, evaluated, window)
+    return tts, midline, evaluated
+
+
+class AdaptiveTransitTimeDataframe:
+
+    def __init__(self, speed, template_df: pd.DataFrame, edges, tt_folder: Path, f_day, l_day, window=MIDLINE_WINDOW, stride=DEFAULT_STRIDE):
+
+        folder = speed_folder(tt_folder, speed)
+        transit_times_path = folder.joinpath('transit_times.csv')
+        rounded_transit_times_path = folder.joinpath('rounded_transit_times.csv')
+        self.transit_time_path = None
+        self.rounded_transit_time_path = None
+        self.evaluated = None
+
+        if cache_lookup(print_file_exists(transit_times_path) and rounded_transit_times_path.exists()):
+            self.transit_time_path, self.rounded_transit_time_path = transit_times_path, rounded_transit_times_path
+        else:
+            with section('adaptive transit timesteps'):
+                tts, midline, evaluated = adaptive_timesteps(TransitChain(edges, speed), len(template_df), window, stride)
+            self.evaluated = int(evaluated.sum())
+            print(f'{speed} kts: {self.evaluated} of {len(tts)} departures evaluated', flush=True)
+            # the filled timesteps are not those of a full run, they are kept apart from savgol.csv and timesteps.csv
+            minima_df = MinimaFrame(tts, template_df, folder.joinpath('adaptive_savgol.csv'), folder.joinpath('minima.csv'), window, midline).frame
+            self.transit_time_path, self.rounded_transit_time_path = write_transit_times(speed, minima_df, f_day, l_day, transit_times_path, rounded_transit_times_path)
+
+
+class AdaptiveTransitTimeJob(MeasuredJob):  # super -> job name, result key, function/object, arguments
+
+    def execute(self): return super().execute()
+    def execute_callback(self, result): return super().execute_callback(result)
+    def error_callback(self, result): return super().error_callback(result)
+
+    def __init__(self, speed, route: Route, tt_folder: Path, window=MIDLINE_WINDOW, stride=DEFAULT_STRIDE, prefix=''):
+        job_name = 'adaptive transit_time' + ' ' + str(speed)
+        result_key = prefix + str(speed) if prefix else speed
+        edges = [(edge.start.folder.joinpath(Globals.EDGE_DATAFILE_NAME), edge.end.folder.joinpath(Globals.EDGE_DATAFILE_NAME), edge.length, getattr(edge, 'reverse', False))
+                 for edge in route.edges]
+        arguments = tuple([speed, Globals.TEMPLATE_TRANSIT_TIME_DATAFRAME, edges, tt_folder, Globals.FIRST_DAY, Globals.LAST_DAY, window, stride])
+        super().__init__(job_name, result_key, AdaptiveTransitTimeDataframe, arguments)
+
+
+def adaptive_processing(job_manager, route: Route, window=MIDLINE_WINDOW, stride=DEFAULT_STRIDE, prefix=''):
+    print(f'\nCalculating adaptive transit timesteps every {stride} departures')
+    keys = [job_manager.put(AdaptiveTransitTimeJob(speed, route, Globals.TRANSIT_TIMES_FOLDER, window, stride, prefix)) for speed in Globals.BOAT_SPEEDS]
+    job_manager.wait()
+
+    for speed, key in zip(Globals.BOAT_SPEEDS, keys):
+        post_transit_times(route, speed, job_manager.get(key))
+
+    aggregate_transit_times(route)
@@ -0,0 +1,243 @@
+import os
+import sys
+import time
+import shutil
+import pandas as pd
+from argparse import ArgumentParser as argParser
+from pathlib import Path
+
+from tt_gpx.gpx import InterpolatedWP, EdgeNode
+from tt_job_manager.job_manager import JobManager
+from tt_file_tools.file_tools import write_df, print_file_exists
+from tt_globals.globals import Globals
+
+from route_setup import initialize_globals, build_route, check_chrome, download_options, result_files, GlobalsState
+from startup import argument_parser, RunStamp, OUT_OF_DATE
+from binary_cache import enable_binary_cache, enable_low_memory, existing_cache_path, cache_exists
+from velocity import DownloadVelocityJob, SplineFitNormalizedVelocityBatchJob
+from elapsed_time import MultiSpeedElapsedTimeJob, elapsed_times_path, aggregate_elapsed_times, post_elapsed_times
+from transit_time import TransitTimeJob, post_transit_times, aggregate_transit_times, midline_window, MIDLINE_WINDOW
+from shared_buffers import SharedBufferRegistry, peak_memory
+from noaa_downloads import prefetch_stations, download_waypoints, station_codes
+from fingerprints import RouteFingerprints, print_dry_run
+from instrumentation import RunReport, MeasuredJobManager
+
+#  manifest columns, one row per route, any main.py option after the manifest applies to every route
+#  python batch.py routes.csv -bc -cd
+MANIFEST_COLUMNS = ['project_name', 'filepath', 'year']
+
+
+class BatchRoute:  # a route and the Globals it was built with, activated before any of its jobs are made
+
+    def __init__(self, args):
+        self.args = args
+        self.code = args['project_name']
+        initialize_globals(args)
+        self.route = build_route(args)
+        self.state = GlobalsState()
+        self.speeds = []
+        self.finished = None
+
+    def activate(self):
+        self.state.restore()
+        return self.route
+
+
+def read_manifest(manifest: Path, flags):
+    frame = pd.read_csv(manifest, dtype=str, skipinitialspace=True)
+    if list(frame.columns) != MANIFEST_COLUMNS:
+        raise ValueError(f'{manifest} columns must be {MANIFEST_COLUMNS}')
+    filepaths = [Path(p).expanduser() for p in frame['filepath']]
+    filepaths = [p if p.is_absolute() else manifest.parent.joinpath(p) for p in filepaths]
+    return [vars(argument_parser().parse_args([name, str(path), year] + flags)) for name, path, year in zip(frame['project_name'], filepaths, frame['year'])]
+
+
+def copy_outputs(source: Path, target: Path, names):  # results of a deduplicated job into the folders of the other routes
+    for name in names:
+        path = existing_cache_path(source.joinpath(name))
+        if path and not target.joinpath(path.name).exists():
+            shutil.copyfile(path, target.joinpath(path.name))
+
+
+def shared_jobs(routes, waypoints, key):  # waypoints of every route grouped so that each group runs one job
+    groups = {}
+    for batch_route in routes:
+        batch_route.activate()
+        for wp in waypoints(batch_route.route):
+            groups.setdefault(key(wp), []).append((batch_route, wp))
+    return groups
+
+
+def batch_downloads(routes, job_manager, station_cache, client):
+    groups = shared_jobs(routes, download_waypoints, lambda wp: (wp.code, Globals.FIRST_DOWNLOAD_DAY, Globals.LAST_DOWNLOAD_DAY))
+    if client:
+        for fdd, ldd in dict.fromkeys((fdd, ldd) for _, fdd, ldd in groups):
+            prefetch_stations(station_codes([m[0][1] for k, m in groups.items() if k[1:] == (fdd, ldd)]), fdd, ldd, station_cache, client)
+
+    print(f'\nDownloading {len(groups)} stations for {sum(len(m) for m in groups.values())} waypoints of {len(routes)} routes', flush=True)
+    keys = []
+    for (code, fdd, ldd), members in groups.items():
+        members[0][0].activate()
+        keys.append(job_manager.put(DownloadVelocityJob(fdd, ldd, Globals.NORMALIZED_DOWNLOAD_DATES, Globals.NORMALIZED_DOWNLOAD_INDICES, members[0][1], station_cache)))
+    job_manager.wait()
+    for key, members in zip(keys, groups.values()):
+        print_file_exists(job_manager.get(key).filepath)
+        for _, wp in members[1:]:
+            copy_outputs(members[0][1].folder, wp.folder, [Globals.WAYPOINT_DATAFILE_NAME, 'orig_velocity_download.csv'])
+
+
+def batch_interpolation(routes, job_manager):
+    for batch_route in routes:
+        for iwp in filter(lambda w: isinstance(w, InterpolatedWP), batch_route.activate().waypoints):
+            print(f'\nInterpolating the data to approximate velocity for INTERPOLATED WAYPOINT "{iwp.name}" of {batch_route.code}', flush=True)
+            iwp.interpolate(job_manager)
+            print_file_exists(iwp.folder.joinpath(Globals.WAYPOINT_DATAFILE_NAME))
+
+
+def batch_splines(routes, job_manager, dtype):
+    groups = shared_jobs(routes, lambda r: filter(lambda w: isinstance(w, EdgeNode), r.waypoints),
+                         lambda wp: id(wp) if isinstance(wp, InterpolatedWP) else (wp.code, Globals.YEAR))
+
+    print(f'\nSpline fitting {len(groups)} EDGE NODE waypoints for {sum(len(m) for m in groups.values())} edge nodes of {len(routes)} routes', flush=True)
+    years = {}
+    for members in groups.values():
+        members[0][0].activate()
+        years.setdefault(Globals.YEAR, (members[0][0], []))[1].append(members[0][1])
+    keys = []
+    for batch_route, waypoints in years.values():
+        batch_route.activate()
+        batch_size = max(1, -(-len(waypoints) // os.cpu_count()))  # one batch per processor
+        for i in range(0, len(waypoints), batch_size):
+            keys.append(job_manager.put(SplineFitNormalizedVelocityBatchJob(Globals.DOWNLOAD_INDEX_RANGE, waypoints[i:i + batch_size], dtype, str(len(keys)) + ' ')))
+    job_manager.wait()
+    for path in [path for key in keys for path in job_manager.get(key).filepaths]:
+        print_file_exists(path)
+    for members in groups.values():
+        for _, wp in members[1:]:
+            copy_outputs(members[0][1].folder, wp.folder, [Globals.EDGE_DATAFILE_NAME])
+
+
+def batch_edges(routes, job_manager, registry):
+    keys = {}
+    for batch_route in routes:
+        route = batch_route.activate()
+        batch_route.speeds = [s for s in Globals.BOAT_SPEEDS if not cache_exists(elapsed_times_path(s))]
+        for s in set(Globals.BOAT_SPEEDS) - set(batch_route.speeds):
+            post_elapsed_times(route, s)
+        if batch_route.speeds:
+            print(f'\nCalculating elapsed timesteps for {batch_route.code} edges at {batch_route.speeds} kts')
+            keys[batch_route] = [job_manager.put(MultiSpeedElapsedTimeJob(edge, batch_route.speeds, registry, batch_route.code + ' ')) for edge in route.edges]
+    job_manager.wait()
+    for batch_route, edge_keys in keys.items():
+        route = batch_route.activate()
+        results = [job_manager.get(key) for key in edge_keys]
+        for s in batch_route.speeds:
+            aggregate_elapsed_times(route, s, [result.filepaths[s] for result in results])
+
+
+def batch_transit_times(routes, job_manager, registry, window, origin):
+    keys = {}
+    for batch_route in routes:
+        route = batch_route.activate()
+        print(f'\nCalculating transit timesteps for {batch_route.code}')
+        keys[batch_route] = {speed: job_manager.put(TransitTimeJob(speed, route.elapsed_time_csv_to_speed[speed], Globals.TRANSIT_TIMES_FOLDER, registry, window, batch_route.code + ' '))
+                             for speed in Globals.BOAT_SPEEDS}
+    job_manager.wait()
+    for batch_route, speed_keys in keys.items():
+        route = batch_route.activate()
+        for speed, key in speed_keys.items():
+            post_transit_times(route, speed, job_manager.get(key))
+        aggregate_transit_times(route)
+        batch_route.finished = time.perf_counter() - origin
+
+
+def batch_report(routes, stages, filepath):
+    frame = pd.DataFrame(data={
+        'project_name': [r.code for r in routes],
+        'year': [r.state.values['YEAR'] for r in routes],
+        'waypoints': [len(r.route.waypoints) for r in routes],
+        'edges': [len(r.route.edges) for r in routes],
+        'speeds': [len(r.speeds) for r in routes],
+        'edge_speeds': [len(r.route.edges) * len(r.speeds) for r in routes],
+        'finished': [round(r.finished, 1) for r in routes],
+        'edge_speeds_per_second': [round(len(r.route.edges) * len(r.speeds) / r.finished, 2) for r in routes]})
+    print_file_exists(write_df(frame, filepath))
+    print(f'\nStage seconds, shared by every route')
+    for stage, seconds in stages.items():
+        print(f'  {round(seconds, 1):>8}  {stage}')
+    print(frame.to_string(index=False))
+
+
+if __name__ == '__main__':
+
+    ap = argParser(description='run every route of a manifest under one job manager, other options are passed to each route as in main.py')
+    ap.add_argument('manifest', type=Path, help='csv with columns ' + ', '.join(MANIFEST_COLUMNS))
+    batch_args, flags = ap.parse_known_args()
+
+    manifest = read_manifest(batch_args.manifest, flags)
+    if manifest and manifest[0]['bidirectional']:
+        ap.error('--bidirectional runs one route at a time, use main.py')
+    if manifest and manifest[0]['extend_from']:
+        ap.error('--extend_from runs one route at a time, use main.py')
+    if manifest and manifest[0]['adaptive']:
+        ap.error('--adaptive runs one route at a time, use main.py')
+    stamps = {args['project_name']: RunStamp(args) for args in manifest}
+    for args in manifest:
+        print(f'{"up to date" if stamps[args["project_name"]].current() else "out of date"}: {args["project_name"]}')
+    manifest = [args for args in manifest if not stamps[args['project_name']].current()]
+    if not manifest:
+        sys.exit(0)
+    if manifest[0]['check']:
+        sys.exit(OUT_OF_DATE)
+
+    routes = [BatchRoute(args) for args in manifest]
+    args = routes[0].args
+    window = midline_window(args['midline_hours']) if args['midline_hours'] else MIDLINE_WINDOW
+    dtype = 'float32' if args['float32'] else None  # low memory mode never changes the results
+
+    fingerprints = {}
+    for batch_route in routes:
+        fingerprints[batch_route] = RouteFingerprints(batch_route.activate(), window, dtype)
+        if args['dry_run']:
+            print_dry_run(batch_route.route, fingerprints[batch_route])
+        else:
+            print(f'{batch_route.code}: removed {len(fingerprints[batch_route].invalidate())} files whose inputs changed')
+    if args['dry_run']:
+        sys.exit()
+
+    check_chrome()
+
+    if args['binary_cache']:
+        enable_binary_cache()  # before the pool starts so the workers inherit it
+    if args['low_memory']:
+        enable_low_memory()
+    report = RunReport()
+    registry = SharedBufferRegistry() if args['shared_memory'] else None  # before the pool starts so the workers share its resource tracker
+    job_manager = MeasuredJobManager(JobManager(), report)
+    station_cache, client = download_options(args)
+
+    origin = time.perf_counter()
+    for stage, run in [('downloads', lambda: batch_downloads(routes, job_manager, station_cache, client)),
+                       ('interpolation', lambda: batch_interpolation(routes, job_manager)),
+                       ('spline fits', lambda: batch_splines(routes, job_manager, dtype)),
+                       ('elapsed times', lambda: batch_edges(routes, job_manager, registry)),
+                       ('transit times', lambda: batch_transit_times(routes, job_manager, registry, window, origin))]:
+        with report.stage(stage):
+            run()
+
+    batch_report(routes, {row['name']: row['wall'] for row in report.stages}, batch_args.manifest.with_name(batch_args.manifest.stem + '_report.csv'))
+    report.write(batch_args.manifest.parent, batch_args.manifest.stem)
+    for batch_route, route_fingerprints in fingerprints.items():
+        print_file_exists(route_fingerprints.save())
+        batch_route.activate()
+        print_file_exists(stamps[batch_route.code].write(result_files(batch_route.route)))
+
+    print(f'\nProcess Complete')
+
+    job_manager.stop_queue()
+
+    if registry:
+        print(f'shared memory {round(registry.nbytes / 1024 / 1024, 1)} MB')
+        registry.release()
+    parent_mb, workers_mb = peak_memory()
+    print(f'peak memory: main process {parent_mb} MB, largest worker {workers_mb} MB')
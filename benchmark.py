@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+import pandas as pd
+from argparse import ArgumentParser as argParser
+from pathlib import Path
+
+from tt_globals.globals import Globals
+from tt_date_time_tools.date_time_tools import round_datetime
+
+from startup import TRANSIT_TIME_HOME
+from binary_cache import enable_binary_cache, enable_low_memory, existing_cache_path, read_cache
+from station_cache import StationCache
+from velocity import DownloadedVelocityCSV, SplineFitNormalizedVelocityBatch
+from elapsed_time import MultiSpeedElapsedTimeDataframe, ElapsedTimeDataframe, elapsed_times_path, aggregate_elapsed_times
+from transit_time import TransitTimeDataframe, MinimaFrame, total_transit_times, create_arcs, aggregate_transit_times, post_transit_times, speed_folder, MIDLINE_WINDOW
+from adaptive import AdaptiveTransitTimeDataframe, DEFAULT_STRIDE
+
+#  Every stage of the pipeline timed on its own with synthetic tidal currents, no NOAA or Chrome needed.
+#  Each run is appended to a json lines file outside the repository so stage times can be compared across commits.
+#  python benchmark.py -e 20 -d 30 -r 3
+BENCHMARK_RESULTS = TRANSIT_TIME_HOME.joinpath('benchmark_results.jsonl')
+
+#  principal tidal constituents, period in hours and amplitude in knots
+CONSTITUENTS = {'M2': (12.4206, 1.2), 'S2': (12.0, 0.3), 'N2': (12.6583, 0.25), 'K1': (23.9345, 0.15), 'O1': (25.8193, 0.1)}
+NOAA_INTERVAL = 360  # seconds between NOAA current predictions
+
+
+def harmonic_velocity(index, phase=0.0, scale=1.0):  # index in seconds, velocity in knots
+    hours = np.asarray(index) / 3600
+    return scale * sum(amplitude * np.cos(2 * np.pi * hours / period - phase) for period, amplitude in CONSTITUENTS.values())
+
+
+class SyntheticWaypoint:
+
+    def __init__(self, folder: Path, code, phase):
+        self.code = code
+        self.unique_name = code
+        self.name = code
+        self.phase = phase
+        self.folder = folder.joinpath(code)
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+
+class SyntheticEdge:
+
+    def __init__(self, folder: Path, start, end, length):
+        self.start = start
+        self.end = end
+        self.length = length
+        self.unique_name = start.code + '-' + end.code
+        self.folder = folder.joinpath(self.unique_name)
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+
+class SyntheticRoute:  # a straight chain of edges, the current phase shifts along the route
+
+    def __init__(self, folder: Path, edges, edge_length):
+        self.location_code = 'BENCH'
+        self.waypoints = [SyntheticWaypoint(folder.joinpath('waypoints'), 'S' + str(i).zfill(3), i * 0.15) for i in range(edges + 1)]
+        self.edges = [SyntheticEdge(folder.joinpath('edges'), s, e, edge_length) for s, e in zip(self.waypoints[:-1], self.waypoints[1:])]
+        self.elapsed_time_csv_to_speed = {}
+        self.transit_time_csv_to_speed = {}
+        self.rounded_transit_time_csv_to_speed = {}
+
+
+def synthetic_globals(folder: Path, year, days, margin_days, speeds):
+    step = Globals.TIMESTEP
+    first_day = pd.Timestamp(year=year, month=1, day=1)
+    last_day = first_day + pd.Timedelta(days=days - 1)
+    first_download_day = first_day - pd.Timedelta(days=1)
+    last_download_day = last_day + pd.Timedelta(days=margin_days + 1)
+
+    def index(begin, end, interval): return np.arange(int(begin.timestamp()), int(end.timestamp()), interval)
+
+    Globals.YEAR = year
+    Globals.BOAT_SPEEDS = speeds
+    Globals.FIRST_DAY, Globals.LAST_DAY = first_day, last_day
+    Globals.FIRST_DOWNLOAD_DAY, Globals.LAST_DOWNLOAD_DAY = first_download_day, last_download_day
+    Globals.NORMALIZED_DOWNLOAD_INDICES = index(first_download_day, last_download_day, NOAA_INTERVAL)
+    Globals.NORMALIZED_DOWNLOAD_DATES = pd.to_datetime(Globals.NORMALIZED_DOWNLOAD_INDICES, unit='s')
+    Globals.DOWNLOAD_INDEX_RANGE = index(first_download_day, last_download_day, step)
+    Globals.ELAPSED_TIME_INDEX_RANGE = index(first_day, last_day + pd.Timedelta(days=margin_days), step)
+    Globals.TEMPLATE_ELAPSED_TIME_DATAFRAME = pd.DataFrame({'departure_index': Globals.ELAPSED_TIME_INDEX_RANGE, 'date_time': pd.to_datetime(Globals.ELAPSED_TIME_INDEX_RANGE, unit='s')})
+    transit_range = index(first_day, last_day + pd.Timedelta(days=1), step)
+    Globals.TEMPLATE_TRANSIT_TIME_DATAFRAME = pd.DataFrame({'departure_index': transit_range, 'date_time': pd.to_datetime(transit_range, unit='s')})
+    Globals.EDGES_FOLDER = folder.joinpath('edges')
+    Globals.TRANSIT_TIMES_FOLDER = folder.joinpath('transit times')
+    for speed in speeds:
+        speed_folder(Globals.TRANSIT_TIMES_FOLDER, speed).mkdir(parents=True, exist_ok=True)
+
+
+def remove(*paths):
+    for path in paths:
+        while existing := existing_cache_path(path):
+            existing.unlink()
+
+
+class StageTimer:
+
+    def __init__(self, repeats):
+        self.repeats = repeats
+        self.stages = {}
+
+    def time(self, name, run, reset=lambda: None):  # reset removes the outputs that would short circuit the next run
+        seconds = []
+        result = None
+        for _ in range(self.repeats):
+            reset()
+            start = time.perf_counter()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):  # file exists messages would bury the table
+                result = run()
+            seconds.append(time.perf_counter() - start)
+        self.stages[name] = {'min': round(min(seconds), 4), 'median': round(float(np.median(seconds)), 4), 'runs': [round(s, 4) for s in seconds]}
+        print(f'  {self.stages[name]["min"]:>10}  {name}', flush=True)
+        return result
+
+
+def run_benchmarks(folder: Path, args):
+    synthetic_globals(folder, args.year, args.days, args.margin_days, args.speeds)
+    route = SyntheticRoute(folder, args.edges, args.edge_length)
+    timer = StageTimer(args.repeats)
+    fdd, ldd = Globals.FIRST_DOWNLOAD_DAY, Globals.LAST_DOWNLOAD_DAY
+    phases = {wp.code: wp.phase for wp in route.waypoints}
+
+    def download(first, last, code):
+        index = np.arange(int(first.timestamp()), int(last.timestamp()) + NOAA_INTERVAL, NOAA_INTERVAL)
+        return pd.DataFrame({'Time': pd.to_datetime(index, unit='s').strftime('%Y-%m-%d %H:%M'), ' Velocity_Major': harmonic_velocity(index, phases[code]).round(2)})
+
+    station_cache = StationCache(folder.joinpath('stations'), fetch=download)
+    for wp in route.waypoints:
+        station_cache.frame(wp.code, fdd, ldd)  # downloads are not part of the timing
+
+    print(f'\n{len(route.edges)} edges, {args.days} days, {len(Globals.ELAPSED_TIME_INDEX_RANGE)} departures, speeds {args.speeds}')
+    timer.time('download spline fit', lambda: [DownloadedVelocityCSV(fdd, ldd, Globals.NORMALIZED_DOWNLOAD_DATES, Globals.NORMALIZED_DOWNLOAD_INDICES, wp.folder, wp.code, station_cache) for wp in route.waypoints],
+               lambda: [remove(wp.folder.joinpath(Globals.WAYPOINT_DATAFILE_NAME)) for wp in route.waypoints])
+    velocity_files = [wp.folder.joinpath(Globals.WAYPOINT_DATAFILE_NAME) for wp in route.waypoints]
+    timer.time('normalized spline fit', lambda: SplineFitNormalizedVelocityBatch(Globals.DOWNLOAD_INDEX_RANGE, velocity_files, args.dtype),
+               lambda: [remove(wp.folder.joinpath(Globals.EDGE_DATAFILE_NAME)) for wp in route.waypoints])
+
+    elapsed = timer.time('elapsed time', lambda: [MultiSpeedElapsedTimeDataframe(edge.folder, edge.start.folder.joinpath(Globals.EDGE_DATAFILE_NAME), edge.end.folder.joinpath(Globals.EDGE_DATAFILE_NAME),
+                                                                                Globals.ELAPSED_TIME_INDEX_RANGE, edge.length, args.speeds) for edge in route.edges],
+                         lambda: [remove(edge.folder.joinpath(ElapsedTimeDataframe.filename(edge.folder, s))) for edge in route.edges for s in args.speeds])
+    timer.time('aggregate elapsed times', lambda: [aggregate_elapsed_times(route, s, [e.filepaths[s] for e in elapsed]) for s in args.speeds],
+               lambda: [remove(elapsed_times_path(s)) for s in args.speeds])
+
+    template_df = Globals.TEMPLATE_TRANSIT_TIME_DATAFRAME
+    et_df = read_cache(route.elapsed_time_csv_to_speed[args.speeds[0]])
+    columns = [c for c in et_df.columns if c not in ['departure_index', 'date_time']]
+    transit_timesteps = timer.time('total transit time', lambda: total_transit_times(len(template_df), et_df, columns))
+
+    minima_folder = folder.joinpath('minima')
+    minima_folder.mkdir(exist_ok=True)
+    minima_df = timer.time('minima frame', lambda: MinimaFrame(transit_timesteps, template_df, minima_folder.joinpath('savgol.csv'), minima_folder.joinpath('minima.csv'), args.window).frame,
+                           lambda: remove(minima_folder.joinpath('savgol.csv'), minima_folder.joinpath('minima.csv')))
+    timer.time('create arcs', lambda: create_arcs(Globals.FIRST_DAY, Globals.LAST_DAY, minima_df))
+
+    def transit_time_dataframes():
+        for s in args.speeds:
+            post_transit_times(route, s, TransitTimeDataframe(s, template_df, route.elapsed_time_csv_to_speed[s], Globals.TRANSIT_TIMES_FOLDER, Globals.FIRST_DAY, Globals.LAST_DAY, args.window))
+
+    timer.time('transit time dataframe', transit_time_dataframes, lambda: [remove(*[speed_folder(Globals.TRANSIT_TIMES_FOLDER, s).joinpath(name) for name in ['timesteps.csv', 'savgol.csv', 'minima.csv', 'transit_times.csv', 'rounded_transit_times.csv']]) for s in args.speeds])
+    timer.time('aggregate transit times', lambda: aggregate_transit_times(route))
+
+    adaptive_folder = folder.joinpath('adaptive')
+    edges = [(edge.start.folder.joinpath(Globals.EDGE_DATAFILE_NAME), edge.end.folder.joinpath(Globals.EDGE_DATAFILE_NAME), edge.length, False) for edge in route.edges]
+    adaptive = timer.time('adaptive transit time', lambda: [AdaptiveTransitTimeDataframe(s, template_df, edges, adaptive_folder, Globals.FIRST_DAY, Globals.LAST_DAY, args.window, args.stride) for s in args.speeds],
+                          lambda: [shutil.rmtree(adaptive_folder, ignore_errors=True)] + [speed_folder(adaptive_folder, s).mkdir(parents=True) for s in args.speeds])
+    adaptive_report(folder, args, timer.stages, adaptive, len(template_df))
+    return timer.stages
+
+
+#  the adaptive stage against the elapsed time and transit time stages it replaces, and its windows against theirs
+def adaptive_report(folder: Path, args, stages, adaptive, departures):
+    full = sum(stages[name]['min'] for name in ['elapsed time', 'aggregate elapsed times', 'transit time dataframe'])
+    stages['adaptive transit time']['speedup'] = round(full / max(stages['adaptive transit time']['min'], 1e-9), 2)
+    print(f'  adaptive speedup {stages["adaptive transit time"]["speedup"]}x')
+    for s, result in zip(args.speeds, adaptive):
+        minima = [read_cache(speed_folder(tt_folder, s).joinpath('minima.csv')) for tt_folder in [Globals.TRANSIT_TIMES_FOLDER, folder.joinpath('adaptive')]]
+        columns = ['start_datetime', 'min_datetime', 'end_datetime']
+        if len(minima[0]) == len(minima[1]):
+            times = [pd.to_datetime(m[c]) for m in minima for c in columns]
+            deviation = max([(abs(f - a)).max().total_seconds() if len(f) else 0.0 for f, a in zip(times[:3], times[3:])])
+            rounded = all((f.apply(round_datetime) == a.apply(round_datetime)).all() for f, a in zip(times[:3], times[3:]))
+        else:
+            deviation, rounded = None, False
+        stages['adaptive transit time'][str(s)] = {'evaluated': result.evaluated, 'departures': departures, 'max_deviation_seconds': deviation, 'rounded_match': rounded}
+        print(f'  {s} kts: {result.evaluated} of {departures} departures evaluated, {len(minima[1])} of {len(minima[0])} windows, '
+              f'max deviation {deviation} seconds, rounded times {"match" if rounded else "differ"}')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, stages):
+    print(f'\nCompared with {previous["commit"]} {previous["date"]}')
+    for name, result in stages.items():
+        if name in previous['stages']:
+            print(f'  {round(result["min"] / max(previous["stages"][name]["min"], 1e-9), 2):>8}x  {name}')
+
+
+if __name__ == '__main__':
+
+    ap = argParser(description='time every pipeline stage offline on synthetic tidal currents')
+    ap.add_argument('-e', '--edges', type=int, default=20)
+    ap.add_argument('-el', '--edge_length', type=float, default=1.0, help='nautical miles')
+    ap.add_argument('-d', '--days', type=int, default=30)
+    ap.add_argument('-md', '--margin_days', type=int, default=3, help='elapsed time days past the last day')
+    ap.add_argument('-y', '--year', type=int, default=2024)
+    ap.add_argument('-s', '--speeds', type=int, nargs='+', default=[3, 5, 7])
+    ap.add_argument('-w', '--window', type=int, default=MIDLINE_WINDOW, help='midline window in samples')
+    ap.add_argument('-r', '--repeats', type=int, default=3)
+    ap.add_argument('-as', '--stride', type=int, default=DEFAULT_STRIDE, help='departures between coarse evaluations of the adaptive stage')
+    ap.add_argument('-f32', '--float32', action='store_true')
+    ap.add_argument('-bc', '--binary_cache', action='store_true')
+    ap.add_argument('-lm', '--low_memory', action='store_true')
+    ap.add_argument('-o', '--output', type=Path, default=BENCHMARK_RESULTS, help='json lines file the run is appended to')
+    ap.add_argument('-k', '--keep', action='store_true', help='keep the synthetic project folder')
+    args = ap.parse_args()
+    args.dtype = 'float32' if args.float32 else None
+
+    if args.binary_cache:
+        enable_binary_cache()
+    if args.low_memory:
+        enable_low_memory()
+
+    folder = Path(tempfile.mkdtemp(prefix='transit_time_benchmark_'))
+    try:
+        stages = run_benchmarks(folder, args)
+    finally:
+        if not args.keep:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    record = {'commit': git_commit(), 'date': pd.Timestamp.now().isoformat(timespec='seconds'), 'machine': platform.node(),
+              'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+              'parameters': {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items() if k not in ['output', 'keep']},
+              'stages': stages}
+    previous = [json.loads(line) for line in args.output.read_text().splitlines() if line.strip()] if args.output.exists() else []
+    previous = [p for p in previous if p['parameters'] == record['parameters']]
+    if previous:
+        compare(previous[-1], stages)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'a') as file:
+        file.write(json.dumps(record) + '\n')
+    print(f'\nResults appended to {args.output}')
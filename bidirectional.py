@@ -0,0 +1,62 @@
+import contextlib
+
+from tt_gpx.gpx import Route, Edge
+from tt_globals.globals import Globals
+
+from transit_time import speed_folder
+
+#  The opposite passage of a route from the same downloads and spline fits. Edges are run end to start in reverse
+#  order with the current's sign flipped, their files go to a reverse folder under the edges and transit times folders.
+REVERSE_FOLDER = 'reverse'
+REVERSE_SUFFIX = '_reverse'
+
+
+def reverse_heading(heading): return (heading + 180) % 360
+
+
+class ReverseEdge:
+
+    def __init__(self, edge: Edge):
+        self.edge = edge
+        self.reverse = True
+        self.start = edge.end
+        self.end = edge.start
+        self.length = edge.length
+        self.unique_name = edge.unique_name + REVERSE_SUFFIX
+        self.folder = edge.folder.parent.joinpath(REVERSE_FOLDER, edge.folder.name)  # same column names in a separate aggregate
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+
+class ReverseRoute:  # the parts of a Route the edge and transit time stages use
+
+    def __init__(self, route: Route):
+        self.route = route
+        self.waypoints = list(reversed(route.waypoints))
+        self.edges = [ReverseEdge(edge) for edge in reversed(route.edges)]
+        self.location_name = route.location_name
+        self.location_code = route.location_code + REVERSE_SUFFIX
+        self.heading = reverse_heading(route.edge_path.route_heading)
+        self.elapsed_time_csv_to_speed = {}
+        self.transit_time_csv_to_speed = {}
+        self.rounded_transit_time_csv_to_speed = {}
+
+
+@contextlib.contextmanager
+def reversed_globals():  # the folders the elapsed and transit time stages read from Globals, workers never read them
+    edges_folder, transit_times_folder = Globals.EDGES_FOLDER, Globals.TRANSIT_TIMES_FOLDER
+    Globals.EDGES_FOLDER = edges_folder.joinpath(REVERSE_FOLDER)
+    Globals.TRANSIT_TIMES_FOLDER = transit_times_folder.joinpath(REVERSE_FOLDER)
+    for speed in Globals.BOAT_SPEEDS:
+        speed_folder(Globals.TRANSIT_TIMES_FOLDER, speed).mkdir(parents=True, exist_ok=True)
+    try:
+        yield
+    finally:
+        Globals.EDGES_FOLDER, Globals.TRANSIT_TIMES_FOLDER = edges_folder, transit_times_folder
+
+
+def reverse_route(route: Route):
+    reverse = ReverseRoute(route)
+    with reversed_globals():
+        Globals.TRANSIT_TIMES_FOLDER.joinpath(str(reverse.heading) + '.heading').touch()
+    print(f'reverse heading {reverse.heading}')
+    return reverse
@@ -0,0 +1,108 @@
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from tt_file_tools.file_tools import read_df, write_df, print_file_exists
+
+from instrumentation import section, cache_lookup
+
+#  Intermediate files are written as .npy record arrays when the binary cache is enabled.
+#  The choice lives in the environment so worker processes started by the job manager inherit it.
+BINARY_CACHE_VARIABLE = 'TT_BINARY_CACHE'
+
+
+def enable_binary_cache(): os.environ[BINARY_CACHE_VARIABLE] = '1'
+def binary_cache_enabled(): return os.environ.get(BINARY_CACHE_VARIABLE) == '1'
+
+
+#  Low memory mode stores every integer column in the smallest dtype that holds it, step counts fit in int16 or int32.
+#  It turns the binary cache on, elapsed times are aggregated into a memory mapped .npy and transit timesteps are read from one in chunks.
+#  Results are unchanged. Peak memory still grows with the departures, each edge job and MinimaFrame hold full-year 1-D arrays.
+LOW_MEMORY_VARIABLE = 'TT_LOW_MEMORY'
+
+
+def enable_low_memory():
+    os.environ[LOW_MEMORY_VARIABLE] = '1'
+    enable_binary_cache()
+def low_memory_enabled(): return os.environ.get(LOW_MEMORY_VARIABLE) == '1'
+
+
+def compact_frame(frame: pd.DataFrame):
+    for column in frame.columns:
+        if pd.api.types.is_integer_dtype(frame[column].dtype):
+            frame[column] = pd.to_numeric(frame[column], downcast='integer')
+    return frame
+
+
+def csv_path(path): return Path(path).with_suffix('.csv')
+def binary_path(path): return Path(path).with_suffix('.npy')
+def cache_path(path): return binary_path(path) if binary_cache_enabled() else csv_path(path)
+
+
+def existing_cache_path(path):
+    candidates = [binary_path(path), csv_path(path)] if binary_cache_enabled() else [csv_path(path), binary_path(path)]
+    return next((p for p in candidates if p.exists()), None)
+
+
+def cache_exists(path):
+    existing = existing_cache_path(path)
+    return cache_lookup(print_file_exists(existing if existing else cache_path(path)))
+
+
+def frame_to_records(frame: pd.DataFrame):
+    columns = {}
+    for column in frame.columns:
+        values = frame[column].to_numpy()
+        columns[str(column)] = values.astype(str) if values.dtype == object else values  # column names as in csv
+    records = np.empty(len(frame), dtype=[(name, values.dtype) for name, values in columns.items()])
+    for name, values in columns.items():
+        records[name] = values
+    return records
+
+
+def records_to_frame(records): return pd.DataFrame({name: records[name] for name in records.dtype.names})
+
+
+def load_records(path, mmap=True, save=True):  # memory mapped record array, csv caches are converted on first use when the binary cache is on
+    existing = existing_cache_path(path)
+    if existing is None:
+        raise FileNotFoundError(cache_path(path))
+    if existing.suffix == '.csv':
+        frame = read_df(existing)
+        records = frame_to_records(compact_frame(frame) if low_memory_enabled() else frame)
+        if not save or not binary_cache_enabled():
+            return records  # in memory, nothing is written next to the csv
+        np.save(binary_path(path), records)
+    return np.load(binary_path(path), mmap_mode='r' if mmap else None)
+
+
+def read_cache(path):
+    with section('read'):
+        return read_cache_file(path)
+
+
+def read_cache_file(path):
+    existing = existing_cache_path(path)
+    if existing is None:
+        raise FileNotFoundError(cache_path(path))
+    frame = records_to_frame(np.load(existing)) if existing.suffix == '.npy' else read_df(existing)
+    if low_memory_enabled():
+        frame = compact_frame(frame)
+    if existing.suffix == '.csv' and binary_cache_enabled():
+        np.save(binary_path(path), frame_to_records(frame))
+    return frame
+
+
+def write_cache(frame: pd.DataFrame, path):
+    with section('write'):
+        return write_cache_file(frame, path)
+
+
+def write_cache_file(frame: pd.DataFrame, path):
+    if low_memory_enabled():
+        frame = compact_frame(frame.copy(deep=False))
+    if binary_cache_enabled():
+        np.save(binary_path(path), frame_to_records(frame))
+        return binary_path(path)
+    return write_df(frame, csv_path(path))
@@ -1,12 +1,17 @@
+import os
 import numpy as np
 import pandas as pd
 from pathlib import Path
 
 from tt_gpx.gpx import Edge, Route
 from tt_date_time_tools.date_time_tools import index_to_date
-from tt_job_manager.job_manager import Job
 from tt_globals.globals import Globals
-from tt_file_tools.file_tools import print_file_exists, read_df, write_df
+from tt_file_tools.file_tools import print_file_exists
+
+from binary_cache import cache_exists, read_cache, write_cache, low_memory_enabled, binary_path, records_to_frame
+from shared_buffers import SharedArray, SharedBufferRegistry, attach
+from instrumentation import MeasuredJob, section, as_completed
+from extension import PreviousRun, index_offset, shifted, reusable, elapsed_time_seed
 
 
 #  Elapsed times are reported in number of timesteps
@@ -22,69 +27,220 @@ def elapsed_time(distance_start_index, distances, length):  # returns number of
     return count  # count = number of time steps
 
 
-class ElapsedTimeDataframe:
+#  Vectorized version of elapsed_time for every departure index at once
+def elapsed_times(distances, length, departures):  # returns array of number of timesteps
+    return elapsed_times_at(distances, length, np.arange(departures))
+
+
+def elapsed_times_at(distances, length, positions, travelled=None):  # elapsed_times for the departures at these positions only
+    if length <= 0:
+        return np.ones(len(positions), dtype=int)  # the loop always takes at least one step
+    if travelled is None:  # summed in float64, a year of float32 distances loses the sub-step precision the lookup needs
+        travelled = np.cumsum(np.abs(distances), dtype=np.float64)  # travelled[i] - travelled[j] = distance covered from j+1 through i
+    start = travelled[positions]
+    arrival = np.searchsorted(travelled, start + length, side='left')  # first index where total >= length
+    arrival = np.maximum(arrival, positions + 1)
+    past = arrival >= len(distances)
+    arrival = np.minimum(arrival, len(distances) - 1)
+    counts = arrival - positions
+
+    # cumulative sums round differently than the running total in elapsed_time, re-check departures on the boundary
+    tolerance = 1e-9 * max(travelled[-1], length)
+    covered = travelled[arrival] - start
+    before = travelled[arrival - 1] - start
+    suspect = (np.abs(covered - length) <= tolerance) | (np.abs(before - length) <= tolerance)
+    if (past & ~suspect).any():
+        raise IndexError('elapsed time runs past the end of the distance array')
+    for i in np.flatnonzero(suspect):
+        counts[i] = elapsed_time(positions[i], distances, length)
+    return counts
+
+
+class ElapsedTimeDataframe:  # elapsed timesteps of an edge at one speed, the files are written by MultiSpeedElapsedTimeDataframe
 
     @staticmethod
     def distance(water_vf, water_vi, boat_speed, ts_in_hr):
         return ((water_vf + water_vi) / 2 + boat_speed) * ts_in_hr  # distance is nm
 
-    def __init__(self, folder: Path, init_velos, final_velos, edge_range, length, speed):
+    @staticmethod
+    def timesteps(init_velos, final_velos, edge_range, length, speed, positions=None):
+        dist = ElapsedTimeDataframe.distance(final_velos[1:], init_velos[:-1], speed, Globals.TIMESTEP / 3600)
+        # noinspection PyTypeChecker
+        dist = np.insert(dist, 0, 0.0)  # distance uses an offset calculation VIx, VFx+1, need a zero at the beginning
+        if positions is not None:
+            return elapsed_times_at(dist, length, positions)
+        return elapsed_times(dist, length, len(edge_range))
+
+    @staticmethod
+    def filename(folder: Path, speed): return folder.name + '_' + str(speed) + '.csv'
+
+
+def edge_velocities(source): return attach(source) if isinstance(source, SharedArray) else read_cache(source)['velocity'].to_numpy()
+
+
+#  counts of the earlier run where the velocities of the whole trip are unchanged, the other departures computed
+def seeded_timesteps(init_velos, final_velos, edge_range, length, speed, seed, velocity_offset, unchanged):
+    old_frame = read_cache(seed[2][speed])
+    offset = index_offset(edge_range, old_frame['departure_index'].to_numpy())
+    if offset is None or offset != velocity_offset:
+        return ElapsedTimeDataframe.timesteps(init_velos, final_velos, edge_range, length, speed)
+    reuse, counts = reusable(unchanged, old_frame.iloc[:, -1].to_numpy(), offset, len(edge_range))
+    counts = counts.astype(int)
+    positions = np.flatnonzero(~reuse)
+    counts[positions] = ElapsedTimeDataframe.timesteps(init_velos, final_velos, edge_range, length, speed, positions)
+    return counts
+
+
+def unchanged_velocities(init_velos, final_velos, seed, download_start):  # offset of the earlier velocities and where both ends are equal
+    old_init, old_final = read_cache(seed[0]), read_cache(seed[1])
+    offset = index_offset(download_start, old_init['date_index'].to_numpy())
+    if offset is None:
+        return None, None
+    init, init_known = shifted(old_init['velocity'].to_numpy(), offset, len(init_velos))
+    final, final_known = shifted(old_final['velocity'].to_numpy(), offset, len(final_velos))
+    return offset, init_known & final_known & (init == init_velos) & (final == final_velos)
+
+
+#  all speeds for one edge, velocities are read once in the worker and the result is a speed x departure array
+#  reverse is the opposite passage, a current that helps one way hinders the other
+#  seed is the same edge in an earlier run, its counts are copied where the trip's velocities have not changed
+class MultiSpeedElapsedTimeDataframe:
+
+    def __init__(self, folder: Path, init_file, final_file, edge_range, length, speeds, reverse=False, seed=None, download_start=None):
+
+        edge_range = attach(edge_range)
+        self.filepaths = {s: folder.joinpath(ElapsedTimeDataframe.filename(folder, s)) for s in speeds}
+        missing = [s for s in speeds if not cache_exists(self.filepaths[s])]
+
+        if missing:
+            init_velos = edge_velocities(init_file)
+            final_velos = edge_velocities(final_file)
+            if reverse:
+                init_velos, final_velos = -init_velos, -final_velos
+            offset = unchanged = None
+            if seed and not reverse and seed[3] == length:
+                offset, unchanged = unchanged_velocities(init_velos, final_velos, seed, download_start)
+            with section('elapsed time'):
+                timesteps = np.vstack([seeded_timesteps(init_velos, final_velos, edge_range, length, s, seed, offset, unchanged) if offset is not None and s in seed[2]
+                                       else ElapsedTimeDataframe.timesteps(init_velos, final_velos, edge_range, length, s) for s in missing])
+            template = pd.DataFrame(data={'departure_index': edge_range, 'date_time': index_to_date(edge_range)})
+            for s, row in zip(missing, timesteps):
+                frame = template.assign(**{ElapsedTimeDataframe.filename(folder, s): row})
+                self.filepaths[s] = write_cache(frame, self.filepaths[s])
+                print_file_exists(self.filepaths[s])
+
+
+class MultiSpeedElapsedTimeJob(MeasuredJob):  # super -> job name, result key, function/object, arguments
 
-        self.filepath = None
-        filename = folder.name + '_' + str(speed) + '.csv'
-        filepath = folder.joinpath(filename)
+    def execute(self): return super().execute()
+    def execute_callback(self, result): return super().execute_callback(result)
+    def error_callback(self, result): return super().error_callback(result)
 
-        if print_file_exists(filepath):
-            self.filepath = filepath
+    def __init__(self, edge: Edge, speeds, registry: SharedBufferRegistry = None, prefix='', seed=None):
+        job_name = edge.unique_name + ' ' + str(round(edge.length, 3)) + ' ' + str(speeds)
+        result_key = prefix + edge.unique_name + '_speeds'  # prefixed when several routes share the job manager
+        init_file = edge.start.folder.joinpath(Globals.EDGE_DATAFILE_NAME)
+        final_file = edge.end.folder.joinpath(Globals.EDGE_DATAFILE_NAME)
+        edge_range = Globals.ELAPSED_TIME_INDEX_RANGE
+        if registry:  # velocities of a node shared by two edges and the index range are published once
+            init_file = registry.publish(init_file, lambda: edge_velocities(init_file))  # read only for the first edge at a node
+            final_file = registry.publish(final_file, lambda: edge_velocities(final_file))
+            edge_range = registry.publish(('elapsed time index range', Globals.YEAR), edge_range)
+        arguments = tuple([edge.folder, init_file, final_file, edge_range, edge.length, speeds, getattr(edge, 'reverse', False), seed, Globals.DOWNLOAD_INDEX_RANGE[:2]])
+        super().__init__(job_name, result_key, MultiSpeedElapsedTimeDataframe, arguments)
+
+
+def elapsed_times_path(speed): return Globals.EDGES_FOLDER.joinpath('elapsed_timesteps_' + str(speed) + '.csv')
+
+
+#  each edge column is copied once into a preallocated departures x edges array, in edge path order
+#  low memory mode fills a memory mapped record array on disk instead, write only renames it into place
+class ElapsedTimeAggregator:
+
+    def __init__(self, route: Route, speed):
+        self.filepath = elapsed_times_path(speed)
+        self.template = Globals.TEMPLATE_ELAPSED_TIME_DATAFRAME
+        self.departures = self.template['departure_index'].to_numpy()
+        self.columns = [ElapsedTimeDataframe.filename(edge.folder, speed) for edge in route.edges]
+        self.filled = np.zeros(len(self.columns), dtype=bool)
+        if low_memory_enabled():
+            self.partial_path = Path(str(binary_path(self.filepath)) + '.part')  # renamed once every column is in, so a crash leaves no cache behind
+            dtype = [(name, self.template[name].dtype) for name in self.template.columns] + [(column, np.int32) for column in self.columns]
+            self.records = np.lib.format.open_memmap(self.partial_path, mode='w+', dtype=dtype, shape=(len(self.departures),))
+            for name in self.template.columns:
+                self.records[name] = self.template[name].to_numpy()
+        else:
+            self.values = np.empty((len(self.departures), len(self.columns)), dtype=int)
+
+    def add(self, position, path):
+        frame = read_cache(path)
+        if not np.array_equal(frame['departure_index'].to_numpy(), self.departures):
+            raise ValueError(f'{path} departures do not match the elapsed time template')
+        if low_memory_enabled():
+            self.records[self.columns[position]] = frame[self.columns[position]].to_numpy()
         else:
-            frame = pd.DataFrame(data={'departure_index': edge_range, 'date_time': index_to_date(edge_range)})
-            dist = ElapsedTimeDataframe.distance(final_velos[1:], init_velos[:-1], speed, Globals.TIMESTEP / 3600)
-            # noinspection PyTypeChecker
-            dist = np.insert(dist, 0, 0.0)  # distance uses an offset calculation VIx, VFx+1, need a zero at the beginning
-            frame[filename] = [elapsed_time(i, dist, length) for i in range(len(edge_range))]
-            self.filepath = write_df(frame, filepath)
-            print_file_exists(self.filepath)
+            self.values[:, position] = frame[self.columns[position]].to_numpy()
+        self.filled[position] = True
 
+    def check(self):
+        if not self.filled.all():
+            raise ValueError(f'missing elapsed times for {[c for c, f in zip(self.columns, self.filled) if not f]}')
 
-class ElapsedTimeJob(Job):  # super -> job name, result key, function/object, arguments
+    def frame(self):
+        self.check()
+        if low_memory_enabled():
+            return records_to_frame(self.records)
+        return pd.concat([self.template, pd.DataFrame(self.values, columns=self.columns, index=self.template.index)], axis=1)
+
+    def write(self):
+        if not low_memory_enabled():
+            return write_cache(self.frame(), self.filepath)
+        self.check()
+        self.records.flush()
+        del self.records
+        os.replace(self.partial_path, binary_path(self.filepath))
+        return binary_path(self.filepath)
 
-    def execute(self): return super().execute()
-    def execute_callback(self, result): return super().execute_callback(result)
-    def error_callback(self, result): return super().error_callback(result)
 
-    def __init__(self, edge: Edge, speed):
-        job_name = edge.unique_name + ' ' + str(round(edge.length, 3)) + ' ' + str(speed)
-        result_key = edge.unique_name + '_' + str(speed)
-        start_velocity = read_df(edge.start.folder.joinpath(Globals.EDGE_DATAFILE_NAME))
-        init_velo = start_velocity['velocity'].to_numpy()
-        end_velocity = read_df(edge.end.folder.joinpath(Globals.EDGE_DATAFILE_NAME))
-        final_velo = end_velocity['velocity'].to_numpy()
-        arguments = tuple([edge.folder, init_velo, final_velo, Globals.ELAPSED_TIME_INDEX_RANGE, edge.length, speed])
-        super().__init__(job_name, result_key, ElapsedTimeDataframe, arguments)
+def aggregate_elapsed_times(route: Route, speed, paths):
+    aggregator = ElapsedTimeAggregator(route, speed)
+    for position, path in enumerate(paths):
+        aggregator.add(position, path)
+    write_elapsed_times(route, speed, aggregator)
 
 
-def edge_processing(route: Route, job_manager):
+def write_elapsed_times(route: Route, speed, aggregator: ElapsedTimeAggregator):
+    print(f'\nAggregating elapsed timesteps at {speed} kts into a dataframe', flush=True)
+    print_file_exists(aggregator.write())
+    post_elapsed_times(route, speed)
+
+
+def post_elapsed_times(route: Route, speed):
+    print(f'Posting elapsed times paths to route for speed {speed}')
+    route.elapsed_time_csv_to_speed[speed] = elapsed_times_path(speed)
+
+
+def edge_processing(route: Route, job_manager, registry: SharedBufferRegistry = None, previous: PreviousRun = None):
 
     print(f'\nCreating template elapsed time dataframe')
 
+    speeds = []
     for s in Globals.BOAT_SPEEDS:
-        print(f'\nCalculating elapsed timesteps for edges at {s} kts')
-        speed_path = Globals.EDGES_FOLDER.joinpath('elapsed_timesteps_'+str(s) + '.csv')
-
-        if not print_file_exists(speed_path):
-            elapsed_time_df = Globals.TEMPLATE_ELAPSED_TIME_DATAFRAME.copy(deep=True)
-            keys = [job_manager.put(ElapsedTimeJob(edge, s)) for edge in route.edges]
-            # for edge in route.edges:
-            #     job = ElapsedTimeJob(edge, s)
-            #     result = job.execute()
-            job_manager.wait()
-
-            print(f'\nAggregating elapsed timesteps at {s} kts into a dataframe', flush=True)
-            for path in [job_manager.get(key).filepath for key in keys]:
-                elapsed_time_df = elapsed_time_df.merge(read_df(path).drop(['date_time'], axis=1), on='departure_index')
-
-            write_df(elapsed_time_df, speed_path)
-            print_file_exists(speed_path)
-
-        print(f'Posting elapsed times paths to route for speed {s}')
-        route.elapsed_time_csv_to_speed[s] = speed_path
+        if cache_exists(elapsed_times_path(s)):
+            post_elapsed_times(route, s)
+        else:
+            speeds.append(s)
+
+    if speeds:
+        print(f'\nCalculating elapsed timesteps for edges at {speeds} kts')
+        seeds = [elapsed_time_seed(previous, position, speeds) if previous else None for position in range(len(route.edges))]
+        jobs = [MultiSpeedElapsedTimeJob(edge, speeds, registry, seed=seed) for edge, seed in zip(route.edges, seeds)]
+        # for edge in route.edges:
+        #     job = MultiSpeedElapsedTimeJob(edge, speeds)
+        #     result = job.execute()
+        aggregators = {s: ElapsedTimeAggregator(route, s) for s in speeds}
+        for position, result in as_completed(job_manager, jobs):  # each edge's columns are filled while the other edges run
+            for s in speeds:
+                aggregators[s].add(position, result.filepaths[s])
+        for s in speeds:
+            write_elapsed_times(route, s, aggregators[s])
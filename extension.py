@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from tt_noaa_data.noaa_data import noaa_current_dataframe
+from tt_file_tools.file_tools import read_df
+from tt_globals.globals import Globals
+
+from binary_cache import existing_cache_path
+from station_cache import StationCache
+from route_setup import initialize_globals, build_route, GlobalsState
+
+#  A run seeded from an earlier run of the same route, another year or a window that overlaps it. Downloads fetch
+#  only the days the earlier run does not have, and spline fits, elapsed times and transit timesteps copy every value
+#  whose inputs are unchanged. Only the new range and the seams near the ends of the earlier run are computed.
+#  The midline and minima are O(n) and are recomputed whole, so windows across the seam come out as in a cold run.
+SEAM = pd.Timedelta(days=2)  # spline values this close to an end of the earlier download are fitted again
+
+
+def index_offset(new_index, old_index):  # old position of new position 0, None when the grids do not line up
+    new_index, old_index = np.asarray(new_index), np.asarray(old_index)
+    if len(new_index) < 2 or len(old_index) < 2:
+        return None
+    step = new_index[1] - new_index[0]
+    if old_index[1] - old_index[0] != step or (new_index[0] - old_index[0]) % step:
+        return None
+    return int((new_index[0] - old_index[0]) // step)
+
+
+def shifted(old_values, offset, length):  # old values at the new positions and where there are any
+    values = np.zeros(length, dtype=np.asarray(old_values).dtype)
+    known = np.zeros(length, dtype=bool)
+    first, last = max(0, -offset), min(length, len(old_values) - offset)
+    if first < last:
+        values[first:last] = old_values[first + offset:last + offset]
+        known[first:last] = True
+    return values, known
+
+
+def unchanged_spans(unchanged, positions, lengths):  # whether every position from each start through start + length is unchanged
+    changed = np.concatenate(([0], np.cumsum(~unchanged)))
+    ends = positions + lengths + 1
+    inside = ends <= len(unchanged)
+    ends = np.minimum(ends, len(unchanged))
+    return inside & (changed[ends] == changed[positions])
+
+
+def reusable(unchanged, old_counts, offset, length):  # new positions whose earlier count covers unchanged input only
+    counts, known = shifted(old_counts, offset, length)
+    positions = np.arange(length)
+    reuse = known & unchanged_spans(unchanged, positions, np.where(known, counts, 0).astype(np.int64))
+    return reuse, counts
+
+
+#  ---------- DOWNLOADS ----------
+
+#  station frames from the downloads of the earlier run, only the days it does not have are fetched
+class ExtendedStations:
+
+    def __init__(self, previous_downloads: dict, station_cache: StationCache = None):
+        self.previous_downloads = previous_downloads  # code -> orig_velocity_download.csv of the earlier run
+        self.station_cache = station_cache
+
+    def __contains__(self, item): return item[0] in self.previous_downloads or (self.station_cache is not None and item in self.station_cache)
+
+    def put(self, code, fdd, ldd, frame): return self.station_cache.put(code, fdd, ldd, frame) if self.station_cache else None
+
+    def fetch(self, code, fdd, ldd):
+        print(f'downloading {code} {pd.Timestamp(fdd).date()} to {pd.Timestamp(ldd).date()}', flush=True)
+        return self.station_cache.frame(code, fdd, ldd) if self.station_cache else noaa_current_dataframe(fdd, ldd, code)
+
+    def frame(self, code, fdd, ldd):
+        path = self.previous_downloads.get(code)
+        if path is None or not Path(path).exists():
+            return self.fetch(code, fdd, ldd)
+        previous = read_df(path).drop(columns=['date_index'], errors='ignore')
+        days = pd.to_datetime(previous['Time']).dt.normalize()
+        first, last = pd.Timestamp(fdd).normalize(), pd.Timestamp(ldd).normalize()
+        frames = [previous[(days >= first) & (days <= last)]]
+        if days.min() > first:
+            frames.insert(0, self.fetch(code, first, min(days.min() - pd.Timedelta(days=1), last)))
+        if days.max() < last:
+            frames.append(self.fetch(code, max(days.max() + pd.Timedelta(days=1), first), last))
+        return pd.concat(frames).drop_duplicates('Time').reset_index(drop=True)
+
+
+#  ---------- SPLINE FITS ----------
+
+#  positions of the index the earlier fit already has, the knots of both downloads are equal between the common first
+#  and last knot and a fit is only disturbed within a few knots of a change in its ends
+def trusted_positions(index, old_knots, new_knots):
+    seam = SEAM.total_seconds()
+    first = max(old_knots[0], new_knots[0]) + (seam if old_knots[0] != new_knots[0] else 0)
+    last = min(old_knots[-1], new_knots[-1]) - (seam if old_knots[-1] != new_knots[-1] else 0)
+    return (index >= first) & (index <= last)
+
+
+def runs(mask):  # first and last position of every run of True
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return list(zip(edges[::2], edges[1::2] - 1))
+
+
+#  ---------- THE EARLIER RUN ----------
+
+class PreviousRun:  # the route and folders of the earlier run, built with its own Globals and then put back
+
+    def __init__(self, args: dict, year):
+        state = GlobalsState()
+        initialize_globals(dict(args, year=year, window_start=None, delete_data=False, dry_run=False))  # the earlier run is only read
+        self.year = year
+        self.route = build_route(dict(args, year=year))
+        self.edges_folder = Globals.EDGES_FOLDER
+        self.transit_times_folder = Globals.TRANSIT_TIMES_FOLDER
+        state.restore()
+
+    def downloads(self):  # station code -> download of the earlier run
+        from noaa_downloads import download_waypoints
+
+        return {wp.code: wp.folder.joinpath('orig_velocity_download.csv') for wp in download_waypoints(self.route)
+                if wp.folder.joinpath('orig_velocity_download.csv').exists()}
+
+    def waypoint(self, position): return self.route.waypoints[position]
+    def edge(self, position): return self.route.edges[position]
+
+
+def spline_seed(previous: PreviousRun, position):  # earlier velocity knots and spline fit of the waypoint at this position
+    wp = previous.waypoint(position)
+    knots, spline = wp.folder.joinpath(Globals.WAYPOINT_DATAFILE_NAME), wp.folder.joinpath(Globals.EDGE_DATAFILE_NAME)
+    return (knots, spline) if knots.exists() and existing_cache_path(spline) else None
+
+
+def elapsed_time_seed(previous: PreviousRun, position, speeds):  # earlier spline fits of both ends and edge files by speed
+    from elapsed_time import ElapsedTimeDataframe
+
+    edge = previous.edge(position)
+    init_file = edge.start.folder.joinpath(Globals.EDGE_DATAFILE_NAME)
+    final_file = edge.end.folder.joinpath(Globals.EDGE_DATAFILE_NAME)
+    files = {s: edge.folder.joinpath(ElapsedTimeDataframe.filename(edge.folder, s)) for s in speeds}
+    files = {s: f for s, f in files.items() if existing_cache_path(f)}
+    if not files or not existing_cache_path(init_file) or not existing_cache_path(final_file):
+        return None
+    return init_file, final_file, files, edge.length
+
+
+def transit_time_seed(previous: PreviousRun, speed):  # earlier aggregate elapsed times and transit timesteps
+    from transit_time import speed_folder
+
+    et_file = previous.edges_folder.joinpath('elapsed_timesteps_' + str(speed) + '.csv')
+    timesteps_file = speed_folder(previous.transit_times_folder, speed).joinpath('timesteps.csv')
+    return (et_file, timesteps_file) if existing_cache_path(et_file) and existing_cache_path(timesteps_file) else None
+
+
+#  ---------- WINDOWS ----------
+
+def window_project_name(project_name, start, months): return project_name + '_' + pd.Timestamp(start).strftime('%Y-%m-%d') + '_' + str(months) + 'm'
+
+
+#  Globals of a window of months from a start day, built from the calendar year Globals by moving every date and
+#  index range that hangs off the first day by the change of the first day and every one off the last day by the
+#  change of the last day, so the padding around the window is the same as around a year
+def window_globals(start, months):
+    start = pd.Timestamp(start)
+    first_shift = start - pd.Timestamp(Globals.FIRST_DAY)
+    last_shift = start + pd.DateOffset(months=months) - pd.Timedelta(days=1) - pd.Timestamp(Globals.LAST_DAY)
+
+    def moved(index):
+        index = np.asarray(index)
+        step = index[1] - index[0]
+        return np.arange(index[0] + int(first_shift.total_seconds()), index[-1] + int(last_shift.total_seconds()) + step, step, dtype=index.dtype)
+
+    def moved_day(day, shift):
+        day_moved = pd.Timestamp(day) + shift
+        return day_moved if isinstance(day, pd.Timestamp) else day_moved.to_pydatetime()
+
+    for name in ['FIRST_DAY', 'FIRST_DOWNLOAD_DAY']:
+        setattr(Globals, name, moved_day(getattr(Globals, name), first_shift))
+    for name in ['LAST_DAY', 'LAST_DOWNLOAD_DAY']:
+        setattr(Globals, name, moved_day(getattr(Globals, name), last_shift))
+    for name, shift in [('FIRST_DAY_DATE', first_shift), ('LAST_DAY_DATE', last_shift)]:
+        if hasattr(Globals, name):
+            setattr(Globals, name, (pd.Timestamp(getattr(Globals, name)) + shift).date())
+
+    Globals.NORMALIZED_DOWNLOAD_INDICES = moved(Globals.NORMALIZED_DOWNLOAD_INDICES)
+    Globals.NORMALIZED_DOWNLOAD_DATES = pd.to_datetime(Globals.NORMALIZED_DOWNLOAD_INDICES, unit='s')
+    Globals.DOWNLOAD_INDEX_RANGE = moved(Globals.DOWNLOAD_INDEX_RANGE)
+    Globals.ELAPSED_TIME_INDEX_RANGE = moved(Globals.ELAPSED_TIME_INDEX_RANGE)
+    for name in ['TEMPLATE_ELAPSED_TIME_DATAFRAME', 'TEMPLATE_TRANSIT_TIME_DATAFRAME']:
+        index = moved(getattr(Globals, name)['departure_index'])
+        setattr(Globals, name, pd.DataFrame({'departure_index': index, 'date_time': pd.to_datetime(index, unit='s')}))
+    print(f'window {Globals.FIRST_DAY} to {Globals.LAST_DAY}')
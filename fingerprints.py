@@ -0,0 +1,107 @@
+import json
+import hashlib
+from pathlib import Path
+
+from tt_gpx.gpx import Route, InterpolatedWP, EdgeNode
+from tt_globals.globals import Globals
+
+from binary_cache import csv_path, binary_path, existing_cache_path
+from elapsed_time import ElapsedTimeDataframe, elapsed_times_path
+from transit_time import speed_folder, MIDLINE_WINDOW
+from noaa_downloads import download_waypoints
+from startup import package_version
+
+FINGERPRINT_FILE = 'fingerprints.json'
+#  tt packages whose code shapes each kind of file, an upgrade rebuilds those files and the ones built from them
+VELOCITY_PACKAGES = ['tt_noaa_data', 'tt_gpx', 'tt_date_time_tools', 'tt_file_tools']
+ELAPSED_PACKAGES = ['tt_globals', 'tt_gpx']
+TRANSIT_PACKAGES = ['tt_globals', 'tt_geometry', 'tt_date_time_tools', 'tt_file_tools']
+
+
+def fingerprint(*parts): return hashlib.sha256(repr(parts).encode()).hexdigest()[:16]
+
+
+def index_span(index_range): return int(index_range[0]), int(index_range[-1]), len(index_range)
+
+
+class Artifact:
+
+    def __init__(self, name, paths, key):
+        self.name = name
+        self.paths = paths  # files rebuilt together, either cache format
+        self.key = key
+
+    def files(self): return [p for path in self.paths for p in dict.fromkeys([csv_path(path), binary_path(path), Path(path)]) if p.exists()]
+    def complete(self): return all(existing_cache_path(path) for path in self.paths)
+
+
+#  every file a route produces keyed by a hash of its inputs, a key includes the keys of the files it is built from
+#  so moving one waypoint changes its velocity files, the edges that end on it and the per speed aggregates only
+class RouteFingerprints:
+
+    def __init__(self, route: Route, window=MIDLINE_WINDOW, dtype=None, adaptive=None):
+
+        self.filepath = Globals.TRANSIT_TIMES_FOLDER.joinpath(FINGERPRINT_FILE)
+        self.stored = json.loads(self.filepath.read_text()) if self.filepath.exists() else {}
+        self.artifacts = []
+        versions = {name: package_version(name) for name in set(VELOCITY_PACKAGES + ELAPSED_PACKAGES + TRANSIT_PACKAGES)}
+        velocity_versions, elapsed_versions, transit_versions = [[versions[name] for name in names] for names in [VELOCITY_PACKAGES, ELAPSED_PACKAGES, TRANSIT_PACKAGES]]
+
+        velocity = {}
+        for wp in download_waypoints(route):
+            velocity[wp] = self.add('velocity ' + wp.unique_name, [wp.folder.joinpath(Globals.WAYPOINT_DATAFILE_NAME), wp.folder.joinpath('orig_velocity_download.csv')],
+                                    wp.code, wp.lat, wp.lon, Globals.YEAR, str(Globals.FIRST_DOWNLOAD_DAY), str(Globals.LAST_DOWNLOAD_DAY), velocity_versions)
+        for iwp in filter(lambda w: isinstance(w, InterpolatedWP), route.waypoints):
+            velocity[iwp] = self.add('velocity ' + iwp.unique_name, [iwp.folder.joinpath(Globals.WAYPOINT_DATAFILE_NAME)],
+                                     iwp.lat, iwp.lon, [velocity[wp] for wp in iwp.data_waypoints])
+
+        spline = {wp: self.add('spline ' + wp.unique_name, [wp.folder.joinpath(Globals.EDGE_DATAFILE_NAME)],
+                               velocity[wp], index_span(Globals.DOWNLOAD_INDEX_RANGE), Globals.TIMESTEP, str(dtype))
+                  for wp in filter(lambda w: isinstance(w, EdgeNode), route.waypoints)}
+
+        track = self.add if not adaptive else lambda name, paths, *parts: fingerprint(*parts)  # adaptive runs write no elapsed time or timesteps files
+        for speed in Globals.BOAT_SPEEDS:
+            edges = [track('elapsed time ' + edge.unique_name + ' ' + str(speed), [edge.folder.joinpath(ElapsedTimeDataframe.filename(edge.folder, speed))],
+                           spline[edge.start], spline[edge.end], round(edge.length, 6), speed, index_span(Globals.ELAPSED_TIME_INDEX_RANGE), Globals.TIMESTEP, elapsed_versions)
+                     for edge in route.edges]
+            elapsed_times = track('elapsed times ' + str(speed), [elapsed_times_path(speed)], edges)
+            folder = speed_folder(Globals.TRANSIT_TIMES_FOLDER, speed)
+            timesteps = track('timesteps ' + str(speed), [folder.joinpath('timesteps.csv')], elapsed_times)
+            # adaptive transit times share the file names of a full run, switching between them rebuilds the files
+            savgol = 'adaptive_savgol.csv' if adaptive else 'savgol.csv'
+            self.add('transit times ' + str(speed), [folder.joinpath(name) for name in [savgol, 'minima.csv', 'transit_times.csv', 'rounded_transit_times.csv']],
+                     timesteps, window, str(Globals.FIRST_DAY), str(Globals.LAST_DAY), Globals.TIME_WINDOW_SCALE_FACTOR, transit_versions,
+                     *(['adaptive', adaptive] if adaptive else []))
+
+    def add(self, name, paths, *parts):
+        key = fingerprint(*parts)
+        self.artifacts.append(Artifact(name, paths, key))
+        return key
+
+    def status(self, artifact):
+        if not artifact.files():
+            return 'missing'
+        if self.stored.get(artifact.name, artifact.key) != artifact.key:  # files from before fingerprints are adopted as they are
+            return 'stale'
+        return 'current' if artifact.complete() else 'missing'
+
+    def outdated(self): return [(a, self.status(a)) for a in self.artifacts if self.status(a) != 'current']
+
+    def invalidate(self):  # removes stale files so the usual exists checks rebuild them
+        stale = [a for a, status in self.outdated() if status == 'stale']
+        for artifact in stale:
+            for file in artifact.files():
+                file.unlink()
+        return stale
+
+    def save(self):
+        self.stored.update({a.name: a.key for a in self.artifacts if a.files()})
+        self.filepath.write_text(json.dumps(self.stored, indent=1, sort_keys=True))
+        return self.filepath
+
+
+def print_dry_run(route: Route, fingerprints: RouteFingerprints):
+    outdated = fingerprints.outdated()
+    print(f'\n{route.location_code}: {len(outdated)} of {len(fingerprints.artifacts)} files would be recomputed')
+    for artifact, status in outdated:
+        print(f'  {status:>8}  {artifact.name}')
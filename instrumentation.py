@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import contextlib
+import traceback
+import pandas as pd
+from pathlib import Path
+from multiprocessing import Manager
+
+from tt_job_manager.job_manager import Job
+from tt_file_tools.file_tools import write_df, print_file_exists
+
+from shared_buffers import peak_memory
+
+#  Wall time, cpu time, peak memory, bytes read and written and cache hits for every stage in the main process
+#  and every job in the workers. Each measurement is a few clock and /proc reads, cheap enough to leave on.
+IO_FILE = Path('/proc/self/io')
+
+
+def io_bytes():  # bytes this process has read and written, linux only
+    try:
+        fields = dict(line.split(': ') for line in IO_FILE.read_text().splitlines())
+        return int(fields['rchar']), int(fields['wchar'])
+    except OSError:
+        return None, None
+
+
+class Measurement:
+
+    def __init__(self, name):
+        self.name = name
+        self.sections = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.read, self.written = io_bytes()
+
+    def finish(self):
+        read, written = io_bytes()
+        return {'name': self.name, 'pid': os.getpid(),
+                'wall': round(time.perf_counter() - self.wall, 4), 'cpu': round(time.process_time() - self.cpu, 4),
+                'peak_rss_mb': peak_memory()[0],  # peak of the whole process so far, a worker's peak is its largest job
+                'bytes_read': read - self.read if read is not None else None,
+                'bytes_written': written - self.written if written is not None else None,
+                'cache_hits': self.cache_hits, 'cache_misses': self.cache_misses,
+                'sections': {name: round(seconds, 4) for name, seconds in self.sections.items()}}
+
+
+active = []  # measurements open in this process, innermost last
+
+
+def cache_lookup(hit):
+    for measurement in active:
+        if hit:
+            measurement.cache_hits += 1
+        else:
+            measurement.cache_misses += 1
+    return hit
+
+
+@contextlib.contextmanager
+def section(name):  # time inside a job or stage, summed by name
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if active:
+            active[-1].sections[name] = active[-1].sections.get(name, 0.0) + time.perf_counter() - start
+
+
+class JobError:  # returned in place of the result of a job that raised, when the caller asked for it
+
+    def __init__(self, name, trace):
+        self.name = name
+        self.trace = trace
+
+
+class MeasuredCall:  # runs a job's function/object in the worker and attaches the measurement to the result
+
+    def __init__(self, function, name):
+        self.function = function
+        self.name = name
+        self.__name__ = getattr(function, '__name__', str(function))
+        self.capture_errors = False  # a failed job is otherwise never collected, a caller polling for it would wait forever
+        self.outbox = None  # shared dict the result is also posted to, under outbox_key, once the job is done
+        self.outbox_key = None
+
+    def __call__(self, *args):
+        measurement = Measurement(self.name)
+        active.append(measurement)
+        try:
+            result = self.function(*args)
+        except Exception:
+            if not self.capture_errors:
+                raise
+            result = JobError(self.name, traceback.format_exc())
+        finally:
+            active.remove(measurement)
+        try:
+            result.metrics = measurement.finish()
+        except AttributeError:  # results without attributes are not measured
+            pass
+        if self.outbox is not None:
+            self.outbox[self.outbox_key] = result
+        return result
+
+
+class MeasuredJob(Job):  # super -> job name, result key, function/object, arguments
+
+    def execute(self): return super().execute()
+    def execute_callback(self, result): return super().execute_callback(result)
+    def error_callback(self, result): return super().error_callback(result)
+
+    def __init__(self, job_name, result_key, function, arguments):
+        self.call = MeasuredCall(function, job_name)
+        super().__init__(job_name, result_key, self.call, arguments)
+
+    def capture_errors(self):  # the result of a failed job is a JobError
+        self.call.capture_errors = True
+        return self
+
+    def post_to(self, outbox, key):  # the result also goes to this shared dict, a caller can tell when it is done without the job manager
+        self.call.outbox = outbox
+        self.call.outbox_key = key
+        return self
+
+
+class RunReport:
+
+    def __init__(self):
+        self.stages = []
+        self.jobs = []
+        self.keys = set()
+        self.current = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        measurement = Measurement(name)
+        active.append(measurement)
+        self.current = name
+        try:
+            yield
+        finally:
+            active.remove(measurement)
+            self.current = None
+            row = measurement.finish()
+            jobs = [job for job in self.jobs if job['stage'] == name]
+            row.update({'jobs': len(jobs), 'job_wall': round(sum(j['wall'] for j in jobs), 4), 'job_cpu': round(sum(j['cpu'] for j in jobs), 4),
+                        'job_peak_rss_mb': max([j['peak_rss_mb'] or 0 for j in jobs], default=None),
+                        'job_bytes_read': sum(j['bytes_read'] or 0 for j in jobs), 'job_bytes_written': sum(j['bytes_written'] or 0 for j in jobs),
+                        'job_cache_hits': sum(j['cache_hits'] for j in jobs), 'job_cache_misses': sum(j['cache_misses'] for j in jobs)})
+            self.stages.append(row)
+            print(f'{name}: {row["wall"]} s wall, {round(row["cpu"] + row["job_cpu"], 1)} s cpu, {row["jobs"]} jobs, '
+                  f'cache {row["cache_hits"] + row["job_cache_hits"]} hits {row["cache_misses"] + row["job_cache_misses"]} misses', flush=True)
+
+    def record(self, key, result):
+        metrics = getattr(result, 'metrics', None)
+        if metrics and key not in self.keys:
+            self.keys.add(key)
+            self.jobs.append(dict(metrics, key=str(key), stage=self.current))
+
+    def write(self, folder: Path, code):
+        json_path = folder.joinpath(code + '_run_report.json')
+        json_path.write_text(json.dumps({'stages': self.stages, 'jobs': self.jobs}, indent=1, default=str))
+        print_file_exists(json_path)
+        frame = pd.DataFrame([dict(row, kind='stage') for row in self.stages] + [dict(row, kind='job') for row in self.jobs])
+        if len(frame):
+            frame['sections'] = frame['sections'].apply(lambda s: ' '.join(f'{k}={v}' for k, v in s.items()))
+        print_file_exists(write_df(frame, folder.joinpath(code + '_run_report.csv')))
+        return json_path
+
+
+class MeasuredJobManager:  # job manager whose results are added to the run report as they are collected
+
+    def __init__(self, job_manager, report: RunReport):
+        self.job_manager = job_manager
+        self.report = report
+
+    def __getattr__(self, name): return getattr(self.job_manager, name)
+    def put(self, job): return self.job_manager.put(job)
+    def wait(self): return self.job_manager.wait()
+    def stop_queue(self): return self.job_manager.stop_queue()
+
+    def get(self, key):
+        result = self.job_manager.get(key)
+        if result is not None:
+            self.report.record(key, result)
+        return result
+
+
+def as_completed(job_manager, jobs, poll_interval=0.1):  # (position, result) of each job as it finishes, in the order they finish
+    with Manager() as manager:
+        outbox = manager.dict()
+        keys = [job_manager.put(job.capture_errors().post_to(outbox, position)) for position, job in enumerate(jobs)]
+        pending = set(range(len(keys)))
+        while pending:
+            finished = pending.intersection(outbox.keys())
+            for position in sorted(finished):
+                result = outbox[position]
+                if isinstance(result, JobError):
+                    raise RuntimeError(f'{result.name} failed\n{result.trace}')
+                yield position, result
+            pending -= finished
+            if pending and not finished:
+                time.sleep(poll_interval)
+    job_manager.wait()  # every job is done, the results are collected for the run report
+    for key in keys:
+        job_manager.get(key)
@@ -1,109 +1,176 @@
-from argparse import ArgumentParser as argParser
-from pathlib import Path
+import sys
 
-from tt_gpx.gpx import Route, Waypoint, Edge, EdgeNode, GpxFile
-from tt_chrome_driver import chrome_driver
-from tt_job_manager.job_manager import JobManager
-from tt_globals.globals import Globals
+from startup import argument_parser, RunStamp, OUT_OF_DATE
+from route_setup import initialize_globals, build_route, check_chrome, download_options, result_files
+
+#  the tt packages, pandas and scipy are imported where they are used, an up to date run loads tt_globals only
 
-from waypoint_processing import waypoint_processing
-from elapsed_time import edge_processing
-from transit_time import transit_time_processing
 
 if __name__ == '__main__':
 
     # ---------- PARSE ARGUMENTS ----------
 
-    ap = argParser()
-    ap.add_argument('project_name', type=str, help='name of transit window project')
-    ap.add_argument('filepath', type=Path, help='path to gpx file')
-    ap.add_argument('year', type=int, help='calendar year for analysis')
-    ap.add_argument('-dd', '--delete_data', action='store_true')
-    ap.add_argument('-er', '--east_river', action='store_true')
-    ap.add_argument('-cdc', '--chesapeake_delaware_canal', action='store_true')
+    ap = argument_parser()
     args = vars(ap.parse_args())
+    if args['extend_from'] and args['dag_scheduler']:
+        ap.error('--extend_from runs the stages in order, drop --dag_scheduler')
+    if args['adaptive'] and args['dag_scheduler']:
+        ap.error('--adaptive runs the stages in order, drop --dag_scheduler')
+
+    # ---------- UP TO DATE ----------
+
+    stamp = RunStamp(args)
+    if stamp.current():
+        print(f'up to date: {args["project_name"]}')
+        sys.exit(0)
+    if args['check']:
+        print(f'out of date: {args["project_name"]}')
+        sys.exit(OUT_OF_DATE)
+
+    from tt_globals.globals import Globals
+    from tt_file_tools.file_tools import print_file_exists
+    from transit_time import midline_window, MIDLINE_WINDOW
+    from fingerprints import RouteFingerprints, print_dry_run
+    from bidirectional import reverse_route, reversed_globals
+    from extension import PreviousRun
+
+    # ---------- EARLIER RUN ----------
+
+    previous = PreviousRun(args, args['extend_from']) if args['extend_from'] else None
 
     # ---------- SET UP GLOBALS ----------
 
-    Globals.initialize_dates(args)
-    Globals.initialize_folders(args)
-    Globals.initialize_structures()
-    
-    Waypoint.waypoints_folder = Globals.WAYPOINTS_FOLDER
-    Edge.edges_folder = Globals.EDGES_FOLDER
+    initialize_globals(args)
+    if previous and (previous.edges_folder == Globals.EDGES_FOLDER or previous.transit_times_folder == Globals.TRANSIT_TIMES_FOLDER):
+        ap.error(f'--extend_from {previous.year} writes to the same folders as this run, use another project name for the window')
 
     # ---------- ROUTE OBJECT ----------
 
-    gpx_file = GpxFile(args['filepath'])
+    route = build_route(args)
+    reverse = reverse_route(route) if args['bidirectional'] else None
+
+    # ---------- FINGERPRINTS ----------
+
+    window = midline_window(args['midline_hours']) if args['midline_hours'] else MIDLINE_WINDOW
+    dtype = 'float32' if args['float32'] else None  # low memory mode never changes the results
+    fingerprints = RouteFingerprints(route, window, dtype, args['adaptive'])
+    reverse_fingerprints = None
+    if reverse:
+        with reversed_globals():
+            reverse_fingerprints = RouteFingerprints(reverse, window, dtype, args['adaptive'])
+    if args['dry_run']:
+        print_dry_run(route, fingerprints)
+        if reverse:
+            print_dry_run(reverse, reverse_fingerprints)
+        sys.exit()
+    print(f'Removed {len(fingerprints.invalidate())} files whose inputs changed')
+    outdated = fingerprints.outdated()
+    if reverse:
+        print(f'Removed {len(reverse_fingerprints.invalidate())} reverse files whose inputs changed')
+        outdated += reverse_fingerprints.outdated()
+
+    if not outdated:  # every intermediate file is current, only the final aggregate is written
+        from elapsed_time import post_elapsed_times
+        from transit_time import post_cached_transit_times, aggregate_transit_times
+        from validations import ValidationReference, validation_names, validation_reports
+
+        print(f'\nAll intermediate files are current')
+        for speed in Globals.BOAT_SPEEDS:
+            post_elapsed_times(route, speed)
+            post_cached_transit_times(route, speed)
+        aggregate_transit_times(route)
+        if validation_names(args):
+            check_chrome()  # the references are fetched from NOAA
+            validation_reports([ValidationReference(name, route.edge_path.route_heading, Globals.FIRST_DAY, Globals.LAST_DAY, Globals.FIRST_DOWNLOAD_DAY, Globals.LAST_DOWNLOAD_DAY) for name in validation_names(args)],
+                               Globals.TRANSIT_TIMES_FOLDER, Globals.BOAT_SPEEDS)
+        print_file_exists(fingerprints.save())
+        if reverse:
+            with reversed_globals():
+                for speed in Globals.BOAT_SPEEDS:
+                    post_elapsed_times(reverse, speed)
+                    post_cached_transit_times(reverse, speed)
+                aggregate_transit_times(reverse)
+            print_file_exists(reverse_fingerprints.save())
 
-    if gpx_file.type == Globals.TYPE['rte']:
-        route = Route(gpx_file.tree)
     else:
-        route = None
-
-    route.location_name = args['filepath'].stem
-    route.location_code = args['project_name']
-
-    print(f'\nCalculating {gpx_file.type} {route.location_name}')
-    print(f'code {route.location_code}')
-    print(f'calendar year: {Globals.YEAR}')
-    print(f'start date: {Globals.FIRST_DAY_DATE}')
-    print(f'end date: {Globals.LAST_DAY_DATE}')
-    print(f'total waypoints: {len(route.waypoints)}')
-    print(f'total edge nodes: {len(list(filter(lambda w: isinstance(w, EdgeNode), route.waypoints)))}')
-    print(f'total edges: {len(route.edges)}')
-    print(f'boat speeds: {Globals.BOAT_SPEEDS}')
-    print(f'length {round(route.edge_path.length, 1)} nm')
-    print(f'direction {route.edge_path.direction}')
-    print(f'heading {route.edge_path.route_heading}\n')
-
-    Globals.TRANSIT_TIMES_FOLDER.joinpath(str(route.edge_path.route_heading) + '.heading').touch()
-
-    # ---------- CHECK CHROME ----------
-    chrome_driver.check_driver()
-    if chrome_driver.installed_driver_version is None or chrome_driver.latest_stable_version > chrome_driver.installed_driver_version:
-        chrome_driver.install_stable_driver()
-
-    # ---------- START MULTIPROCESSING ----------
-    job_manager = JobManager()
-
-    # ---------- WAYPOINT PROCESSING ----------
-    waypoint_processing(route, job_manager)
-
-    # ---------- EDGE PROCESSING ----------
-    edge_processing(route, job_manager)
-
-    # ---------- TRANSIT TIMES ----------
-    transit_time_processing(job_manager, route)
-
-    # # if args['east_river']:
-    # #     print(f'\nEast River validation')
-    # #
-    # #     validation_frame = pd.DataFrame()
-    # #
-    # #     frame = validations.hell_gate_validation()
-    # #     validation_frame = pd.concat([validation_frame, frame])
-    # #
-    # #     frame = validations.battery_validation()
-    # #     validation_frame = pd.concat([validation_frame, frame])
-    # #
-    # #     validation_frame.sort_values(['start_date'], ignore_index=True, inplace=True)
-    # #     write_df(validation_frame, Globals.TRANSIT_TIMES_FOLDER.joinpath('east_river_validation.csv'))
-    # #
-    # # if args['chesapeake_delaware_canal']:
-    # #     print(f'\nChesapeake Delaware Canal validation')
-    # #
-    # #     validation_frame = pd.DataFrame()
-    # #
-    # #     frame = validations.chesapeake_city_validation()
-    # #     validation_frame = pd.concat([validation_frame, frame])
-    # #
-    # #     frame = validations.reedy_point_tower_validation()
-    # #     validation_frame = pd.concat([validation_frame, frame])
-    # #
-    # #     validation_frame.sort_values(['start_date'], ignore_index=True, inplace=True)
-    # #     write_df(validation_frame, Globals.TRANSIT_TIMES_FOLDER.joinpath('chesapeake_delaware_validation.csv'))
-
+        from tt_job_manager.job_manager import JobManager
+        from waypoint_processing import waypoint_processing
+        from elapsed_time import edge_processing
+        from transit_time import transit_time_processing
+        from adaptive import adaptive_processing
+        from binary_cache import enable_binary_cache, enable_low_memory
+        from scheduler import schedule_route
+        from shared_buffers import SharedBufferRegistry, peak_memory
+        from instrumentation import RunReport, MeasuredJobManager
+        from validations import ValidationReferenceJob, validation_names, validation_reports
+
+        # ---------- CHECK CHROME ----------
+        if any(artifact.name.startswith('velocity ') for artifact, status in outdated) or validation_names(args):  # only NOAA downloads and validation references need the driver
+            check_chrome()
+
+        # ---------- START MULTIPROCESSING ----------
+        if args['binary_cache']:
+            enable_binary_cache()  # before the pool starts so the workers inherit it
+        if args['low_memory']:
+            enable_low_memory()
+        report = RunReport()
+        registry = SharedBufferRegistry() if args['shared_memory'] else None  # before the pool starts so the workers share its resource tracker
+        job_manager = MeasuredJobManager(JobManager(), report)
+        station_cache, client = download_options(args)
+
+        validation_keys = []
+        if args['dag_scheduler']:
+            validation_keys = [job_manager.put(ValidationReferenceJob(name, route.edge_path.route_heading)) for name in validation_names(args)]  # the scheduler never waits on it
+            with report.stage('schedule'):
+                schedule_route(route, job_manager, registry, window, dtype, station_cache, client)
+        else:
+            # ---------- WAYPOINT PROCESSING ----------
+            with report.stage('waypoints'):
+                waypoint_processing(route, job_manager, dtype, station_cache, client, previous)
+
+            if args['adaptive']:
+                # ---------- ADAPTIVE TRANSIT TIMES ----------
+                with report.stage('adaptive transit times'):
+                    validation_keys = [job_manager.put(ValidationReferenceJob(name, route.edge_path.route_heading)) for name in validation_names(args)]
+                    adaptive_processing(job_manager, route, window, args['adaptive'])
+            else:
+                # ---------- EDGE PROCESSING ----------
+                with report.stage('edges'):
+                    edge_processing(route, job_manager, registry, previous)
+
+                # ---------- TRANSIT TIMES ----------
+                with report.stage('transit times'):
+                    validation_keys = [job_manager.put(ValidationReferenceJob(name, route.edge_path.route_heading)) for name in validation_names(args)]  # NOAA references alongside the last stage
+                    transit_time_processing(job_manager, route, registry, window, previous=previous)
+
+        # ---------- REVERSE PASSAGE ----------
+        if reverse and args['adaptive']:
+            with report.stage('reverse adaptive transit times'), reversed_globals():
+                adaptive_processing(job_manager, reverse, window, args['adaptive'], 'reverse ')
+        elif reverse:
+            with report.stage('reverse edges'), reversed_globals():
+                edge_processing(reverse, job_manager, registry)
+            with report.stage('reverse transit times'), reversed_globals():
+                transit_time_processing(job_manager, reverse, registry, window, 'reverse ')
+
+        # ---------- VALIDATION ----------
+        if validation_keys:
+            with report.stage('validation'):
+                job_manager.wait()
+                validation_reports([job_manager.get(key) for key in validation_keys], Globals.TRANSIT_TIMES_FOLDER, Globals.BOAT_SPEEDS)
+
+        print_file_exists(fingerprints.save())
+        if reverse:
+            print_file_exists(reverse_fingerprints.save())
+        report.write(Globals.TRANSIT_TIMES_FOLDER, route.location_code)
+
+        job_manager.stop_queue()
+
+        if registry:
+            print(f'shared memory {round(registry.nbytes / 1024 / 1024, 1)} MB')
+            registry.release()
+        parent_mb, workers_mb = peak_memory()
+        print(f'peak memory: main process {parent_mb} MB, largest worker {workers_mb} MB')
+
+    print_file_exists(stamp.write(result_files(route, reverse)))
     print(f'\nProcess Complete')
-
-    job_manager.stop_queue()
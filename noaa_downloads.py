@@ -0,0 +1,112 @@
+import io
+import time
+import threading
+import http.client
+import pandas as pd
+from urllib.parse import urlsplit, urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+from tt_gpx.gpx import Route, InterpolatedWP, EdgeNode
+from tt_globals.globals import Globals
+
+from station_cache import StationCache
+
+NOAA_DATAGETTER_URL = 'https://api.tidesandcurrents.noaa.gov/api/prod/datagetter'
+
+
+class DownloadError(Exception):
+    pass
+
+
+#  fetches current predictions from the NOAA datagetter with one kept-alive connection per thread
+#  stations are split into month long requests and every request of every station runs concurrently
+#  its frames are not those of noaa_current_dataframe, they are cached under their own source
+class NoaaCurrentClient:
+
+    def __init__(self, url=NOAA_DATAGETTER_URL, max_workers=8, retries=4, backoff=1.0, timeout=60, interval='6', time_zone='lst_ldt'):
+        self.url = urlsplit(url)
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff  # seconds, doubled after every failed attempt
+        self.timeout = timeout
+        self.interval = interval  # minutes between predictions
+        self.time_zone = time_zone
+        self.source = 'datagetter ' + self.interval + ' ' + self.time_zone
+        self.local = threading.local()
+
+    def __getstate__(self): return dict(self.__dict__, local=None)  # connections stay in the process that opened them
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def connection(self, reset=False):
+        if reset or getattr(self.local, 'connection', None) is None:
+            if getattr(self.local, 'connection', None) is not None:
+                self.local.connection.close()
+            connection_class = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+            self.local.connection = connection_class(self.url.netloc, timeout=self.timeout)
+        return self.local.connection
+
+    @staticmethod
+    def months(fdd, ldd):
+        first = pd.Timestamp(fdd).normalize()
+        last = pd.Timestamp(ldd).normalize()
+        starts = pd.date_range(first, last, freq='MS').union([first])
+        return [(start, min(start + pd.offsets.MonthEnd(0), last)) for start in starts if start <= last]
+
+    def query(self, code, begin, end):
+        station, _, station_bin = code.partition('_')
+        parameters = {'product': 'currents_predictions', 'station': station, 'begin_date': begin.strftime('%Y%m%d'),
+                      'end_date': end.strftime('%Y%m%d'), 'time_zone': self.time_zone, 'interval': self.interval, 'units': 'english', 'format': 'csv'}
+        if station_bin:
+            parameters['bin'] = station_bin
+        return self.url.path + '?' + urlencode(parameters)
+
+    def request(self, code, begin, end):
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                connection = self.connection(reset=attempt > 0)
+                connection.request('GET', self.query(code, begin, end))
+                response = connection.getresponse()
+                body = response.read().decode()
+                if response.status == 200:
+                    if 'Velocity_Major' not in body.partition('\n')[0]:
+                        raise DownloadError(f'{code} {begin.date()} {body.strip()[:200]}')
+                    return pd.read_csv(io.StringIO(body))
+                if response.status not in (429, 500, 502, 503, 504):
+                    raise DownloadError(f'{code} {begin.date()} HTTP {response.status}')
+            except (OSError, http.client.HTTPException):
+                if attempt == self.retries:
+                    raise
+            if attempt < self.retries:
+                time.sleep(delay)
+                delay *= 2
+        raise DownloadError(f'{code} {begin.date()} failed after {self.retries + 1} attempts')
+
+    def fetch(self, fdd, ldd, code): return self.fetch_all([code], fdd, ldd)[code]  # same call as noaa_current_dataframe
+
+    def fetch_all(self, codes, fdd, ldd):
+        months = NoaaCurrentClient.months(fdd, ldd)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {code: [executor.submit(self.request, code, begin, end) for begin, end in months] for code in codes}
+            return {code: pd.concat([f.result() for f in futures[code]]).drop_duplicates('Time').reset_index(drop=True) for code in futures}
+
+
+def download_waypoints(route: Route):  # data waypoints of every interpolated waypoint and the remaining edge nodes
+    waypoints = [wp for iwp in filter(lambda w: isinstance(w, InterpolatedWP), route.waypoints) for wp in iwp.data_waypoints]
+    return waypoints + [wp for wp in route.waypoints if isinstance(wp, EdgeNode) and not isinstance(wp, InterpolatedWP)]
+
+
+def station_codes(waypoints):  # stations still to be downloaded, without repeats
+    return list(dict.fromkeys(wp.code for wp in waypoints if not wp.folder.joinpath(Globals.WAYPOINT_DATAFILE_NAME).exists()))
+
+
+def prefetch_stations(codes, fdd, ldd, station_cache: StationCache, client: NoaaCurrentClient):
+    codes = list(dict.fromkeys(codes))
+    missing = [code for code in codes if (code, fdd, ldd) not in station_cache]
+    print(f'\nDownloading {len(missing)} of {len(codes)} stations concurrently', flush=True)
+    for code, frame in client.fetch_all(missing, fdd, ldd).items():
+        station_cache.put(code, fdd, ldd, frame)
+    return missing
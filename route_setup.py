@@ -0,0 +1,110 @@
+from startup import DEFAULT_STATION_CACHE_FOLDER
+
+#  Globals, the route and the download options of a run, shared by main.py, batch.py, the query tools and extended runs
+#  the tt packages are imported where they are used, an up to date run never loads them
+
+
+def initialize_globals(args):
+    from tt_gpx.gpx import Waypoint, Edge
+    from tt_globals.globals import Globals
+
+    if args.get('dry_run'):  # a dry run only reads, -dd never deletes the data it reports on
+        args = dict(args, delete_data=False)
+    Globals.initialize_dates(args)
+    if args.get('window_start'):  # a window has folders of its own, never those of the calendar year
+        from extension import window_project_name, window_globals
+        Globals.initialize_folders(dict(args, project_name=window_project_name(args['project_name'], args['window_start'], args['window_months'])))
+        Globals.initialize_structures()
+        window_globals(args['window_start'], args['window_months'])
+    else:
+        Globals.initialize_folders(args)
+        Globals.initialize_structures()
+    
+    Waypoint.waypoints_folder = Globals.WAYPOINTS_FOLDER
+    Edge.edges_folder = Globals.EDGES_FOLDER
+
+
+def build_route(args):
+    from tt_gpx.gpx import Route, EdgeNode, GpxFile
+    from tt_globals.globals import Globals
+
+    gpx_file = GpxFile(args['filepath'])
+
+    if gpx_file.type == Globals.TYPE['rte']:
+        route = Route(gpx_file.tree)
+    else:
+        route = None
+
+    route.location_name = args['filepath'].stem
+    route.location_code = args['project_name']
+
+    print(f'\nCalculating {gpx_file.type} {route.location_name}')
+    print(f'code {route.location_code}')
+    print(f'calendar year: {Globals.YEAR}')
+    print(f'start date: {Globals.FIRST_DAY_DATE}')
+    print(f'end date: {Globals.LAST_DAY_DATE}')
+    print(f'total waypoints: {len(route.waypoints)}')
+    print(f'total edge nodes: {len(list(filter(lambda w: isinstance(w, EdgeNode), route.waypoints)))}')
+    print(f'total edges: {len(route.edges)}')
+    print(f'boat speeds: {Globals.BOAT_SPEEDS}')
+    print(f'length {round(route.edge_path.length, 1)} nm')
+    print(f'direction {route.edge_path.direction}')
+    print(f'heading {route.edge_path.route_heading}\n')
+
+    if not args.get('dry_run'):
+        Globals.TRANSIT_TIMES_FOLDER.joinpath(str(route.edge_path.route_heading) + '.heading').touch()
+    return route
+
+
+def check_chrome():
+    from tt_chrome_driver import chrome_driver
+
+    chrome_driver.check_driver()
+    if chrome_driver.installed_driver_version is None or chrome_driver.latest_stable_version > chrome_driver.installed_driver_version:
+        chrome_driver.install_stable_driver()
+
+
+def download_options(args):
+    from station_cache import StationCache
+    from noaa_downloads import NoaaCurrentClient
+
+    if args['concurrent_downloads'] and not args['station_cache']:
+        args['station_cache'] = DEFAULT_STATION_CACHE_FOLDER  # concurrent downloads are handed to the jobs through the station cache
+    client = NoaaCurrentClient(max_workers=args['concurrent_downloads']) if args['concurrent_downloads'] else None
+    if client:  # a station missing from the cache is fetched by the client too, frames of both kinds are never mixed
+        station_cache = StationCache(args['station_cache'], args['station_cache_mb'] * 1024 * 1024, client.fetch, client.source)
+    else:
+        station_cache = StationCache(args['station_cache'], args['station_cache_mb'] * 1024 * 1024) if args['station_cache'] else None
+    return station_cache, client
+
+
+def result_files(route, reverse=None):  # final files of a run, recorded in the run stamp
+    from tt_globals.globals import Globals
+    from bidirectional import reversed_globals
+
+    folder = Globals.TRANSIT_TIMES_FOLDER
+    files = ([folder.joinpath(route.location_code + '_transit_times.csv'), folder.joinpath(route.location_code + '_arcs.csv')]
+             + list(route.transit_time_csv_to_speed.values()) + list(route.rounded_transit_time_csv_to_speed.values()))
+    if reverse:
+        with reversed_globals():
+            files += result_files(reverse)
+    return files
+
+
+class GlobalsState:  # Globals and the waypoint and edge folders as they are now, put back by restore
+
+    def __init__(self):
+        from types import FunctionType
+        from tt_gpx.gpx import Waypoint, Edge
+        from tt_globals.globals import Globals
+
+        self.values = {k: v for k, v in vars(Globals).items() if not k.startswith('__') and not isinstance(v, (FunctionType, classmethod, staticmethod))}
+        self.folders = (Waypoint.waypoints_folder, Edge.edges_folder)
+
+    def restore(self):
+        from tt_gpx.gpx import Waypoint, Edge
+        from tt_globals.globals import Globals
+
+        for name, value in self.values.items():
+            setattr(Globals, name, value)
+        Waypoint.waypoints_folder, Edge.edges_folder = self.folders
@@ -0,0 +1,174 @@
+import time
+import pandas as pd
+from threading import Thread
+from multiprocessing import Manager
+
+from tt_gpx.gpx import Route, InterpolatedWP, EdgeNode
+from tt_file_tools.file_tools import write_df, print_file_exists
+from tt_globals.globals import Globals
+
+from binary_cache import cache_exists
+from velocity import DownloadVelocityJob, SplineFitNormalizedVelocityJob, InterpolatedVelocityJob
+from elapsed_time import MultiSpeedElapsedTimeJob, elapsed_times_path, aggregate_elapsed_times, post_elapsed_times
+from transit_time import TransitTimeJob, post_transit_times, aggregate_transit_times, MIDLINE_WINDOW
+from shared_buffers import SharedBufferRegistry
+from station_cache import StationCache
+from instrumentation import JobError
+from noaa_downloads import NoaaCurrentClient, prefetch_stations, download_waypoints, station_codes
+
+
+class ScheduleNode:
+
+    def __init__(self, name, job=None, action=None, after=()):
+        self.name = name
+        self.job = job  # callable returning a Job, built only when the dependencies are done so its inputs exist
+        self.action = action  # callable run in a parent thread, for work that is not a Job and puts no jobs
+        self.after = list(after)
+        self.key = None
+        self.thread = None
+        self.error = None
+        self.start = None
+        self.end = None
+
+    def run_action(self):
+        try:
+            self.action()
+        except Exception as error:  # re-raised by the scheduler so dependents never start on missing files
+            self.error = error
+
+
+class DagScheduler:
+    poll_interval = 0.1
+
+    def __init__(self, job_manager):
+        self.job_manager = job_manager
+        self.nodes = {}
+        self.results = {}
+        self.outbox = None  # results posted by the jobs themselves, by node name
+
+    def add(self, name, job=None, action=None, after=()):
+        self.nodes[name] = ScheduleNode(name, job, action, after)
+        return name
+
+    def job_finished(self, node):  # a job is done when its result is in the outbox, the job manager is only read once it is
+        if node.name not in self.outbox:
+            return False
+        self.results[node.name] = self.outbox[node.name]
+        if isinstance(self.results[node.name], JobError):
+            node.error = RuntimeError(f'{node.name} failed\n{self.results[node.name].trace}')
+        return True
+
+    def finished(self, node):
+        if node.job:
+            return self.job_finished(node)
+        return node.thread is None or not node.thread.is_alive()
+
+    def run(self):
+        with Manager() as manager:
+            self.outbox = manager.dict()
+            self.run_nodes()
+        self.job_manager.wait()  # every job is done, the results are collected for the run report
+        for node in filter(lambda n: n.job, self.nodes.values()):
+            self.job_manager.get(node.key)
+
+    def run_nodes(self):
+        pending = dict(self.nodes)
+        running = {}
+        done = set()
+        origin = time.perf_counter()
+        while pending or running:
+            for node in [n for n in pending.values() if all(d in done for d in n.after)]:
+                node.start = time.perf_counter() - origin
+                if node.job:
+                    node.key = self.job_manager.put(node.job().capture_errors().post_to(self.outbox, node.name))
+                else:
+                    node.thread = Thread(target=node.run_action)
+                    node.thread.start()
+                running[node.name] = pending.pop(node.name)
+            for node in [n for n in running.values() if self.finished(n)]:
+                node.end = time.perf_counter() - origin
+                if node.error:
+                    raise node.error
+                done.add(running.pop(node.name).name)
+            time.sleep(self.poll_interval)
+
+    def critical_path(self):  # longest chain of node durations through the graph
+        length = {}
+        previous = {}
+        for node in sorted(self.nodes.values(), key=lambda n: n.end):
+            longest = max(node.after, key=lambda d: length[d], default=None)
+            previous[node.name] = longest
+            length[node.name] = node.end - node.start + (length[longest] if longest else 0)
+        name = max(length, key=length.get)
+        path = []
+        while name:
+            path.insert(0, name)
+            name = previous[name]
+        return path
+
+    def report(self, filepath):
+        path = self.critical_path()
+        frame = pd.DataFrame(data={
+            'node': [n.name for n in self.nodes.values()],
+            'start': [round(n.start, 3) for n in self.nodes.values()],
+            'end': [round(n.end, 3) for n in self.nodes.values()],
+            'duration': [round(n.end - n.start, 3) for n in self.nodes.values()],
+            'critical': [n.name in path for n in self.nodes.values()]})
+        print_file_exists(write_df(frame.sort_values('start'), filepath))
+        print(f'\nCritical path {round(sum(self.nodes[n].end - self.nodes[n].start for n in path), 1)} seconds')
+        for name in path:
+            print(f'  {round(self.nodes[name].end - self.nodes[name].start, 1):>8}  {name}')
+
+
+def schedule_route(route: Route, job_manager, registry: SharedBufferRegistry = None, window=MIDLINE_WINDOW, dtype=None, station_cache: StationCache = None, client: NoaaCurrentClient = None):
+    scheduler = DagScheduler(job_manager)
+    fdd = Globals.FIRST_DOWNLOAD_DAY
+    ldd = Globals.LAST_DOWNLOAD_DAY
+    ndd = Globals.NORMALIZED_DOWNLOAD_DATES
+    ndi = Globals.NORMALIZED_DOWNLOAD_INDICES
+
+    # ---------- WAYPOINTS ----------
+
+    prefetch = []
+    if client:
+        codes = station_codes(download_waypoints(route))
+        prefetch = [scheduler.add('download stations', action=lambda: prefetch_stations(codes, fdd, ldd, station_cache, client))]
+
+    velocity_node = {}
+    for iwp in filter(lambda w: isinstance(w, InterpolatedWP), route.waypoints):
+        downloads = [scheduler.add('download ' + wp.unique_name, job=lambda wp=wp: DownloadVelocityJob(fdd, ldd, ndd, ndi, wp, station_cache), after=prefetch) for wp in iwp.data_waypoints]
+        velocity_node[iwp] = scheduler.add('interpolate ' + iwp.unique_name, job=lambda iwp=iwp: InterpolatedVelocityJob(iwp), after=downloads)
+    for wp in filter(lambda w: isinstance(w, EdgeNode) and not isinstance(w, InterpolatedWP), route.waypoints):
+        velocity_node[wp] = scheduler.add('download ' + wp.unique_name, job=lambda wp=wp: DownloadVelocityJob(fdd, ldd, ndd, ndi, wp, station_cache), after=prefetch)
+
+    spline_node = {wp: scheduler.add('spline ' + wp.unique_name, job=lambda wp=wp: SplineFitNormalizedVelocityJob(Globals.DOWNLOAD_INDEX_RANGE, wp, dtype), after=[velocity_node[wp]])
+                   for wp in filter(lambda w: isinstance(w, EdgeNode), route.waypoints)}
+
+    # ---------- EDGES ----------
+
+    speeds = [s for s in Globals.BOAT_SPEEDS if not cache_exists(elapsed_times_path(s))]
+    edge_nodes = [scheduler.add('elapsed time ' + edge.unique_name, job=lambda edge=edge: MultiSpeedElapsedTimeJob(edge, speeds, registry),
+                                after=[spline_node[edge.start], spline_node[edge.end]]) for edge in route.edges] if speeds else []
+
+    aggregate_node = {}
+    for s in Globals.BOAT_SPEEDS:
+        if s in speeds:
+            aggregate_node[s] = scheduler.add('elapsed times ' + str(s), after=edge_nodes,
+                                              action=lambda s=s: aggregate_elapsed_times(route, s, [scheduler.results[n].filepaths[s] for n in edge_nodes]))
+        else:
+            aggregate_node[s] = scheduler.add('elapsed times ' + str(s), action=lambda s=s: post_elapsed_times(route, s))
+
+    # ---------- TRANSIT TIMES ----------
+
+    transit_node = {s: scheduler.add('transit time ' + str(s), job=lambda s=s: TransitTimeJob(s, route.elapsed_time_csv_to_speed[s], Globals.TRANSIT_TIMES_FOLDER, registry, window), after=[aggregate_node[s]])
+                    for s in Globals.BOAT_SPEEDS}
+
+    def aggregate():
+        for speed in Globals.BOAT_SPEEDS:
+            post_transit_times(route, speed, scheduler.results[transit_node[speed]])
+        aggregate_transit_times(route)
+
+    scheduler.add('aggregate transit times', action=aggregate, after=transit_node.values())
+
+    scheduler.run()
+    scheduler.report(Globals.TRANSIT_TIMES_FOLDER.joinpath(route.location_code + '_schedule.csv'))
@@ -0,0 +1,79 @@
+import sys
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory, resource_tracker
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+class SharedArray:  # picklable handle, the array itself stays in shared memory
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self.memory = None
+
+    def __getstate__(self): return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype, 'memory': None}
+
+    def attach(self):
+        if self.memory is None:
+            self.memory = shared_memory.SharedMemory(name=self.name)  # kept on the handle while the array is in use
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self.memory.buf)
+
+
+class SharedFrame:  # one shared array per column
+
+    def __init__(self, columns: dict):
+        self.columns = columns
+
+    def attach(self): return pd.DataFrame({name: array.attach() for name, array in self.columns.items()}, copy=False)
+
+
+def attach(value): return value.attach() if isinstance(value, (SharedArray, SharedFrame)) else value
+
+
+#  Create the registry before the job manager. Workers forked or spawned after the resource tracker is running share it,
+#  one started later by a worker that attaches unlinks the segments as soon as that worker exits.
+class SharedBufferRegistry:
+
+    def __init__(self):
+        self.segments = {}
+        self.handles = {}
+        resource_tracker.ensure_running()
+
+    def publish(self, key, array):  # each key is copied into shared memory once, a callable array is only loaded for a new key
+        if key not in self.handles:
+            array = np.ascontiguousarray(array() if callable(array) else array)
+            if array.dtype == object:
+                array = array.astype(str)
+            segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+            self.segments[key] = segment
+            self.handles[key] = SharedArray(segment.name, array.shape, array.dtype)
+        return self.handles[key]
+
+    def publish_frame(self, key, frame: pd.DataFrame):
+        return SharedFrame({column: self.publish((key, column), frame[column].to_numpy()) for column in frame.columns})
+
+    @property
+    def nbytes(self): return sum(segment.size for segment in self.segments.values())
+
+    def release(self):
+        for segment in self.segments.values():
+            segment.close()
+            segment.unlink()
+        self.segments.clear()
+        self.handles.clear()
+
+
+def peak_memory():  # peak resident set size in MB of this process and of its finished children
+    if resource is None:
+        return None, None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024  # bytes on macOS, kilobytes on linux
+    parent = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(parent, 1), round(children, 1)
@@ -0,0 +1,160 @@
+import sys
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+from tt_gpx.gpx import Route
+from tt_globals.globals import Globals
+from tt_file_tools.file_tools import print_file_exists
+
+from route_setup import initialize_globals, build_route
+from startup import argument_parser
+from binary_cache import cache_exists, read_cache, write_cache, enable_binary_cache, enable_low_memory
+from elapsed_time import ElapsedTimeDataframe, edge_velocities, elapsed_times_path
+from transit_time import TransitTimeDataframe, speed_folder, total_transit_times, midline_window, MIDLINE_WINDOW
+
+#  Transit times at a speed between two computed speeds without a full run
+#  python speed_query.py project route.gpx 2025 -qs 5.5 6.25 -tol 30
+#  Steps over an edge never increase with the boat speed while the speed over ground stays positive, so the elapsed
+#  timesteps of the two bracketing speeds bound the true ones. The estimate interpolates 1 / timesteps between them, exact
+#  for a steady current. Every edge keeps its order of arrival, so the transit time of every departure lies between the
+#  transit times of the two bounds. The widest of those intervals is the guarantee, edges are computed exactly, widest
+#  first, until it is within tolerance.
+QUERY_FOLDER = 'speed queries'
+DEFAULT_TOLERANCE = 30  # minutes
+
+
+def computed_speeds(route: Route):
+    speeds = [s for s in Globals.BOAT_SPEEDS if cache_exists(elapsed_times_path(s))]
+    route.elapsed_time_csv_to_speed.update({s: elapsed_times_path(s) for s in speeds})
+    return speeds
+
+
+def bracket(speed, speeds):  # (slower, faster), the same direction as speed and nearest on either side
+    same_direction = sorted([s for s in speeds if s * speed > 0], key=abs)
+    slower = [s for s in same_direction if abs(s) < abs(speed)]
+    faster = [s for s in same_direction if abs(s) > abs(speed)]
+    if not slower or not faster:
+        raise ValueError(f'{speed} kts is outside the computed speeds {sorted(speeds)}')
+    return slower[-1], faster[0]
+
+
+def edge_matrix(path, columns):
+    frame = read_cache(path)
+    return frame[columns].to_numpy().astype(int)
+
+
+def velocity_pair(edge):
+    init_velos = edge_velocities(edge.start.folder.joinpath(Globals.EDGE_DATAFILE_NAME))
+    final_velos = edge_velocities(edge.end.folder.joinpath(Globals.EDGE_DATAFILE_NAME))
+    if getattr(edge, 'reverse', False):
+        init_velos, final_velos = -init_velos, -final_velos
+    return init_velos, final_velos
+
+
+#  abs(distance) is summed, a step against the boat counts as progress and the steps stop falling with the speed
+def stalls(init_velos, final_velos, speed):  # somewhere the current holds a boat at this speed still or sets it back
+    steps = ElapsedTimeDataframe.distance(final_velos[1:], init_velos[:-1], speed, 1)
+    return bool((steps * np.sign(speed) <= 0).any())
+
+
+def exact_timesteps(edge, speed):
+    init_velos, final_velos = velocity_pair(edge)
+    return ElapsedTimeDataframe.timesteps(init_velos, final_velos, Globals.ELAPSED_TIME_INDEX_RANGE, edge.length, speed)
+
+
+class SpeedQuery:
+
+    def __init__(self, route: Route, speed, tolerance=DEFAULT_TOLERANCE, window=MIDLINE_WINDOW):
+
+        self.speed = speed
+        speeds = computed_speeds(route)
+        if speed in speeds:  # nothing to estimate
+            self.slower = self.faster = speed
+            self.guarantee_minutes = 0
+            self.exact_edges = []
+            self.filepath = speed_folder(Globals.TRANSIT_TIMES_FOLDER, speed).joinpath('transit_times.csv')
+            self.rounded_filepath = speed_folder(Globals.TRANSIT_TIMES_FOLDER, speed).joinpath('rounded_transit_times.csv')
+            print_file_exists(self.filepath)
+            return
+        self.slower, self.faster = bracket(speed, speeds)
+        print(f'\n{speed} kts from {self.slower} and {self.faster} kts', flush=True)
+
+        upper = edge_matrix(elapsed_times_path(self.slower), [ElapsedTimeDataframe.filename(e.folder, self.slower) for e in route.edges])
+        lower = edge_matrix(elapsed_times_path(self.faster), [ElapsedTimeDataframe.filename(e.folder, self.faster) for e in route.edges])
+        weight = (abs(speed) - abs(self.slower)) / (abs(self.faster) - abs(self.slower))
+        estimate = np.rint(1 / ((1 - weight) / upper + weight / lower)).astype(int)  # speed over ground is linear in the boat speed
+
+        # where the current stops the slower speed the bounds need not hold, whether they cross or not
+        self.exact = [i for i, edge in enumerate(route.edges) if stalls(*velocity_pair(edge), self.slower)]
+        width = (upper - lower).max(axis=0)
+        candidates = [i for i in np.argsort(-width, kind='stable') if i not in self.exact and width[i] > 0]
+        tolerance_steps = tolerance * 60 / Globals.TIMESTEP
+        row_count = len(Globals.TEMPLATE_TRANSIT_TIME_DATAFRAME)
+
+        computed = set()
+        batch = 1
+        while True:
+            for i in set(self.exact) - computed:
+                upper[:, i] = lower[:, i] = estimate[:, i] = exact_timesteps(route.edges[i], speed)
+                computed.add(i)
+            transit_upper = total_transit_times(row_count, pd.DataFrame(upper), range(len(route.edges)))
+            transit_lower = total_transit_times(row_count, pd.DataFrame(lower), range(len(route.edges)))
+            self.guarantee = int((transit_upper - transit_lower).max(initial=0))
+            if self.guarantee <= tolerance_steps or not candidates:
+                break
+            self.exact += candidates[:batch]  # widest edges first, doubling so the number of rounds stays logarithmic
+            candidates = candidates[batch:]
+            batch *= 2
+
+        self.guarantee_minutes = round(self.guarantee * Globals.TIMESTEP / 60, 1)
+        self.exact_edges = [route.edges[i].unique_name for i in sorted(self.exact)]
+        print(f'{len(self.exact)} of {len(route.edges)} edges computed exactly, transit times within {self.guarantee_minutes} minutes', flush=True)
+
+        # outside the route's own speed folders, an estimate is never mistaken for a computed speed
+        self.folder = Globals.TRANSIT_TIMES_FOLDER.joinpath(QUERY_FOLDER)
+        speed_path = self.folder.joinpath('elapsed_timesteps_' + str(speed) + '.csv')
+        shutil.rmtree(speed_folder(self.folder, speed), ignore_errors=True)  # an earlier answer may rest on other bounds
+        for path in self.folder.glob(speed_path.stem + '.*'):
+            path.unlink()
+        speed_folder(self.folder, speed).mkdir(parents=True, exist_ok=True)
+
+        columns = [ElapsedTimeDataframe.filename(e.folder, speed) for e in route.edges]
+        template = Globals.TEMPLATE_ELAPSED_TIME_DATAFRAME
+        frame = pd.concat([template, pd.DataFrame(estimate, columns=columns, index=template.index)], axis=1)
+        self.elapsed_times_path = write_cache(frame, speed_path)
+        print_file_exists(self.elapsed_times_path)
+
+        transit_times = TransitTimeDataframe(speed, Globals.TEMPLATE_TRANSIT_TIME_DATAFRAME, self.elapsed_times_path, self.folder, Globals.FIRST_DAY, Globals.LAST_DAY, window)
+        self.filepath = transit_times.transit_time_path
+        self.rounded_filepath = transit_times.rounded_transit_time_path
+
+        self.report_path = self.folder.joinpath(route.location_code + '_' + str(speed) + '.json')
+        self.report_path.write_text(json.dumps({'speed': speed, 'slower': self.slower, 'faster': self.faster, 'tolerance_minutes': tolerance,
+                                                'guarantee_minutes': self.guarantee_minutes, 'exact_edges': self.exact_edges,
+                                                'transit_times': str(self.filepath)}, indent=1))
+        print_file_exists(self.report_path)
+
+
+if __name__ == '__main__':
+
+    ap = argument_parser()
+    ap.add_argument('-qs', '--query_speeds', type=float, nargs='+', required=True, help='speeds between the computed boat speeds')
+    ap.add_argument('-tol', '--tolerance', type=float, default=DEFAULT_TOLERANCE, help='largest transit time error in minutes')
+    args = vars(ap.parse_args())
+
+    if args['binary_cache']:
+        enable_binary_cache()
+    if args['low_memory']:
+        enable_low_memory()
+    initialize_globals(args)
+    route = build_route(args)
+    window = midline_window(args['midline_hours']) if args['midline_hours'] else MIDLINE_WINDOW
+
+    for query_speed in args['query_speeds']:
+        try:
+            SpeedQuery(route, int(query_speed) if query_speed.is_integer() else query_speed, args['tolerance'], window)
+        except ValueError as err:
+            print(err)
+            sys.exit(1)
@@ -0,0 +1,118 @@
+import json
+import hashlib
+import importlib.util
+from importlib import metadata
+from argparse import ArgumentParser as argParser
+from pathlib import Path
+
+#  Only the standard library is imported here so an up to date run can finish before scipy, the Chrome check or the
+#  job manager pool are ever loaded. The run stamp imports tt_globals alone, for the settings the results depend on.
+TRANSIT_TIME_HOME = Path.home().joinpath('.transit_time')
+DEFAULT_STATION_CACHE_FOLDER = TRANSIT_TIME_HOME.joinpath('stations')
+RUN_STAMP_FOLDER = TRANSIT_TIME_HOME.joinpath('runs')
+RESULT_OPTIONS = ['project_name', 'filepath', 'year', 'east_river', 'chesapeake_delaware_canal', 'binary_cache', 'midline_hours', 'float32', 'low_memory', 'bidirectional', 'window_start', 'window_months', 'adaptive']
+OUT_OF_DATE = 3  # exit status of --check when the route has work to do
+TT_PACKAGES = ['tt_globals', 'tt_gpx', 'tt_noaa_data', 'tt_date_time_tools', 'tt_file_tools', 'tt_geometry', 'tt_job_manager', 'tt_chrome_driver']
+
+
+def argument_parser():
+    ap = argParser()
+    ap.add_argument('project_name', type=str, help='name of transit window project')
+    ap.add_argument('filepath', type=Path, help='path to gpx file')
+    ap.add_argument('year', type=int, help='calendar year for analysis')
+    ap.add_argument('-dd', '--delete_data', action='store_true')
+    ap.add_argument('-er', '--east_river', action='store_true')
+    ap.add_argument('-cdc', '--chesapeake_delaware_canal', action='store_true')
+    ap.add_argument('-bc', '--binary_cache', action='store_true', help='store intermediate files as .npy')
+    ap.add_argument('-dag', '--dag_scheduler', action='store_true', help='start each job as soon as its inputs exist')
+    ap.add_argument('-sm', '--shared_memory', action='store_true', help='pass large job arguments through shared memory')
+    ap.add_argument('-mh', '--midline_hours', type=float, help='transit time midline window in hours')
+    ap.add_argument('-f32', '--float32', action='store_true', help='store spline fitted velocities as float32, halves their memory but elapsed times can differ from a float64 run by a timestep')
+    ap.add_argument('-sc', '--station_cache', type=Path, nargs='?', const=DEFAULT_STATION_CACHE_FOLDER, help='folder of NOAA downloads shared by all projects')
+    ap.add_argument('-scm', '--station_cache_mb', type=int, default=1024, help='station cache size limit in MB')
+    ap.add_argument('-cd', '--concurrent_downloads', type=int, nargs='?', const=8, help='download all stations at once over this many connections')
+    ap.add_argument('-lm', '--low_memory', action='store_true', help='smallest integer dtypes, elapsed times aggregated into and transit times read in chunks from memory mapped .npy caches, turns on -bc, results are unchanged; edge jobs and the minima still hold full-year arrays')
+    ap.add_argument('-bd', '--bidirectional', action='store_true', help='also compute the opposite passage from the same velocities')
+    ap.add_argument('-xf', '--extend_from', type=int, help='reuse the downloads and results of this year of the route where they overlap')
+    ap.add_argument('-ws', '--window_start', type=str, help='first day of a window of months instead of the calendar year, YYYY-MM-DD')
+    ap.add_argument('-wm', '--window_months', type=int, default=12, help='length of the window in months')
+    ap.add_argument('-ad', '--adaptive', type=int, nargs='?', const=16, help='transit minima from a coarse grid of departures every this many, refined where a window could change')
+    ap.add_argument('-n', '--dry_run', action='store_true', help='list the files that would be recomputed and stop')
+    ap.add_argument('-ck', '--check', action='store_true', help=f'exit 0 when the results are up to date and {OUT_OF_DATE} when there is work to do')
+    return ap
+
+
+def file_digest(path: Path): return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def file_state(path: Path):
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def code_version():  # any edit to a module of this project makes every stamp out of date
+    return hashlib.sha256(json.dumps([[p.name] + file_state(p) for p in sorted(Path(__file__).parent.glob('*.py'))]).encode()).hexdigest()
+
+
+def package_version(name):  # installed version and module files of a tt package, found without importing it
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return None
+    try:
+        version = metadata.version(name)
+    except metadata.PackageNotFoundError:  # a checkout on the path
+        version = None
+    if spec.submodule_search_locations:
+        folder = Path(list(spec.submodule_search_locations)[0])
+        files = sorted(folder.rglob('*.py'))
+    else:
+        folder = Path(spec.origin).parent
+        files = [Path(spec.origin)]
+    return [version, hashlib.sha256(json.dumps([[str(p.relative_to(folder))] + file_state(p) for p in files]).encode()).hexdigest()]
+
+
+def settings_state():  # Globals settings that are not run options, boat speeds, timestep, file and folder names
+    from tt_globals.globals import Globals
+
+    simple = (bool, int, float, str, list, tuple, dict, Path)
+    return {name: repr(value) for name, value in sorted(vars(Globals).items()) if name.isupper() and isinstance(value, simple)}
+
+
+#  the gpx file, the code, the tt packages, the Globals settings and the result files of the last complete run of a project
+#  a rerun with the same stamp has nothing to do
+class RunStamp:
+
+    def __init__(self, args: dict, folder: Path = RUN_STAMP_FOLDER):
+        self.options = {name: str(Path(args[name]).resolve()) if name == 'filepath' else args[name] for name in RESULT_OPTIONS}
+        key = hashlib.sha256(json.dumps(self.options, sort_keys=True).encode()).hexdigest()[:24]
+        self.filepath = folder.joinpath(args['project_name'] + '_' + key + '.json')
+        self.gpx_file = Path(args['filepath'])
+        self.forced = args['delete_data'] or args['dry_run']
+        self.settings = settings_state()  # before the run initializes Globals, so a check and a write compare alike
+
+    def state(self):
+        return {'gpx': file_digest(self.gpx_file), 'code': code_version(),
+                'packages': {name: package_version(name) for name in TT_PACKAGES}, 'settings': self.settings}
+
+    def current(self):
+        if self.forced or not self.filepath.exists():
+            return False
+        try:
+            stamp = json.loads(self.filepath.read_text())
+            results = [Path(path).exists() and file_state(Path(path)) == state for path, state in stamp['results'].items()]
+            return all(results) and stamp['state'] == self.state()
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def transit_times_folder(self):  # where the last complete run wrote its results, Globals are never set up to find it
+        try:
+            results = list(json.loads(self.filepath.read_text())['results'])
+        except (OSError, ValueError, KeyError):
+            return None
+        return Path(results[0]).parent if results else None
+
+    def write(self, results):
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        stamp = {'options': self.options, 'state': self.state(), 'results': {str(path): file_state(Path(path)) for path in results}}
+        self.filepath.write_text(json.dumps(stamp, indent=1))
+        return self.filepath
@@ -0,0 +1,58 @@
+import os
+import hashlib
+import pandas as pd
+from pathlib import Path
+
+from tt_noaa_data.noaa_data import noaa_current_dataframe
+
+from instrumentation import cache_lookup
+from startup import DEFAULT_STATION_CACHE_FOLDER
+
+
+#  NOAA current downloads shared by every project, keyed by station code and date range
+#  least recently used files are removed once the folder grows past max_bytes
+class StationCache:
+
+    def __init__(self, folder: Path = DEFAULT_STATION_CACHE_FOLDER, max_bytes=1024 ** 3, fetch=noaa_current_dataframe, source=None):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+        self.fetch = fetch  # called as fetch(first day, last day, code), replaceable by a local stub
+        self.source = source  # names a fetch whose frames differ from noaa_current_dataframe's, they never share a file
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    def path(self, code, fdd, ldd):
+        key = hashlib.sha256((f'{code}|{fdd}|{ldd}' + (f'|{self.source}' if self.source else '')).encode()).hexdigest()
+        return self.folder.joinpath(key + '.pkl')
+
+    def __contains__(self, item): return self.path(*item).exists()
+
+    def frame(self, code, fdd, ldd):
+        path = self.path(code, fdd, ldd)
+        if cache_lookup(path.exists()):
+            os.utime(path)  # modification time is the last use
+            return pd.read_pickle(path)
+        frame = self.fetch(fdd, ldd, code)
+        self.store(frame, path)
+        return frame
+
+    def put(self, code, fdd, ldd, frame: pd.DataFrame): self.store(frame, self.path(code, fdd, ldd))
+
+    def store(self, frame: pd.DataFrame, path: Path):
+        temporary = path.with_suffix('.' + str(os.getpid()) + '.tmp')
+        frame.to_pickle(temporary)
+        os.replace(temporary, path)  # other processes never see a partial file
+        self.evict(keep=path)
+
+    def evict(self, keep: Path = None):
+        files = sorted(self.folder.glob('*.pkl'), key=lambda f: f.stat().st_mtime)
+        total = sum(f.stat().st_size for f in files)
+        for file in files:
+            if total <= self.max_bytes:
+                break
+            if file != keep:
+                size = file.stat().st_size
+                try:
+                    file.unlink()
+                    total -= size
+                except OSError:  # in use by another process on windows
+                    pass
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from transit_time import linear_trend
+from adaptive import interpolation_slack, midline_slack
+
+
+def transit_steps(count, seed):  # a later departure never arrives earlier, steps fall by at most one per departure
+    rng = np.random.default_rng(seed)
+    tts = np.empty(count, dtype=int)
+    tts[0] = 200
+    for i in range(1, count):
+        tts[i] = max(tts[i - 1] - 1, tts[i - 1] + rng.integers(-1, 3) - (i // 400) % 2 * 2)
+    return tts
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_the_midline_stays_within_its_slack(seed):
+    true = transit_steps(4000, seed)
+    evaluated = np.zeros(len(true), dtype=bool)
+    evaluated[np.unique(np.append(np.arange(0, len(true), 16), len(true) - 1))] = True
+    exact = np.flatnonzero(evaluated)
+    filled = np.rint(np.interp(np.arange(len(true)), exact, true[exact])).astype(int)
+
+    slack = interpolation_slack(filled, evaluated)
+    assert (np.abs(filled - true) <= slack).all()
+    window = 501
+    assert (np.abs(linear_trend(filled, window) - linear_trend(true, window)) <= midline_slack(slack, window) + 1e-9).all()
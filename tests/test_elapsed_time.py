@@ -0,0 +1,105 @@
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+
+from tt_globals.globals import Globals
+
+from binary_cache import BINARY_CACHE_VARIABLE, LOW_MEMORY_VARIABLE, write_cache, read_cache
+from elapsed_time import elapsed_time, elapsed_times, elapsed_times_at, ElapsedTimeAggregator, ElapsedTimeDataframe
+
+
+def scalar_counts(distances, length, departures):
+    return np.array([elapsed_time(i, distances, length) for i in range(departures)])
+
+
+def tidal_distances(count, speed, seed, dtype=float):  # distance per step of a boat in a tidal current, nm
+    rng = np.random.default_rng(seed)
+    steps = np.arange(count)
+    current = 3 * np.sin(2 * np.pi * steps / 149) + rng.normal(0, 0.2, count)
+    return np.insert((current[1:] + speed) * 0.05, 0, 0.0).astype(dtype)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_distances(seed):
+    distances = tidal_distances(3000, 5, seed)
+    np.testing.assert_array_equal(elapsed_times(distances, 1.7, 2800), scalar_counts(distances, 1.7, 2800))
+
+
+def test_negative_distances():  # a current stronger than the boat, abs(distance) is summed
+    distances = tidal_distances(3000, 2, 7)
+    assert (distances < 0).any()
+    np.testing.assert_array_equal(elapsed_times(distances, 1.2, 2800), scalar_counts(distances, 1.2, 2800))
+
+
+@pytest.mark.parametrize('length', [0.0, -1.0])
+def test_zero_length(length):
+    distances = tidal_distances(100, 5, 1)
+    np.testing.assert_array_equal(elapsed_times(distances, length, 90), scalar_counts(distances, length, 90))
+
+
+def test_boundary_distances():  # rounded distances land exactly on the length
+    distances = np.insert(np.resize([0.1, 0.2, 0.3, 0.25], 2000), 0, 0.0)
+    for length in [0.3, 0.6, 0.85, 1.7]:
+        np.testing.assert_array_equal(elapsed_times(distances, length, 1900), scalar_counts(distances, length, 1900))
+
+
+def test_float32_distances():  # float32 storage must not change the counts late in the year
+    distances = tidal_distances(40000, 5, 3, np.float32)
+    positions = np.arange(37000, 39500)
+    expected = np.array([elapsed_time(i, distances, 1.3) for i in positions])
+    np.testing.assert_array_equal(elapsed_times_at(distances, 1.3, positions), expected)
+
+
+def test_trip_ending_on_last_sample():
+    rng = np.random.default_rng(6)
+    distances = np.insert(np.round(rng.uniform(0.05, 0.3, 40), 3), 0, 0.0)  # the cumulative sum falls short of the loop's total
+    length = 0.0
+    for d in distances[31:]:  # the running total of the loop reaches the length on the last sample
+        length += d
+    assert elapsed_times_at(distances, length, np.array([30]))[0] == elapsed_time(30, distances, length) == 10
+
+
+def test_trip_past_the_end():
+    distances = np.insert(np.full(40, 0.1), 0, 0.0)
+    with pytest.raises(IndexError):
+        elapsed_time(35, distances, 1.0)
+    with pytest.raises(IndexError):
+        elapsed_times_at(distances, 1.0, np.array([35]))
+
+
+def aggregated_edges(tmp_path, monkeypatch, low_memory):  # three edges in a different order than they finish
+    tmp_path.mkdir(exist_ok=True)
+    monkeypatch.setenv(BINARY_CACHE_VARIABLE, '1')  # low memory turns it on, both sides write .npy
+    monkeypatch.setenv(LOW_MEMORY_VARIABLE, '1' if low_memory else '')
+    departures = np.arange(1_700_000_000, 1_700_000_000 + 900 * 500, 900)
+    template = pd.DataFrame({'departure_index': departures, 'date_time': pd.to_datetime(departures, unit='s')})
+    monkeypatch.setattr(Globals, 'EDGES_FOLDER', tmp_path, raising=False)
+    monkeypatch.setattr(Globals, 'TEMPLATE_ELAPSED_TIME_DATAFRAME', template, raising=False)
+    route = SimpleNamespace(edges=[SimpleNamespace(folder=tmp_path.joinpath(name)) for name in ['A-B', 'B-C', 'C-D']])
+    aggregator = ElapsedTimeAggregator(route, 5)
+    rng = np.random.default_rng(2)
+    for position in [2, 0, 1]:
+        edge = route.edges[position]
+        edge.folder.mkdir(exist_ok=True)
+        column = ElapsedTimeDataframe.filename(edge.folder, 5)
+        aggregator.add(position, write_cache(template.assign(**{column: rng.integers(1, 40000, len(departures))}), edge.folder.joinpath(column)))
+    return aggregator
+
+
+def test_low_memory_aggregation_matches(tmp_path, monkeypatch):
+    expected = aggregated_edges(tmp_path.joinpath('dense'), monkeypatch, False)
+    expected = read_cache(expected.write())
+    aggregator = aggregated_edges(tmp_path.joinpath('mapped'), monkeypatch, True)
+    assert aggregator.partial_path.exists() and not aggregator.filepath.with_suffix('.npy').exists()  # no cache until every column is in
+    written = aggregator.write()
+    assert written.suffix == '.npy' and not aggregator.partial_path.exists()
+    pd.testing.assert_frame_equal(read_cache(written), expected, check_dtype=False)
+
+
+def test_missing_edge_is_not_written(tmp_path, monkeypatch):
+    aggregator = aggregated_edges(tmp_path, monkeypatch, True)
+    aggregator.filled[1] = False
+    with pytest.raises(ValueError, match='B-C'):
+        aggregator.write()
+    assert not aggregator.filepath.with_suffix('.npy').exists()
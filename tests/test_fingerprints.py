@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from types import SimpleNamespace
+
+from tt_gpx.gpx import EdgeNode
+from tt_globals.globals import Globals
+
+import fingerprints
+from fingerprints import RouteFingerprints
+
+
+class Node(EdgeNode):
+
+    def __init__(self, name, folder: Path):
+        self.unique_name = name
+        self.code, self.lat, self.lon = name, 40.7, -74.0
+        self.folder = folder
+
+
+def two_node_route(tmp_path, monkeypatch):  # one edge between two downloaded stations
+    for name, value in {'TRANSIT_TIMES_FOLDER': tmp_path.joinpath('transit times'), 'EDGES_FOLDER': tmp_path.joinpath('edges'), 'YEAR': 2025,
+                        'FIRST_DAY': pd.Timestamp('2025-01-01'), 'LAST_DAY': pd.Timestamp('2025-12-31'),
+                        'FIRST_DOWNLOAD_DAY': pd.Timestamp('2024-12-01'), 'LAST_DOWNLOAD_DAY': pd.Timestamp('2026-01-31'),
+                        'DOWNLOAD_INDEX_RANGE': np.arange(0, 9000, 15), 'ELAPSED_TIME_INDEX_RANGE': np.arange(0, 6000, 15)}.items():
+        monkeypatch.setattr(Globals, name, value, raising=False)
+    start, end = Node('A', tmp_path.joinpath('A')), Node('B', tmp_path.joinpath('B'))
+    edge = SimpleNamespace(unique_name='A-B', start=start, end=end, length=1.25, folder=tmp_path.joinpath('A-B'))
+    return SimpleNamespace(waypoints=[start, end], edges=[edge])
+
+
+def keys(route, **options): return {a.name: a.key for a in RouteFingerprints(route, **options).artifacts}
+
+
+def test_settings_and_packages_reach_the_keys(tmp_path, monkeypatch):
+    route = two_node_route(tmp_path, monkeypatch)
+    before = keys(route)
+    monkeypatch.setattr(Globals, 'TIME_WINDOW_SCALE_FACTOR', 1.2)
+    scaled = keys(route)
+    assert [name for name in before if before[name] != scaled[name]] == ['transit times ' + str(s) for s in Globals.BOAT_SPEEDS]
+
+    installed = fingerprints.package_version
+    monkeypatch.setattr(fingerprints, 'package_version', lambda name: [name, 'upgraded'] if name == 'tt_geometry' else installed(name))
+    upgraded = keys(route)
+    assert {name for name in scaled if scaled[name] != upgraded[name]} == {'transit times ' + str(s) for s in Globals.BOAT_SPEEDS}
+
+
+def test_adaptive_runs_track_only_the_files_they_write(tmp_path, monkeypatch):
+    route = two_node_route(tmp_path, monkeypatch)
+    names = keys(route, adaptive=16)
+    assert not [name for name in names if name.startswith(('elapsed', 'timesteps'))]
+    assert keys(route)['transit times 3'] != names['transit times 3']
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tt_globals.globals import Globals
+
+from transit_time import midline_windows, linear_trend
+
+
+#  the clump loop MinimaFrame used before minima_windows, departures and transit timesteps of every window
+def clump_loop_windows(departures, tts, midline, noise_size=100):
+    frame = pd.DataFrame({'departure_index': departures, 'tts': tts, 'midline': midline})
+    frame['TF'] = frame['tts'].lt(frame['midline'])
+    frame = frame.drop(frame[frame['tts'] == frame['midline']].index).reset_index(drop=True)
+    frame['block'] = (frame['TF'] != frame['TF'].shift(1)).cumsum()
+    clump_lookup = {index: df for index, df in frame.groupby('block') if df['TF'].any()}
+    clump_lookup = {index: df.drop(['TF', 'block', 'midline'], axis=1).reset_index() for index, df in clump_lookup.items() if len(df) > noise_size}
+
+    windows = []
+    for index, clump in clump_lookup.items():
+        median_departure_index = clump[clump['tts'] == clump.min()['tts']]['departure_index'].median()
+        abs_diff = clump['departure_index'].sub(median_departure_index).abs()
+        minimum_index = abs_diff[abs_diff == abs_diff.min()].index[0]
+        minimum_row = clump.iloc[minimum_index]
+        offset = int(minimum_row['tts'] * Globals.TIME_WINDOW_SCALE_FACTOR)
+
+        sr_range = clump[clump['departure_index'].lt(minimum_row['departure_index'])]
+        sr = sr_range[sr_range['tts'].gt(offset)].iloc[-1] if len(sr_range[sr_range['tts'].gt(offset)]) else clump.iloc[0]
+        er_range = clump[clump['departure_index'].gt(minimum_row['departure_index'])]
+        er = er_range[er_range['tts'].gt(offset)].iloc[0] if len(er_range[er_range['tts'].gt(offset)]) else clump.iloc[-1]
+        windows.append([int(row[column]) for row in [sr, minimum_row, er] for column in ['departure_index', 'tts']])
+    return windows
+
+
+def vectorized_windows(departures, tts, midline):
+    keep, start, minimum, end = midline_windows(departures, tts, midline)
+    departures, tts = departures[keep], tts[keep]
+    return [[int(v) for v in row] for row in zip(departures[start], tts[start], departures[minimum], tts[minimum], departures[end], tts[end])]
+
+
+def transit_steps(count, seed, plateau):  # tidal transit timesteps, coarse steps give long runs of tied minima
+    rng = np.random.default_rng(seed)
+    steps = np.arange(count)
+    tts = 400 + 150 * np.sin(2 * np.pi * steps / 1490) + 40 * np.sin(2 * np.pi * steps / 5400) + rng.normal(0, 12, count)
+    return (np.rint(tts / plateau) * plateau).astype(int)
+
+
+@pytest.mark.parametrize('scale', [1.0, 1.1, 1.25, 1.6])
+@pytest.mark.parametrize('seed, plateau', [(0, 1), (1, 1), (2, 20), (3, 60)])
+def test_minima_match_the_clump_loop(monkeypatch, scale, seed, plateau):
+    monkeypatch.setattr(Globals, 'TIME_WINDOW_SCALE_FACTOR', scale)
+    tts = transit_steps(20000, seed, plateau)
+    departures = 1735689600 + 15 * np.arange(len(tts))
+    midline = linear_trend(tts, 3001).round()
+    expected = clump_loop_windows(departures, tts, midline)
+    assert len(expected) > 10
+    assert vectorized_windows(departures, tts, midline) == expected
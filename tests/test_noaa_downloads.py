@@ -0,0 +1,77 @@
+import threading
+import pandas as pd
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from noaa_downloads import NoaaCurrentClient, DownloadError
+from station_cache import StationCache
+
+
+class StandIn(BaseHTTPRequestHandler):  # the NOAA datagetter, every fourth request fails with 503
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        query = {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items()}
+        with StandIn.lock:
+            StandIn.requests.append(query)
+            failed = len(StandIn.requests) % 4 == 0
+        if query['station'] == 'BAD':
+            self.reply(200, 'Error: No data was found.')
+        elif failed:
+            self.reply(503, 'busy')
+        else:
+            times = pd.date_range(pd.Timestamp(query['begin_date']), pd.Timestamp(query['end_date']) + pd.Timedelta(hours=23, minutes=54), freq=query['interval'] + 'min')
+            rows = [f'{t.strftime("%Y-%m-%d %H:%M")}, 0.0, {round(t.hour / 10, 2)}, 60, 240, {query.get("bin", 1)}' for t in times]
+            self.reply(200, '\n'.join(['Time, Depth, Velocity_Major, meanFloodDir, meanEbbDir, Bin'] + rows) + '\n')
+
+    def reply(self, status, body):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): pass
+
+
+@pytest.fixture
+def server():
+    StandIn.requests = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:' + str(httpd.server_address[1]) + '/api/prod/datagetter'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_stations_are_fetched_by_month_with_retries(server):
+    fdd, ldd = pd.Timestamp('2024-01-20'), pd.Timestamp('2024-03-05')
+    frames = NoaaCurrentClient(server, max_workers=4, backoff=0.01).fetch_all(['ACT1', 'ACT2_7'], fdd, ldd)
+    for frame in frames.values():
+        times = pd.to_datetime(frame['Time'])
+        assert times.iloc[0] == fdd and times.iloc[-1] == ldd + pd.Timedelta(hours=23, minutes=54)
+        assert (times.diff().dropna() == pd.Timedelta(minutes=6)).all()
+        assert ' Velocity_Major' in frame.columns
+    months = [(q['station'], q['begin_date'], q['end_date']) for q in StandIn.requests]
+    assert set(months) == {(s, b, e) for s in ['ACT1', 'ACT2'] for b, e in [('20240120', '20240131'), ('20240201', '20240229'), ('20240301', '20240305')]}
+    assert len(months) > 6  # the 503 replies were retried
+    assert all(q['bin'] == '7' for q in StandIn.requests if q['station'] == 'ACT2')
+
+
+def test_a_reply_without_predictions_is_an_error(server):
+    with pytest.raises(DownloadError):
+        NoaaCurrentClient(server, backoff=0.01).fetch(pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-02'), 'BAD')
+
+
+def test_client_frames_are_cached_apart_from_noaa_current_dataframe(server, tmp_path):
+    client = NoaaCurrentClient(server, backoff=0.01, interval='30')
+    fdd, ldd = pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-02')
+    cache = StationCache(tmp_path, fetch=client.fetch, source=client.source)
+    frame = cache.frame('ACT1', fdd, ldd)
+    assert ('ACT1', fdd, ldd) in cache
+    assert ('ACT1', fdd, ldd) not in StationCache(tmp_path)
+    assert pd.to_datetime(frame['Time']).diff().dropna().eq(pd.Timedelta(minutes=30)).all()
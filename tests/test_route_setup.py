@@ -0,0 +1,31 @@
+import extension
+from tt_globals.globals import Globals
+
+from route_setup import initialize_globals
+
+
+def record_folders(monkeypatch):  # the arguments the folders are made from, the rest of Globals left alone
+    calls = []
+    monkeypatch.setattr(Globals, 'initialize_dates', lambda args: None, raising=False)
+    monkeypatch.setattr(Globals, 'initialize_folders', lambda args: calls.append(args), raising=False)
+    monkeypatch.setattr(Globals, 'initialize_structures', lambda: None, raising=False)
+    monkeypatch.setattr(Globals, 'WAYPOINTS_FOLDER', None, raising=False)
+    monkeypatch.setattr(Globals, 'EDGES_FOLDER', None, raising=False)
+    monkeypatch.setattr(extension, 'window_globals', lambda start, months: None)
+    return calls
+
+
+def test_a_window_has_its_own_folders(monkeypatch):
+    calls = record_folders(monkeypatch)
+    args = {'project_name': 'ER', 'year': 2025, 'window_months': 6}
+    initialize_globals(dict(args, window_start=None))
+    initialize_globals(dict(args, window_start='2025-07-01'))
+    initialize_globals(dict(args, window_start='2025-07-01', window_months=12))
+    assert [c['project_name'] for c in calls] == ['ER', 'ER_2025-07-01_6m', 'ER_2025-07-01_12m']
+
+
+def test_a_dry_run_never_deletes(monkeypatch):
+    calls = record_folders(monkeypatch)
+    initialize_globals({'project_name': 'ER', 'year': 2025, 'window_start': None, 'delete_data': True, 'dry_run': True})
+    initialize_globals({'project_name': 'ER', 'year': 2025, 'window_start': None, 'delete_data': True, 'dry_run': False})
+    assert [c['delete_data'] for c in calls] == [False, True]
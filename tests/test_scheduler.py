@@ -0,0 +1,83 @@
+import time
+import threading
+import pytest
+
+from instrumentation import MeasuredJob, as_completed
+from scheduler import DagScheduler
+
+
+class Finished:  # result of a stand in job, when it ended
+
+    def __init__(self, seconds):
+        time.sleep(seconds)
+        self.end = time.perf_counter()
+
+
+def failing(): raise ValueError('no data')
+
+
+class ThreadJobManager:  # runs every job on its own thread, get answers None until a job is done and never raises
+
+    def __init__(self):
+        self.results = {}
+        self.threads = []
+        self.waits = 0
+
+    def put(self, job):
+        def run():
+            key, result = job.execute()
+            self.results[key] = result
+        self.threads.append(threading.Thread(target=run))
+        self.threads[-1].start()
+        return job.result_key
+
+    def wait(self):
+        self.waits += 1
+        for thread in self.threads:
+            thread.join()
+
+    def get(self, key): return self.results.get(key)
+
+
+def stand_in(name, seconds): return MeasuredJob(name, name, Finished, tuple([seconds]))
+
+
+def test_a_slow_job_holds_back_only_its_dependents():
+    job_manager = ThreadJobManager()
+    scheduler = DagScheduler(job_manager)
+    scheduler.poll_interval = 0.01
+    scheduler.add('slow', job=lambda: stand_in('slow', 1.0))
+    scheduler.add('fast', job=lambda: stand_in('fast', 0.0))
+    scheduler.add('after fast', job=lambda: stand_in('after fast', 0.0), after=['fast'])
+    scheduler.add('after slow', job=lambda: stand_in('after slow', 0.0), after=['slow'])
+    scheduler.run()
+    results = scheduler.results
+    assert results['after fast'].end < results['slow'].end < results['after slow'].end
+    assert job_manager.waits == 1  # only once every node is done
+
+
+def test_a_failed_job_stops_the_run():
+    scheduler = DagScheduler(ThreadJobManager())
+    scheduler.poll_interval = 0.01
+    scheduler.add('fails', job=lambda: MeasuredJob('fails', 'fails', failing, tuple()))
+    scheduler.add('after', job=lambda: stand_in('after', 0.0), after=['fails'])
+    with pytest.raises(RuntimeError, match='no data'):
+        scheduler.run()
+    assert 'after' not in scheduler.results
+
+
+def test_as_completed_yields_jobs_in_the_order_they_finish():
+    job_manager = ThreadJobManager()
+    jobs = [stand_in('slow', 0.5), stand_in('fast', 0.0), stand_in('middle', 0.2)]
+    finished = []
+    for position, result in as_completed(job_manager, jobs, poll_interval=0.01):
+        finished.append(position)
+        assert job_manager.waits == 0  # each result arrives before the pool is waited on
+    assert finished == [1, 2, 0]
+    assert job_manager.waits == 1
+
+
+def test_as_completed_raises_on_a_failed_job():
+    jobs = [MeasuredJob('fails', 'fails', failing, tuple())]
+    with pytest.raises(RuntimeError, match='no data'):
+        list(as_completed(ThreadJobManager(), jobs, poll_interval=0.01))
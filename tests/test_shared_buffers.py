@@ -0,0 +1,20 @@
+import numpy as np
+
+from shared_buffers import SharedBufferRegistry, attach
+
+
+def test_a_key_is_loaded_once():
+    registry = SharedBufferRegistry()
+    loads = []
+
+    def load():
+        loads.append(1)
+        return np.arange(5.0)
+
+    try:
+        first = registry.publish('node velocities', load)
+        second = registry.publish('node velocities', load)  # the next edge at the same node
+        assert first is second and len(loads) == 1
+        np.testing.assert_array_equal(attach(second), np.arange(5.0))
+    finally:
+        registry.release()
@@ -0,0 +1,25 @@
+import numpy as np
+
+from elapsed_time import ElapsedTimeDataframe
+from speed_query import stalls
+
+
+def ebb(count, peak):  # a current against the boat, held at its peak for a while, then slack
+    steps = np.arange(count)
+    return np.clip(-2 * peak * np.sin(2 * np.pi * steps / 1240), -peak, 0)
+
+
+def test_a_stalled_edge_breaks_the_bounds():  # speeds 3, 4 and 5 kts over 0.3 nm in a 3.8 kt ebb
+    velos = ebb(6000, 3.8)
+    counts = {speed: ElapsedTimeDataframe.timesteps(velos, velos, range(4000), 0.3, speed) for speed in (3, 4, 5)}
+    assert not (counts[5] > counts[3]).any()  # the bounds never cross
+    assert ((counts[4] > counts[3]) | (counts[4] < counts[5])).any()  # yet 4 kts falls outside them
+    assert stalls(velos, velos, 3)
+    assert not stalls(velos, velos, 5)
+
+
+def test_stalls_follows_the_direction_of_the_speed():
+    velos = -ebb(6000, 3.8)  # a flood, against a boat going the other way
+    assert stalls(velos, velos, -3)
+    assert not stalls(velos, velos, -5)
+    assert not stalls(velos, velos, 3)
@@ -0,0 +1,46 @@
+import os
+import pandas as pd
+
+from station_cache import StationCache
+
+
+class StubFetch:  # stands in for noaa_current_dataframe, counts the downloads
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, fdd, ldd, code):
+        self.calls.append(code)
+        times = pd.date_range(fdd, ldd, freq='6min')
+        return pd.DataFrame({'Time': times.strftime('%Y-%m-%d %H:%M'), ' Velocity_Major': range(len(times))})
+
+
+def test_repeat_requests_are_served_from_the_cache(tmp_path):
+    fetch = StubFetch()
+    fdd, ldd = pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-03')
+    first = StationCache(tmp_path, fetch=fetch).frame('ACT1', fdd, ldd)
+    second = StationCache(tmp_path, fetch=fetch).frame('ACT1', fdd, ldd)  # another project sharing the folder
+    assert fetch.calls == ['ACT1']
+    pd.testing.assert_frame_equal(first, second)
+    assert ('ACT1', fdd, ldd) in StationCache(tmp_path, fetch=fetch)
+
+
+def test_date_ranges_are_kept_apart(tmp_path):
+    fetch = StubFetch()
+    cache = StationCache(tmp_path, fetch=fetch)
+    cache.frame('ACT1', pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-02'))
+    cache.frame('ACT1', pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-03'))
+    assert fetch.calls == ['ACT1', 'ACT1']
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    fetch = StubFetch()
+    fdd, ldd = pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-02')
+    cache = StationCache(tmp_path, fetch=fetch)
+    for age, code in enumerate(['A', 'B', 'C']):
+        cache.frame(code, fdd, ldd)
+        os.utime(cache.path(code, fdd, ldd), (1000 + age, 1000 + age))
+    cache.frame('A', fdd, ldd)  # a hit makes A the most recently used
+    cache.max_bytes = 2 * cache.path('A', fdd, ldd).stat().st_size
+    cache.evict()
+    assert [(code, fdd, ldd) in cache for code in ['A', 'B', 'C']] == [True, False, True]
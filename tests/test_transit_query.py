@@ -0,0 +1,46 @@
+import pandas as pd
+
+from binary_cache import BINARY_CACHE_VARIABLE
+from startup import argument_parser, RunStamp
+from transit_time import speed_folder
+from transit_query import TransitTimeIndex
+
+
+def timesteps_folder(tt_folder, speed):  # a day of departures every 15 minutes, no minima
+    folder = speed_folder(tt_folder, speed)
+    folder.mkdir(parents=True)
+    departures = pd.date_range('2025-06-03', periods=96, freq='15min')
+    indices = (departures - pd.Timestamp('1970-01-01')) // pd.Timedelta('1s')
+    pd.DataFrame({'departure_index': indices, '0': range(96, 192)}).to_csv(folder.joinpath('timesteps.csv'), index=False)
+    return folder
+
+
+def test_one_departure_and_a_list_agree(tmp_path):
+    timesteps_folder(tmp_path, 6)
+    index = TransitTimeIndex(tmp_path, [6])
+    departures = ['2025-06-03 14:20', '2025-06-03T15:00', pd.Timestamp('2025-06-03 09:05')]
+    batch = index.query(departures, 6)
+    assert batch == [index.query(departure, 6) for departure in departures]
+    assert batch[0]['departure'] == '2025-06-03 14:30:00'
+
+
+def test_a_query_writes_nothing(tmp_path, monkeypatch):
+    monkeypatch.setenv(BINARY_CACHE_VARIABLE, '1')
+    folder = timesteps_folder(tmp_path, 6)
+    TransitTimeIndex(tmp_path, [6]).query('2025-06-03 14:20', 6)
+    assert [p.name for p in folder.iterdir()] == ['timesteps.csv']
+
+
+def test_the_folder_comes_from_the_run_stamp(tmp_path):
+    gpx = tmp_path.joinpath('route.gpx')
+    gpx.write_text('<gpx/>')
+    args = vars(argument_parser().parse_args(['ER', str(gpx), '2025']))
+    stamps = tmp_path.joinpath('runs')
+    assert RunStamp(args, stamps).transit_times_folder() is None  # no complete run yet
+    tt_folder = tmp_path.joinpath('ER 2025', 'transit times')
+    tt_folder.mkdir(parents=True)
+    results = [tt_folder.joinpath('ER_transit_times.csv'), tt_folder.joinpath('ER_arcs.csv')]
+    for path in results:
+        path.write_text('')
+    RunStamp(args, stamps).write(results)
+    assert RunStamp(args, stamps).transit_times_folder() == tt_folder
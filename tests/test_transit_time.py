@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scipy.signal import savgol_filter
+
+from binary_cache import frame_to_records
+from transit_time import total_transit_time, total_transit_times, chunked_transit_times, linear_trend, index_arc_df
+
+
+def elapsed_frame(rows, edges, seed):  # elapsed timesteps of every edge, a few steps to a few hundred
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({f'edge_{i}': rng.integers(1, rng.integers(2, 300), rows) for i in range(edges)})
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_transit_times_match_the_scalar_chain(seed):
+    frame = elapsed_frame(5000, 6, seed)
+    cols = frame.columns.to_list()
+    row_count = len(frame) - 6 * 300
+    expected = np.array([total_transit_time(row, frame, cols) for row in range(row_count)])
+    np.testing.assert_array_equal(total_transit_times(row_count, frame, cols), expected)
+    np.testing.assert_array_equal(total_transit_times(row_count, frame, cols, [5, 17, 900]), expected[[5, 17, 900]])
+    for chunk in [1, 77, 1024, row_count + 10]:
+        np.testing.assert_array_equal(chunked_transit_times(row_count, frame_to_records(frame), cols, chunk), expected)
+
+
+def transit_steps(count, seed):  # integer transit timesteps with a tidal swing and noise
+    rng = np.random.default_rng(seed)
+    steps = np.arange(count)
+    return np.rint(400 + 120 * np.sin(2 * np.pi * steps / 1490) + rng.normal(0, 15, count)).astype(int)
+
+
+@pytest.mark.parametrize('window', [2, 3, 51, 500, 501, 4000])
+def test_linear_trend_matches_savgol(window):
+    values = transit_steps(4000, window)
+    expected = savgol_filter(values, window, 1)
+    trend = linear_trend(values, window)
+    np.testing.assert_allclose(trend, expected, rtol=0, atol=1e-8)  # the edge fits included
+    ties = np.abs(np.abs(expected - np.floor(expected)) - 0.5) < 1e-8  # .5 can round either way after floating point sums
+    np.testing.assert_array_equal(trend.round()[~ties], expected.round()[~ties])
+
+
+def test_linear_trend_window_longer_than_values():
+    values = transit_steps(100, 0)
+    with pytest.raises(ValueError):
+        savgol_filter(values, 101, 1)
+    with pytest.raises(ValueError):
+        linear_trend(values, 101)
+
+
+def row_loop_index_arc_df(frame):  # index_arc_df before it was vectorized
+    output_frame = pd.DataFrame(columns=['idx'] + frame.columns.to_list())
+    date_arr_dict = {key: [] for key in sorted(list(set(frame['date'])))}
+    for i, row in frame.iterrows():
+        date_arr_dict[row['date']].append(row)
+    for key in date_arr_dict.keys():
+        for i in range(len(date_arr_dict[key])):
+            output_frame.loc[len(output_frame)] = [i + 1] + date_arr_dict[key][i].tolist()
+        if len(date_arr_dict[key]) == 2:
+            last_row_dict = output_frame.loc[len(output_frame) - 1].to_dict()
+            new_dict = {key: None for key in last_row_dict}
+            new_dict.update({'idx': 3, 'date': last_row_dict['date']})
+            output_frame.loc[len(output_frame)] = new_dict
+    return output_frame
+
+
+def arcs_frame(count, seed):  # one to three arcs a day in start time order, as create_arcs builds them
+    rng = np.random.default_rng(seed)
+    starts = pd.Timestamp('2025-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 40 * 24 * 60, count)), unit='min')
+    frame = pd.DataFrame({'start_datetime': starts, 'min_angle': rng.uniform(0, 180, count).round(1),
+                          'speed': rng.choice([3, -5, 7], count), 'start_time': starts.strftime('%H:%M')})
+    frame.insert(loc=0, column='date', value=frame['start_datetime'].dt.date)
+    return frame
+
+
+@pytest.mark.parametrize('count, seed', [(0, 0), (1, 0), (30, 1), (60, 2), (90, 3)])
+def test_index_arc_df_matches_the_row_loop(count, seed):
+    frame = arcs_frame(count, seed)
+    expected, indexed = row_loop_index_arc_df(frame), index_arc_df(frame)
+    pd.testing.assert_frame_equal(indexed, expected)
+    padding = expected['start_datetime'].isna().to_numpy()
+    assert all(value is None for value in indexed.loc[padding, 'min_angle'])  # None as the loop wrote, never NaN
@@ -0,0 +1,21 @@
+import pandas as pd
+import pytest
+
+from validations import route_validations, validation_errors, reference_times, index_arc_df
+
+
+@pytest.mark.parametrize('name, heading, references', [('east_river', 30, ['HG', 'BN']), ('east_river', 210, ['HG', 'BS']),
+                                                        ('chesapeake_delaware_canal', 85, ['CC']), ('chesapeake_delaware_canal', 265, ['RP'])])
+def test_references_follow_the_direction_of_the_route(name, heading, references):
+    assert [v.__name__ for v in route_validations(name, heading)] == [
+        {'HG': 'hell_gate_validation', 'BN': 'battery_north_validation', 'BS': 'battery_south_validation',
+         'CC': 'chesapeake_city_validation', 'RP': 'reedy_point_tower_validation'}[r] for r in references]
+
+
+def test_minima_are_matched_to_the_nearest_reference():
+    reference = index_arc_df(reference_times(['2025-06-03 06:00', '2025-06-03 18:30'], 'BN'))
+    minima = pd.DataFrame({'speed': 5, 'min_datetime': pd.to_datetime(['2025-06-03 06:12', '2025-06-03 18:00', '2025-06-03 12:15'])})
+    errors = validation_errors(reference, minima)
+    assert errors['reference'].unique().tolist() == ['BN']
+    assert errors['error_minutes'].dropna().tolist() == [12.0, -30.0]
+    assert errors['reference_datetime'].isna().tolist() == [False, True, False]  # noon is more than the tolerance from any reference
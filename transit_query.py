@@ -0,0 +1,156 @@
+import json
+import datetime
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from tt_globals.globals import Globals
+from tt_date_time_tools.date_time_tools import index_to_date, date_to_index, round_datetime
+
+from startup import argument_parser, RunStamp
+from binary_cache import existing_cache_path, load_records, read_cache
+from transit_time import speed_folder
+from speed_query import QUERY_FOLDER
+
+#  Transit time of any departure at any computed or queried speed, and the best window nearest to it
+#  python transit_query.py project route.gpx 2025 -kt 6 -dt "2025-06-03 14:20"
+#  python transit_query.py project route.gpx 2025 -p 8765
+#  GET /transit?speed=6&departure=2025-06-03T14:20&departure=2025-06-03T15:00, GET /speeds
+#  The timesteps are memory mapped and departures are evenly spaced, a lookup is one subtraction and one array read.
+DEFAULT_PORT = 8765
+
+
+class SpeedIndex:  # one speed, transit timesteps by departure and the minima windows in time order
+
+    def __init__(self, folder: Path):
+        records = load_records(folder.joinpath('timesteps.csv'), save=False)  # a query never writes into the project
+        self.departures = records['departure_index']
+        self.timesteps = records['0']
+        self.first = int(self.departures[0])
+        self.step = int(self.departures[1] - self.departures[0]) if len(self.departures) > 1 else Globals.TIMESTEP
+        self.regular = bool(self.departures[-1] - self.first == self.step * (len(self.departures) - 1))
+        if date_to_index(index_to_date(self.first)) != self.first:
+            raise ValueError(f'{folder} departure indices do not round trip through index_to_date')
+
+        minima = read_cache(folder.joinpath('minima.csv')) if existing_cache_path(folder.joinpath('minima.csv')) else pd.DataFrame()
+        self.windows = {column: pd.to_datetime(minima[column]).to_numpy() if column in minima else np.array([], dtype='datetime64[ns]')
+                        for column in ['start_datetime', 'min_datetime', 'end_datetime']}
+        self.min_et = [str(t) for t in pd.to_timedelta(minima['min_et'])] if 'min_et' in minima else []
+        self.rounded = {column: [str(round_datetime(t)) for t in pd.DatetimeIndex(values)] for column, values in self.windows.items()}  # answers as published
+
+    def positions(self, indices):  # nearest departure at or after each index
+        indices = np.asarray(indices)
+        if self.regular:
+            positions = -((self.first - indices) // self.step)
+        else:
+            positions = np.searchsorted(self.departures, indices)
+        if (positions < 0).any() or (positions >= len(self.departures)).any():
+            raise ValueError(f'departures must be between {index_to_date(self.first)} and {index_to_date(self.departures[-1])}')
+        return positions
+
+    def windows_at(self, departures):  # the window each departure falls in, else the one whose best time is nearest
+        starts, minima, ends = self.windows['start_datetime'], self.windows['min_datetime'], self.windows['end_datetime']
+        if not len(minima):
+            return [None] * len(departures)
+        after = np.minimum(np.searchsorted(minima, departures), len(minima) - 1)
+        before = np.maximum(after - 1, 0)
+        nearest = np.where(np.abs(minima[before] - departures) <= np.abs(minima[after] - departures), before, after)
+        chosen = np.where((starts[before] <= departures) & (departures <= ends[before]), before,
+                          np.where((starts[after] <= departures) & (departures <= ends[after]), after, nearest))
+        rounded = self.rounded
+        return [{'start': rounded['start_datetime'][i], 'best': rounded['min_datetime'][i], 'end': rounded['end_datetime'][i],
+                 'best_transit': self.min_et[i] if self.min_et else None} for i in chosen]
+
+
+class TransitTimeIndex:
+
+    def __init__(self, tt_folder: Path = None, speeds=None):
+        self.folder = Path(tt_folder) if tt_folder else Globals.TRANSIT_TIMES_FOLDER
+        folders = {s: speed_folder(self.folder, s) for s in (Globals.BOAT_SPEEDS if speeds is None else speeds)}
+        for report in self.folder.joinpath(QUERY_FOLDER).glob('*.json'):  # speeds answered by speed_query.py
+            speed = json.loads(report.read_text())['speed']
+            folders.setdefault(speed, speed_folder(self.folder.joinpath(QUERY_FOLDER), speed))
+        self.speeds = {s: SpeedIndex(f) for s, f in folders.items() if existing_cache_path(f.joinpath('timesteps.csv'))}
+
+    def speed(self, speed):  # the key of a speed given as text or a number
+        match = next((s for s in self.speeds if s == float(speed)), None)
+        if match is None:
+            raise ValueError(f'{speed} kts has no transit timesteps, computed speeds are {sorted(self.speeds)}')
+        return match
+
+    def query(self, departures, speed):  # one departure or a list, datetimes or anything pd.Timestamp reads
+        single = isinstance(departures, (str, datetime.datetime, pd.Timestamp, np.datetime64))
+        departures = [departures] if single else list(departures)
+        speed = self.speed(speed)
+        index = self.speeds[speed]
+        positions = index.positions([date_to_index(pd.Timestamp(d)) for d in departures])  # the conversion the velocities were indexed with
+        timesteps = np.asarray(index.timesteps[positions]).astype(np.int64)
+        starts = np.asarray(index.departures[positions]).astype(np.int64).astype('datetime64[s]')
+        arrivals = starts + (timesteps * Globals.TIMESTEP).astype('timedelta64[s]')
+        windows = index.windows_at(starts.astype('datetime64[ns]'))
+        answers = [{'speed': speed, 'departure': str(start).replace('T', ' '), 'transit_timesteps': int(steps),
+                    'transit_time': str(datetime.timedelta(seconds=int(steps) * Globals.TIMESTEP)), 'arrival': str(arrival).replace('T', ' '), 'window': window}
+                   for start, steps, arrival, window in zip(starts, timesteps, arrivals, windows)]
+        return answers[0] if single else answers
+
+
+class TransitQueryHandler(BaseHTTPRequestHandler):
+
+    index: TransitTimeIndex = None
+
+    def reply(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        fields = parse_qs(url.query)
+        try:
+            if url.path == '/speeds':
+                self.reply(200, sorted(self.index.speeds))
+            elif url.path == '/transit':
+                self.reply(200, self.index.query(fields['departure'], fields['speed'][0]))
+            else:
+                self.reply(404, {'error': f'unknown path {url.path}, use /transit or /speeds'})
+        except (KeyError, ValueError) as err:
+            self.reply(400, {'error': str(err)})
+
+    def log_message(self, *args): pass  # a line per request would dominate the time of a query
+
+
+def serve(index: TransitTimeIndex, port=DEFAULT_PORT, host='127.0.0.1'):
+    TransitQueryHandler.index = index
+    server = ThreadingHTTPServer((host, port), TransitQueryHandler)
+    print(f'transit queries for {sorted(index.speeds)} kts on http://{host}:{port}/transit?speed=&departure=', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+
+    ap = argument_parser()
+    ap.add_argument('-kt', '--speed', type=float, help='boat speed of the departures')
+    ap.add_argument('-dt', '--departures', type=str, nargs='+', help='departure date times, one answer each')
+    ap.add_argument('-p', '--port', type=int, nargs='?', const=DEFAULT_PORT, help='serve queries over http on this port')
+    args = vars(ap.parse_args())
+
+    tt_folder = RunStamp(args).transit_times_folder()  # initialize_globals could create or delete folders, a query only reads
+    if tt_folder is None:
+        ap.error(f'no complete run of {args["project_name"]} with these options, run main.py first')
+    transit_index = TransitTimeIndex(tt_folder)
+
+    if args['departures']:
+        for answer in transit_index.query(args['departures'], args['speed']):
+            print(json.dumps(answer))
+    if args['port'] or not args['departures']:
+        serve(transit_index, args['port'] or DEFAULT_PORT)
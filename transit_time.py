@@ -1,27 +1,26 @@
+import numpy as np
 import pandas as pd
-from scipy.signal import savgol_filter
 from num2words import num2words
 from pathlib import Path
 import datetime
 
 from tt_file_tools.file_tools import read_df, write_df, print_file_exists
 from tt_geometry.geometry import Arc
-from tt_job_manager.job_manager import Job
 from tt_date_time_tools.date_time_tools import index_to_date, round_datetime, timedelta_hours_mins
 from tt_globals.globals import Globals
 from tt_gpx.gpx import Route
 
+from binary_cache import cache_exists, existing_cache_path, read_cache, write_cache, load_records, low_memory_enabled
+from shared_buffers import SharedBufferRegistry, attach
+from instrumentation import MeasuredJob, section, cache_lookup
+from extension import PreviousRun, index_offset, shifted, reusable, transit_time_seed
+
 import warnings
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 warnings.simplefilter(action='ignore', category=UserWarning)
 
 
-def none_row(row, df):
-    for c in range(len(df.columns)):
-        df.iloc[row, c] = None
-
-
 def total_transit_time(init_row, d_frame, cols):
     row = init_row
     tt = 0
@@ -32,6 +31,60 @@ def total_transit_time(init_row, d_frame, cols):
     return tt
 
 
+#  Vectorized version of total_transit_time for every row at once, or for the rows given, tests hold it to the scalar chain
+def total_transit_times(row_count, d_frame, cols, rows=None):
+    rows = np.arange(row_count) if rows is None else np.array(rows)
+    tt = np.zeros(len(rows), dtype=int)
+    for col in cols:
+        val = d_frame[col].to_numpy()[rows]
+        tt += val
+        rows += val
+    return tt
+
+
+TRANSIT_CHUNK = 2 ** 16  # departures per chunk in low memory mode
+
+
+#  total_transit_times over a memory mapped record array, one chunk of departures at a time
+#  a chunk reads the elapsed time rows from its first departure to its last arrival, overlapping the next chunk
+def chunked_transit_times(row_count, records, cols, chunk=TRANSIT_CHUNK):
+    tt = np.zeros(row_count, dtype=np.int32)
+    for start in range(0, row_count, chunk):
+        rows = np.arange(start, min(start + chunk, row_count))
+        for col in cols:
+            val = records[col][rows]
+            tt[start:start + len(rows)] += val
+            rows += val
+    return tt
+
+
+#  O(n) equivalent of savgol_filter(values, window, 1): a running mean in the interior and a linear fit at the edges
+def linear_trend(values, window):
+    values = np.asarray(values)
+    n = len(values)
+    if window > n:
+        raise ValueError('window must be less than or equal to the size of values')
+    half = window // 2
+    lead = (window - 1) // 2  # samples before the output point in the interior window
+    total = np.concatenate(([0], np.cumsum(values)))  # integer sums stay exact
+    trend = np.empty(n)
+    trend[half:n - half] = (total[half - lead + window:n - half - lead + window] - total[half - lead:n - half - lead]) / window
+
+    positions = np.arange(window) - (window - 1) / 2
+    for start, fill in [(0, slice(0, half)), (n - window, slice(window - half, window))]:  # first and last half windows
+        edge = values[start:start + window]
+        slope = np.dot(positions, edge) / np.dot(positions, positions)
+        trend[start + fill.start:start + fill.stop] = edge.mean() + slope * positions[fill]
+    return trend
+
+
+MIDLINE_WINDOW = 50000  # samples, the savgol_filter window this replaced
+NOISE_SIZE = 100  # blocks below the midline this long or shorter are noise at the inflections
+
+
+def midline_window(hours): return int(hours * 3600 / Globals.TIMESTEP)  # window in samples
+
+
 class MinimaFrame:
     col_types = {
         'start_datetime': 'DT', 'min_datetime': 'DT', 'end_datetime': 'DT',
@@ -39,123 +92,121 @@ class MinimaFrame:
         'start_round_datetime': 'DT', 'min_round_datetime': 'DT', 'end_round_datetime': 'DT'
     }
 
-    def __init__(self, transit_array, template_df, savgol_path, minima_path):
+    def __init__(self, transit_array, template_df, savgol_path, minima_path, window=MIDLINE_WINDOW, midline=None):
 
         self.frame = None
-        if print_file_exists(minima_path):
-            self.frame = read_df(minima_path)
+        if cache_exists(minima_path):
+            self.frame = read_cache(minima_path)
             for column in self.frame.columns:
                 if MinimaFrame.col_types[column] == 'DT':
                     self.frame[column] = pd.to_datetime(self.frame[column])
                 elif MinimaFrame.col_types[column] == 'TD':
                     self.frame[column] = pd.to_timedelta(self.frame[column])
         else:
-            noise_size = 100
-            self.frame = template_df.copy(deep=True)
-            self.frame = self.frame.assign(tts=transit_array)
-            self.frame.drop(['date_time'], axis=1, inplace=True)  # only needed for debugging
-            if savgol_path.exists():
-                self.frame['midline'] = read_df(savgol_path)['midline']
+            departures = template_df['departure_index'].to_numpy()
+            tts = np.asarray(transit_array)
+            if existing_cache_path(savgol_path):
+                midline = read_cache(savgol_path)['midline'].to_numpy()
             else:
-                # noinspection PyUnresolvedReferences
-                self.frame['midline'] = savgol_filter(transit_array, 50000, 1).round()
-                write_df(self.frame, savgol_path)
-            print_file_exists(savgol_path)
-
-            self.frame['TF'] = self.frame['tts'].lt(
-                self.frame['midline'])  # Above midline = False,  below midline = True
-            self.frame = self.frame.drop(self.frame[self.frame['tts'] == self.frame['midline']].index).reset_index(
-                drop=True)  # remove values that equal midline
-            # noinspection PyUnresolvedReferences
-            self.frame['block'] = (
-                        self.frame['TF'] != self.frame['TF'].shift(1)).cumsum()  # index the blocks of True and False
-            clump_lookup = {index: df for index, df in self.frame.groupby('block') if
-                            df['TF'].any()}  # select only the True blocks
-            clump_lookup = {index: df.drop(['TF', 'block', 'midline'], axis=1).reset_index() for index, df in
-                            clump_lookup.items() if
-                            len(df) > noise_size}  # remove the tiny blocks caused by noise at the inflections
-
-            for index, clump in clump_lookup.items():
-                # for this clump get the row with the minimum transit time
-                # median of the departure indices among the tts minimum values
-                median_departure_index = clump[clump['tts'] == clump.min()['tts']]['departure_index'].median()
-                abs_diff = clump['departure_index'].sub(median_departure_index).abs()  # series of abs differences
-                minimum_index = abs_diff[abs_diff == abs_diff.min()].index[0]  # row closest to median departure index
-                minimum_row = clump.iloc[minimum_index]
-
-                # find the upper and lower limits of the time window
-                offset = int(
-                    minimum_row['tts'] * Globals.TIME_WINDOW_SCALE_FACTOR)  # offset is transit time steps (tts)
-
-                sr_range = clump[clump['departure_index'].lt(
-                    minimum_row['departure_index'])]  # range of valid starting points less than minimum
-                if len(sr_range[sr_range['tts'].gt(
-                        offset)]):  # there is a valid starting point between the beginning and minimum
-                    sr = sr_range[sr_range['tts'].gt(offset)].iloc[-1]  # pick the one closest to minimum
-                else:
-                    sr = clump.iloc[0]
-
-                er_range = clump[clump['departure_index'].gt(
-                    minimum_row['departure_index'])]  # range of valid ending points greater than minimum
-                if len(er_range[
-                           er_range['tts'].gt(offset)]):  # there is a valid starting point between the minimum and end
-                    er = er_range[er_range['tts'].gt(offset)].iloc[0]  # pick the one closest to minimum
-                else:
-                    er = clump.iloc[-1]
-
-                start_row = sr
-                end_row = er
-
-                self.frame.at[minimum_row['index'], 'start_datetime'] = index_to_date(
-                    start_row['departure_index'])  # datetime.timestamp ('<M8[ns]') (datetime64[ns])
-                self.frame.at[minimum_row['index'], 'min_datetime'] = index_to_date(minimum_row['departure_index'])
-                self.frame.at[minimum_row['index'], 'end_datetime'] = index_to_date(end_row['departure_index'])
-                self.frame.at[minimum_row['index'], 'start_et'] = datetime.timedelta(
-                    seconds=int(start_row['tts']) * Globals.TIMESTEP)  # datetime.timedelta (timedelta64[us])
-                self.frame.at[minimum_row['index'], 'min_et'] = datetime.timedelta(
-                    seconds=int(minimum_row['tts']) * Globals.TIMESTEP)
-                self.frame.at[minimum_row['index'], 'end_et'] = datetime.timedelta(
-                    seconds=int(end_row['tts']) * Globals.TIMESTEP)
-
-            self.frame = self.frame.dropna(axis=0).sort_index().reset_index(drop=True)  # remove lines with NA
+                if midline is None:
+                    with section('midline'):
+                        midline = linear_trend(tts, window).round()
+                write_cache(template_df.drop(['date_time'], axis=1).assign(tts=tts, midline=midline), savgol_path)
+            cache_exists(savgol_path)
+
+            with section('minima'):
+                keep, start, minimum, end = midline_windows(departures, tts, midline)
+            departures, tts = departures[keep], tts[keep]
+
+            self.frame = pd.DataFrame({
+                'start_datetime': [index_to_date(d) for d in departures[start]],  # datetime.timestamp ('<M8[ns]') (datetime64[ns])
+                'min_datetime': [index_to_date(d) for d in departures[minimum]],
+                'end_datetime': [index_to_date(d) for d in departures[end]],
+                'start_et': [datetime.timedelta(seconds=int(t) * Globals.TIMESTEP) for t in tts[start]],  # datetime.timedelta (timedelta64[us])
+                'min_et': [datetime.timedelta(seconds=int(t) * Globals.TIMESTEP) for t in tts[minimum]],
+                'end_et': [datetime.timedelta(seconds=int(t) * Globals.TIMESTEP) for t in tts[end]]})
             self.frame['start_round_datetime'] = self.frame['start_datetime'].apply(round_datetime)  # datetime.timestamp ('<M8[ns]') (datetime64[ns])
             self.frame['min_round_datetime'] = self.frame['min_datetime'].apply(round_datetime)
             self.frame['end_round_datetime'] = self.frame['end_datetime'].apply(round_datetime)
 
-            self.frame.drop(['tts', 'departure_index', 'midline', 'block', 'TF'], axis=1, inplace=True)
-            write_df(self.frame, minima_path)
-            print_file_exists(minima_path)
-
-
+            print_file_exists(write_cache(self.frame, minima_path))
+
+
+def midline_windows(departures, tts, midline, noise_size=NOISE_SIZE):  # rows kept and the windows among them
+    keep = np.flatnonzero(tts != midline)  # remove values that equal midline
+    start, minimum, end = minima_windows(departures[keep], tts[keep], tts[keep] < midline[keep], noise_size)
+    return keep, start, minimum, end
+
+
+def minima_windows(departures, tts, below, noise_size):  # row positions of the start, minimum and end of every window
+    # blocks of rows below the midline, longer than the noise at the inflections
+    boundaries = np.flatnonzero(below[1:] != below[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(tts)]))
+    clumps = below[starts] & (ends - starts > noise_size)
+    starts, ends = starts[clumps], ends[clumps]
+    if not len(starts):
+        return starts, starts, starts
+
+    # every row of every clump laid end to end, offsets are where each clump begins
+    lengths = ends - starts
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    rows = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+    clump = np.repeat(np.arange(len(starts)), lengths)
+    clump_tts = tts[rows]
+
+    # median of the departure indices among the tts minimum values, then the row closest to it
+    lowest = np.minimum.reduceat(clump_tts, offsets)
+    tied = clump_tts == lowest[clump]
+    ties = rows[tied]
+    counts = np.bincount(clump[tied], minlength=len(starts))
+    first = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    median = (departures[ties[first + (counts - 1) // 2]] + departures[ties[first + counts // 2]]) / 2
+    after = np.searchsorted(departures, median)
+    before = np.maximum(after - 1, starts)
+    minimum = np.where(median - departures[before] <= departures[after] - median, before, after)
+
+    # closest rows on either side of the minimum whose transit time is above the offset, else the ends of the clump
+    offset = (tts[minimum] * Globals.TIME_WINDOW_SCALE_FACTOR).astype(int)  # offset is transit time steps (tts)
+    above = clump_tts > offset[clump]
+    position = np.arange(len(rows))
+    last_above = np.maximum.accumulate(np.where(above, position, -1))
+    next_above = np.minimum.accumulate(np.where(above, position, len(rows))[::-1])[::-1]
+    local = offsets + minimum - starts
+    last_end = offsets + lengths - 1
+    candidate = last_above[np.maximum(local - 1, 0)]
+    start = np.where((local > offsets) & (candidate >= offsets), candidate, offsets)
+    candidate = next_above[np.minimum(local + 1, len(rows) - 1)]
+    end = np.where((local < last_end) & (candidate <= last_end), candidate, last_end)
+    return rows[start], minimum, rows[end]
+
+
+#  per date arc number, days with two arcs get an empty third row so every day of the table has the same shape
 def index_arc_df(frame):
-    output_frame = pd.DataFrame(columns=['idx'] + frame.columns.to_list())
-
-    date_arr_dict = {key: [] for key in sorted(list(set(frame['date'])))}
-
-    for i, row in frame.iterrows():
-        date_arr_dict[row['date']].append(row)
-
-    for key in date_arr_dict.keys():
-        for i in range(len(date_arr_dict[key])):
-            output_frame.loc[len(output_frame)] = [i + 1] + date_arr_dict[key][i].tolist()
-        if len(date_arr_dict[key]) == 2:
-            last_row_dict = output_frame.loc[len(output_frame) - 1].to_dict()
-            new_dict = {key: None for key in last_row_dict}
-            new_dict.update({'idx': 3, 'date': last_row_dict['date']})
-            output_frame.loc[len(output_frame)] = new_dict
-
-    return output_frame
+    if not len(frame):
+        return pd.DataFrame(columns=['idx'] + frame.columns.to_list())
+    frame = frame.sort_values(by=['date'], kind='stable')
+    frame.insert(loc=0, column='idx', value=frame.groupby('date', sort=False).cumcount().to_numpy() + 1)
+    counts = frame.groupby('date', sort=False)['date'].transform('size').to_numpy()
+    second_of_two = np.flatnonzero((counts == 2) & (frame['idx'].to_numpy() == 2))
+    if not len(second_of_two):
+        return frame.reset_index(drop=True)
+    frame = frame.astype({column: object for column in frame.columns if column != 'idx'})  # padding rows hold None, as in the row by row loop this replaced
+    padding = pd.DataFrame(np.full((len(second_of_two), len(frame.columns)), None, dtype=object), columns=frame.columns)
+    padding['idx'] = 3
+    padding['date'] = frame['date'].iloc[second_of_two].to_numpy()
+    order = np.concatenate([np.arange(len(frame)), second_of_two + 0.5])  # each padding row right after the second arc of its day
+    output_frame = pd.concat([frame, padding], ignore_index=True).iloc[np.argsort(order, kind='stable')]
+    return output_frame.reset_index(drop=True)
 
 
 def create_arcs(f_day, l_day, minima_frame):
-    arcs = [Arc(row.to_dict()) for i, row in minima_frame.iterrows()]
+    arcs = [Arc(row) for row in minima_frame.to_dict('records')]
     next_day_arcs = [arc.next_day_arc for arc in arcs if arc.next_day_arc]
     all_arcs = arcs + next_day_arcs
     all_good_arcs = [arc for arc in all_arcs if not arc.zero_angle]
 
-    arcs_df = pd.DataFrame(columns=Arc.columns)
-    for d in [a.arc_dict for a in all_good_arcs]:
-        arcs_df.loc[len(arcs_df)] = d
+    arcs_df = pd.DataFrame([a.arc_dict for a in all_good_arcs], columns=Arc.columns)
 
     # noinspection PyTypeChecker
     arcs_df.insert(loc=0, column='date', value=None)
@@ -172,57 +223,94 @@ def create_arcs(f_day, l_day, minima_frame):
     return arcs_df
 
 
+def speed_folder(tt_folder: Path, speed): return tt_folder.joinpath(num2words(speed))
+
+
+ROUNDED_DROP_COLUMNS = ['start_datetime', 'min_datetime', 'end_datetime', 'start_angle', 'min_angle', 'end_angle']
+
+
+def write_transit_times(speed, minima_df, f_day, l_day, transit_times_path, rounded_transit_times_path):  # arcs of the minima windows
+    with section('arcs'):
+        frame = create_arcs(f_day, l_day, minima_df)
+    if frame.duplicated().any():
+        print(f'Duplicates in {speed}')
+    frame['speed'] = speed
+
+    transit_time_path = write_df(frame, transit_times_path)
+    print_file_exists(transit_time_path)
+
+    rounded_transit_time_path = write_df(frame.drop(ROUNDED_DROP_COLUMNS, axis=1), rounded_transit_times_path)
+    print_file_exists(rounded_transit_time_path)
+    return transit_time_path, rounded_transit_time_path
+
+
+#  timesteps of an earlier run where every elapsed time the passage crosses is unchanged, the other departures computed
+def seeded_transit_times(row_count, et_df: pd.DataFrame, cols, seed):
+    old_et, old_tt = read_cache(seed[0]), read_cache(seed[1])
+    offset = index_offset(et_df['departure_index'], old_et['departure_index'])
+    if offset is None or offset != index_offset(et_df['departure_index'], old_tt['departure_index']) or set(cols) - set(old_et.columns):
+        return total_transit_times(row_count, et_df, cols)
+    unchanged = np.ones(len(et_df), dtype=bool)
+    for col in cols:
+        values, known = shifted(old_et[col].to_numpy(), offset, len(et_df))
+        unchanged &= known & (values == et_df[col].to_numpy())
+    reuse, tt = reusable(unchanged, old_tt['0'].to_numpy(), offset, row_count)
+    tt = tt.astype(int)
+    positions = np.flatnonzero(~reuse)
+    tt[positions] = total_transit_times(row_count, et_df, cols, positions)
+    print(f'transit timesteps reused for {row_count - len(positions)} of {row_count} departures', flush=True)
+    return tt
+
+
 class TransitTimeDataframe:
 
-    def __init__(self, speed, template_df: pd.DataFrame, et_file: Path, tt_folder, f_day, l_day):
+    def __init__(self, speed, template_df: pd.DataFrame, et_file: Path, tt_folder, f_day, l_day, window=MIDLINE_WINDOW, seed=None):
 
+        template_df = attach(template_df)
         self.transit_time_path = None
         self.rounded_transit_time_path = None
-        folder = tt_folder.joinpath(num2words(speed))
+        folder = speed_folder(tt_folder, speed)
         transit_times_path = folder.joinpath('transit_times.csv')
         rounded_transit_times_path = folder.joinpath('rounded_transit_times.csv')
 
         timesteps_path = folder.joinpath('timesteps.csv')
         savgol_path = folder.joinpath('savgol.csv')
         minima_path = folder.joinpath('minima.csv')
-        row_range = range(len(template_df))
-        rounded_drop_columns = ['start_datetime', 'min_datetime', 'end_datetime', 'start_angle', 'min_angle', 'end_angle']
 
-        if print_file_exists(transit_times_path):
+        if cache_lookup(print_file_exists(transit_times_path)):
             self.transit_time_path = transit_times_path
             if print_file_exists(rounded_transit_times_path):
                 self.rounded_transit_time_path = rounded_transit_times_path
             else:
                 frame = read_df(transit_times_path)
-                self.rounded_transit_time_path = write_df(frame.drop(rounded_drop_columns, axis=1), rounded_transit_times_path)
+                self.rounded_transit_time_path = write_df(frame.drop(ROUNDED_DROP_COLUMNS, axis=1), rounded_transit_times_path)
         else:
-            et_df = read_df(et_file)
-            if print_file_exists(timesteps_path):
-                transit_timesteps_arr = list(read_df(timesteps_path)['0'].to_numpy())
+            if cache_exists(timesteps_path):
+                transit_timesteps_arr = read_cache(timesteps_path)['0'].to_numpy()
             else:
-                col_list = et_df.columns.to_list()
-                col_list.remove('departure_index')
-                col_list.remove('date_time')
-
-                transit_timesteps_arr = [total_transit_time(row, et_df, col_list) for row in row_range]
-                write_df(pd.concat([template_df, pd.DataFrame(transit_timesteps_arr)], axis=1), timesteps_path)
-                print_file_exists(timesteps_path)
-
-            minima_df = MinimaFrame(transit_timesteps_arr, template_df, savgol_path, minima_path).frame
-
-            frame = create_arcs(f_day, l_day, minima_df)
-            if frame.duplicated().any():
-                print(f'Duplicates in {speed}')
-            frame['speed'] = speed
+                if low_memory_enabled():  # the elapsed time frame is never loaded whole
+                    records = load_records(et_file)
+                    col_list = [c for c in records.dtype.names if c not in ['departure_index', 'date_time']]
+                    with section('transit timesteps'):
+                        transit_timesteps_arr = chunked_transit_times(len(template_df), records, col_list)
+                else:
+                    et_df = read_cache(et_file)
+                    col_list = et_df.columns.to_list()
+                    col_list.remove('departure_index')
+                    col_list.remove('date_time')
 
-            self.transit_time_path = write_df(frame, transit_times_path)
-            print_file_exists(self.transit_time_path)
+                    with section('transit timesteps'):
+                        if seed:
+                            transit_timesteps_arr = seeded_transit_times(len(template_df), et_df, col_list, seed)
+                        else:
+                            transit_timesteps_arr = total_transit_times(len(template_df), et_df, col_list)
+                print_file_exists(write_cache(pd.concat([template_df, pd.DataFrame(transit_timesteps_arr)], axis=1), timesteps_path))
 
-            self.rounded_transit_time_path = write_df(frame.drop(rounded_drop_columns, axis=1), rounded_transit_times_path)
-            print_file_exists(self.rounded_transit_time_path)
+            minima_df = MinimaFrame(transit_timesteps_arr, template_df, savgol_path, minima_path, window).frame
+            self.transit_time_path, self.rounded_transit_time_path = write_transit_times(speed, minima_df, f_day, l_day, transit_times_path, rounded_transit_times_path)
 
 
-class TransitTimeJob(Job):  # super -> job name, result key, function/object, arguments
+class TransitTimeJob(MeasuredJob):  # super -> job name, result key, function/object, arguments
 
     def execute(self): return super().execute()
 
@@ -230,28 +318,46 @@ class TransitTimeJob(Job):  # super -> job name, result key, function/object, ar
 
     def error_callback(self, result): return super().error_callback(result)
 
-    def __init__(self, speed, et_frame: pd.DataFrame, tt_folder: Path):
+    def __init__(self, speed, et_frame: pd.DataFrame, tt_folder: Path, registry: SharedBufferRegistry = None, window=MIDLINE_WINDOW, prefix='', seed=None):
         job_name = 'transit_time' + ' ' + str(speed)
-        result_key = speed
+        result_key = prefix + str(speed) if prefix else speed
+        template_df = Globals.TEMPLATE_TRANSIT_TIME_DATAFRAME
+        if registry:
+            template_df = registry.publish_frame(('transit time template', Globals.YEAR), template_df)
         arguments = tuple(
-            [speed, Globals.TEMPLATE_TRANSIT_TIME_DATAFRAME, et_frame, tt_folder, Globals.FIRST_DAY, Globals.LAST_DAY])
+            [speed, template_df, et_frame, tt_folder, Globals.FIRST_DAY, Globals.LAST_DAY, window, seed])
         super().__init__(job_name, result_key, TransitTimeDataframe, arguments)
 
 
-def transit_time_processing(job_manager, route: Route):
+def transit_time_processing(job_manager, route: Route, registry: SharedBufferRegistry = None, window=MIDLINE_WINDOW, prefix='', previous: PreviousRun = None):
     print(f'\nCalculating transit timesteps')
-    keys = [job_manager.put(TransitTimeJob(speed, route.elapsed_time_csv_to_speed[speed], Globals.TRANSIT_TIMES_FOLDER)) for speed in Globals.BOAT_SPEEDS]
+    keys = [job_manager.put(TransitTimeJob(speed, route.elapsed_time_csv_to_speed[speed], Globals.TRANSIT_TIMES_FOLDER, registry, window, prefix,
+                                           transit_time_seed(previous, speed) if previous else None)) for speed in Globals.BOAT_SPEEDS]
     # for speed in Globals.BOAT_SPEEDS:
     #     job = TransitTimeJob(speed, route.elapsed_time_csv_to_speed[speed], Globals.TRANSIT_TIMES_FOLDER)
     #     result = job.execute()
     job_manager.wait()
 
-    for key in keys:
-        print(f'Posting transit times paths to route for speed {key}')
-        result = job_manager.get(key)
-        route.transit_time_csv_to_speed[key] = result.transit_time_path
-        route.rounded_transit_time_csv_to_speed[key] = result.rounded_transit_time_path
+    for speed, key in zip(Globals.BOAT_SPEEDS, keys):
+        post_transit_times(route, speed, job_manager.get(key))
+
+    aggregate_transit_times(route)
+
+
+def post_transit_times(route: Route, speed, result):
+    print(f'Posting transit times paths to route for speed {speed}')
+    route.transit_time_csv_to_speed[speed] = result.transit_time_path
+    route.rounded_transit_time_csv_to_speed[speed] = result.rounded_transit_time_path
+
+
+def post_cached_transit_times(route: Route, speed):  # transit times of an earlier run that are still current
+    print(f'Posting transit times paths to route for speed {speed}')
+    folder = speed_folder(Globals.TRANSIT_TIMES_FOLDER, speed)
+    route.transit_time_csv_to_speed[speed] = folder.joinpath('transit_times.csv')
+    route.rounded_transit_time_csv_to_speed[speed] = folder.joinpath('rounded_transit_times.csv')
+
 
+def aggregate_transit_times(route: Route):
     print(f'\nAggregating transit times', flush=True)
 
     aggregate_transit_time_df = pd.concat([read_df(route.rounded_transit_time_csv_to_speed[key]) for key in
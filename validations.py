@@ -1,114 +1,168 @@
+import numpy as np
 import pandas as pd
+from pathlib import Path
+
 from tt_geometry.geometry import time_to_degrees
 from tt_globals.globals import Globals
 from tt_noaa_data.noaa_data import noaa_tide_dataframe, noaa_slack_dataframe
-from tt_date_time_tools.date_time_tools import date_to_index
+from tt_file_tools.file_tools import write_df, print_file_exists
+
+from binary_cache import existing_cache_path, read_cache
+from transit_time import speed_folder
+from instrumentation import MeasuredJob
+
+#  Best departure times published by NOAA slack and tide predictions set against the computed minima. Every computed
+#  minimum is joined to the nearest reference time of each kind for the direction of the route, errors are minutes late
+#  (+) or early (-).
+MATCH_TOLERANCE = pd.Timedelta(hours=3)  # a reference further than this from a minimum belongs to another window
 
 
+#  per date arc number, in the order the frame lists them
 def index_arc_df(frame):
-    date_time_dict = {key: [] for key in sorted(list(set(frame['start_date'])))}
-    date_angle_dict = {key: [] for key in sorted(list(set(frame['start_date'])))}
-    date_name_dict = {key: [] for key in sorted(list(set(frame['start_date'])))}
-    columns = frame.columns.to_list()
-    for i, row in frame.iterrows():
-        date_time_dict[row.iloc[columns.index('start_date')]].append(row.iloc[columns.index('time')])
-        date_angle_dict[row.iloc[columns.index('start_date')]].append(row.iloc[columns.index('angle')])
-        date_name_dict[row.iloc[columns.index('start_date')]].append(row.iloc[columns.index('graphic_name')])
-
-    df = pd.DataFrame(columns=['start_date', 'name', 'time', 'angle'])
-    for key in date_time_dict.keys():
-        times = date_time_dict[key]
-        angles = date_angle_dict[key]
-        names = date_name_dict[key]
-        for i in range(len(times)):
-            df.loc[len(df.name)] = [key, names[i] + ' ' + str(i + 1), times[i], angles[i]]
-    return df
-
-
-def hell_gate_validation():
+    frame = frame.sort_values('start_date', kind='stable')
+    number = frame.groupby('start_date', sort=False).cumcount() + 1
+    return pd.DataFrame({'start_date': frame['start_date'].to_numpy(), 'name': (frame['graphic_name'] + ' ' + number.astype(str)).to_numpy(),
+                         'time': frame['time'].to_numpy(), 'angle': frame['angle'].to_numpy(), 'date_time': frame['date_time'].to_numpy()})
+
+
+def reference_times(date_times, graphic_name):  # best departure times with their date, time and angle
+    date_times = pd.to_datetime(pd.Series(date_times)).astype('datetime64[ns]').reset_index(drop=True)
+    frame = pd.DataFrame({'date_time': date_times, 'start_date': date_times.dt.date, 'time': date_times.dt.time})
+    frame['angle'] = frame['time'].map(time_to_degrees)
+    return frame.assign(graphic_name=graphic_name)
+
+
+def slack_frame(first_day, last_day, wp_code):
+    noaa_frame = noaa_slack_dataframe(first_day, last_day, wp_code)
+    noaa_frame = noaa_frame.rename(columns={'Time': 'date_time', ' Velocity_Major': 'velocity', ' Type': 'type'})
+    noaa_frame['date_time'] = pd.to_datetime(noaa_frame['date_time'])
+    return noaa_frame.sort_values('date_time', kind='stable', ignore_index=True)
+
+
+def hell_gate_validation(first_day, last_day, first_download_day=None, last_download_day=None):
     # flood current is to the north & east, ebb current is to the south & west
     # northbound depart hell gate slack water - flood begins (low tide)
     # southbound depart hell gate slack water - ebb begins (high tide)
     wp_code = "NYH1924"
 
-    noaa_frame = noaa_slack_dataframe(Globals.FIRST_DAY, Globals.LAST_DAY, wp_code)
-    noaa_frame.rename(columns={'Time': 'date_time', ' Velocity_Major': 'velocity', ' Type': 'type'}, inplace=True)
-    noaa_frame['date_index'] = noaa_frame['date_time'].apply(date_to_index)
+    noaa_frame = slack_frame(first_day, last_day, wp_code)
+    return index_arc_df(reference_times(noaa_frame.loc[noaa_frame['type'] == 'slack', 'date_time'], 'HG'))
+
 
-    slack_frame = noaa_frame[noaa_frame['type'] == 'slack']
-    slack_frame.sort_values('date_time')
-    slack_frame['start_date'] = slack_frame['date_time'].apply(pd.to_datetime).dt.date
-    slack_frame['time'] = slack_frame['date_time'].apply(pd.to_datetime).dt.time
-    slack_frame['angle'] = slack_frame['time'].apply(time_to_degrees)
-    slack_frame = slack_frame.filter(['start_date', 'time', 'angle'])
-    slack_frame = slack_frame.assign(graphic_name='HG')
-    slack_frame = index_arc_df(slack_frame)
-    return slack_frame
+def battery_after(first_day, last_day, high_low, hours, graphic_name):  # departures some hours after high or low water at the battery
+    wp_code = "8518750"
+
+    frame = noaa_tide_dataframe(first_day, last_day, wp_code)
+    date_times = pd.to_datetime(frame['date_time'])
+    return index_arc_df(reference_times(date_times[frame['HL'] == high_low] + pd.Timedelta(hours=hours), graphic_name))
 
 
-def battery_validation():
+def battery_north_validation(first_day, last_day, first_download_day=None, last_download_day=None):
     # flood current is to the north & east, ebb current is to the south & west
     # northbound depart 4.5 hours after low water at the battery
-    # southbound depart 4 hours after high water at the battery
-    wp_code = "8518750"
+    return battery_after(first_day, last_day, 'L', 4.5, 'BN')
+
 
-    frame = noaa_tide_dataframe(Globals.FIRST_DAY, Globals.LAST_DAY, wp_code)
+def battery_south_validation(first_day, last_day, first_download_day=None, last_download_day=None):
+    # southbound depart 4 hours after high water at the battery
+    return battery_after(first_day, last_day, 'H', 4, 'BS')
 
-    north_df = frame[frame['HL'] == 'L']
-    north_df.insert(len(north_df.columns), 'best_time', north_df['date_time'].apply(pd.to_datetime) + pd.Timedelta(hours=4.5))
-    north_df = north_df.assign(graphic_name='BN')
-    south_df = frame[frame['HL'] == 'H']
-    south_df.insert(len(south_df.columns), 'best_time', south_df['date_time'].apply(pd.to_datetime) + pd.Timedelta(hours=4))
-    south_df = south_df.assign(graphic_name='BS')
 
-    best_df = pd.concat([north_df.drop(['date', 'time', 'HL', 'date_time'], axis=1), south_df.drop(['date', 'time', 'HL', 'date_time'], axis=1)], ignore_index=True)
-    best_df['start_date'] = best_df['best_time'].dt.date
-    best_df['time'] = best_df['best_time'].dt.time
-    best_df['angle'] = best_df['time'].apply(time_to_degrees)
-    best_df = best_df.drop(['best_time'], axis=1)
-    best_df = index_arc_df(best_df)
-    return best_df
+def slack_before(first_day, last_day, first_download_day, last_download_day, wp_code, current, minutes, graphic_name):  # departures ahead of the slack a current begins at
+    noaa_frame = slack_frame(first_download_day, last_download_day, wp_code)
+    date_times = noaa_frame.loc[noaa_frame['type'].shift(-1) == current, 'date_time'] - pd.Timedelta(minutes=minutes)
+    date_times = date_times[(date_times >= first_day) & (date_times < last_day)]
+    return index_arc_df(reference_times(date_times, graphic_name))
 
 
-def chesapeake_city_validation():
+def chesapeake_city_validation(first_day, last_day, first_download_day, last_download_day):
     # eastbound depart 3 minutes before "Slack Water Flood Begins" at the Chesapeake City station for the very beginning of a fair current
-    wp_code = "cb1301"
+    return slack_before(first_day, last_day, first_download_day, last_download_day, "cb1301", 'flood', 3, 'CC')
 
-    noaa_frame = noaa_slack_dataframe(Globals.FIRST_DOWNLOAD_DAY, Globals.LAST_DOWNLOAD_DAY, wp_code)
-    noaa_frame.rename(columns={'Time': 'date_time', ' Velocity_Major': 'velocity', ' Type': 'type'}, inplace=True)
-    slack_frame = noaa_frame[noaa_frame['type'].shift(-1) == 'flood']
-    slack_frame['date_time'] = slack_frame['date_time'].apply(pd.to_datetime) - pd.Timedelta(minutes=3)
-    slack_frame = slack_frame[slack_frame['date_time'] >= Globals.FIRST_DAY]
-    slack_frame = slack_frame[slack_frame['date_time'] < Globals.LAST_DAY]
-    slack_frame['date_index'] = slack_frame['date_time'].apply(date_to_index)
 
-    slack_frame['start_date'] = slack_frame['date_time'].apply(pd.to_datetime).dt.date
-    slack_frame['time'] = slack_frame['date_time'].apply(pd.to_datetime).dt.time
-    slack_frame['angle'] = slack_frame['time'].apply(time_to_degrees)
+def reedy_point_tower_validation(first_day, last_day, first_download_day, last_download_day):
+    # westbound depart 7 minutes before "Slack Water Ebb Begins" at the Reedy Point Tower station for the very beginning of a fair current
+    return slack_before(first_day, last_day, first_download_day, last_download_day, "ACT6256", 'ebb', 7, 'RP')
 
-    slack_frame = slack_frame.filter(['start_date', 'time', 'angle'])
-    slack_frame = slack_frame.assign(graphic_name='CC')
-    slack_frame = index_arc_df(slack_frame)
-    return slack_frame
 
+#  heading of the flood current, then the validations of a route heading with the flood and of one heading against it
+VALIDATIONS = {'east_river': (45, [hell_gate_validation, battery_north_validation], [hell_gate_validation, battery_south_validation]),
+               'chesapeake_delaware_canal': (90, [chesapeake_city_validation], [reedy_point_tower_validation])}
 
-def reedy_point_tower_validation():
-    # westbound depart 7 minutes before "Slack Water Ebb Begins" at the Reedy Point Tower station for the very beginning of a fair current
-    wp_code = "ACT6256"
-
-    noaa_frame = noaa_slack_dataframe(Globals.FIRST_DOWNLOAD_DAY, Globals.LAST_DOWNLOAD_DAY, wp_code)
-    noaa_frame.rename(columns={'Time': 'date_time', ' Velocity_Major': 'velocity', ' Type': 'type'}, inplace=True)
-    slack_frame = noaa_frame[noaa_frame['type'].shift(-1) == 'ebb']
-    slack_frame['date_time'] = slack_frame['date_time'].apply(pd.to_datetime) - pd.Timedelta(minutes=7)
-    slack_frame = slack_frame[slack_frame['date_time'] >= Globals.FIRST_DAY]
-    slack_frame = slack_frame[slack_frame['date_time'] < Globals.LAST_DAY]
-    slack_frame['date_index'] = slack_frame['date_time'].apply(date_to_index)
-
-    slack_frame['start_date'] = slack_frame['date_time'].apply(pd.to_datetime).dt.date
-    slack_frame['time'] = slack_frame['date_time'].apply(pd.to_datetime).dt.time
-    slack_frame['angle'] = slack_frame['time'].apply(time_to_degrees)
-
-    slack_frame = slack_frame.filter(['start_date', 'time', 'angle'])
-    slack_frame = slack_frame.assign(graphic_name='RP')
-    slack_frame = index_arc_df(slack_frame)
-    return slack_frame
+
+def route_validations(name, heading):  # the validations for the direction of the route
+    flood_heading, with_flood, against_flood = VALIDATIONS[name]
+    return with_flood if np.cos(np.radians(heading - flood_heading)) > 0 else against_flood
+
+
+class ValidationReference:  # reference times of one validation, fetched in a worker while the route is computed
+
+    def __init__(self, name, heading, first_day, last_day, first_download_day, last_download_day):
+        frames = [validation(first_day, last_day, first_download_day, last_download_day) for validation in route_validations(name, heading)]
+        self.name = name
+        self.frame = pd.concat(frames).sort_values(['start_date'], kind='stable', ignore_index=True)
+
+
+class ValidationReferenceJob(MeasuredJob):  # super -> job name, result key, function/object, arguments
+
+    def execute(self): return super().execute()
+    def execute_callback(self, result): return super().execute_callback(result)
+    def error_callback(self, result): return super().error_callback(result)
+
+    def __init__(self, name, heading):
+        arguments = tuple([name, heading, Globals.FIRST_DAY, Globals.LAST_DAY, Globals.FIRST_DOWNLOAD_DAY, Globals.LAST_DOWNLOAD_DAY])
+        super().__init__(name + ' validation', name + '_validation', ValidationReference, arguments)
+
+
+def computed_minima(tt_folder: Path, speeds):  # minimum of every window of every speed
+    frames = []
+    for speed in speeds:
+        path = existing_cache_path(speed_folder(tt_folder, speed).joinpath('minima.csv'))
+        if path:
+            frames.append(pd.DataFrame({'speed': speed, 'min_datetime': pd.to_datetime(read_cache(path)['min_datetime']).astype('datetime64[ns]')}))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame({'speed': [], 'min_datetime': pd.Series(dtype='datetime64[ns]')})
+
+
+def validation_errors(reference: pd.DataFrame, minima: pd.DataFrame, tolerance=MATCH_TOLERANCE):  # every minimum against the nearest reference of each kind
+    references = reference.assign(reference=reference['name'].str.rsplit(' ', n=1).str[0])
+    references = references[['reference', 'date_time']].rename(columns={'date_time': 'reference_datetime'}).sort_values('reference_datetime')
+    references['reference_datetime'] = references['reference_datetime'].astype('datetime64[ns]')  # merge_asof needs one resolution
+    minima = minima.dropna(subset=['min_datetime']).astype({'min_datetime': 'datetime64[ns]'}).merge(references[['reference']].drop_duplicates(), how='cross')
+    errors = pd.merge_asof(minima.sort_values('min_datetime'), references, left_on='min_datetime', right_on='reference_datetime',
+                           by='reference', direction='nearest', tolerance=tolerance)
+    errors['date'] = errors['min_datetime'].dt.date
+    errors['error_minutes'] = (errors['min_datetime'] - errors['reference_datetime']).dt.total_seconds() / 60
+    return errors.sort_values(['reference', 'speed', 'min_datetime'], ignore_index=True)[['reference', 'speed', 'date', 'min_datetime', 'reference_datetime', 'error_minutes']]
+
+
+def error_statistics(errors: pd.DataFrame, keys):  # bias and size of the errors per group, unmatched minima are counted apart
+    absolute = errors.assign(abs_error=errors['error_minutes'].abs())
+    groups = absolute.groupby(keys, sort=True)
+    frame = groups.agg(windows=('min_datetime', 'size'), matched=('error_minutes', 'count'), mean_error=('error_minutes', 'mean'),
+                       mean_abs_error=('abs_error', 'mean'), median_abs_error=('abs_error', 'median'), max_abs_error=('abs_error', 'max'))
+    frame['p95_abs_error'] = groups['abs_error'].quantile(0.95)
+    return frame.round(1).reset_index()
+
+
+class ValidationReport:
+
+    def __init__(self, reference: ValidationReference, tt_folder: Path, speeds):
+        name = reference.name
+        errors = validation_errors(reference.frame, computed_minima(tt_folder, speeds))
+        self.filepaths = [write_df(reference.frame.drop(columns=['date_time']), tt_folder.joinpath(name + '_validation.csv')),
+                          write_df(errors, tt_folder.joinpath(name + '_validation_errors.csv')),
+                          write_df(error_statistics(errors, ['reference', 'speed', 'date']), tt_folder.joinpath(name + '_validation_daily.csv')),
+                          write_df(error_statistics(errors, ['reference', 'speed']), tt_folder.joinpath(name + '_validation_speeds.csv'))]
+        self.summary = error_statistics(errors, ['reference', 'speed'])
+
+
+def validation_names(args): return [name for name in VALIDATIONS if args.get(name)]
+
+
+def validation_reports(references, tt_folder: Path, speeds):
+    for reference in references:
+        report = ValidationReport(reference, tt_folder, speeds)
+        print(f'\n{report.filepaths[0].stem} minutes late (+) or early (-)')
+        print(report.summary.to_string(index=False))
+        for path in report.filepaths:
+            print_file_exists(path)
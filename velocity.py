@@ -1,29 +1,52 @@
+import numpy as np
 import pandas as pd
 from scipy.interpolate import CubicSpline
 from pathlib import Path
 
 from tt_noaa_data.noaa_data import noaa_current_dataframe
-from tt_file_tools.file_tools import read_df, write_df, print_file_exists
+from tt_file_tools.file_tools import write_df
 from tt_date_time_tools.date_time_tools import date_to_index
-from tt_job_manager.job_manager import Job
-from tt_gpx.gpx import Waypoint
+from tt_gpx.gpx import Waypoint, InterpolatedWP
 from tt_globals.globals import Globals
 
+from binary_cache import cache_exists, read_cache, write_cache
+from station_cache import StationCache
+from instrumentation import MeasuredJob, section, cache_lookup
+from extension import SEAM, index_offset, shifted, trusted_positions, runs
+
 
 def dash_to_zero(value): return 0.0 if str(value).strip() == '-' else value
 
 
+#  evaluates each station's spline on the whole index at once, stations sharing a time grid share one spline call
+def resample(index, stations):  # stations is a list of (date_index, velocity) pairs
+    index = np.asarray(index)
+    grids = {}
+    for i, (date_index, velocity) in enumerate(stations):
+        grids.setdefault(np.asarray(date_index).tobytes(), []).append(i)
+    velocities = [None] * len(stations)
+    for members in grids.values():
+        cs = CubicSpline(stations[members[0]][0], np.column_stack([stations[i][1] for i in members]))
+        values = cs(index)
+        for column, i in enumerate(members):
+            velocities[i] = values[:, column]
+    return velocities
+
+
 class DownloadedVelocityCSV:
 
-    def __init__(self, fdd, ldd, ndd, ndi, folder: Path, code: str):
+    def __init__(self, fdd, ldd, ndd, ndi, folder: Path, code: str, station_cache: StationCache = None):
 
         self.filepath = None
         filepath = folder.joinpath(Globals.WAYPOINT_DATAFILE_NAME)
 
-        if filepath.exists():
+        if cache_lookup(filepath.exists()):
             self.filepath = filepath
         else:
-            downloaded_frame = noaa_current_dataframe(fdd, ldd, code)
+            if station_cache:
+                downloaded_frame = station_cache.frame(code, fdd, ldd)
+            else:
+                downloaded_frame = noaa_current_dataframe(fdd, ldd, code)
             downloaded_frame['date_index'] = downloaded_frame['Time'].apply(date_to_index)
             write_df(downloaded_frame, folder.joinpath('orig_velocity_download.csv'))
 
@@ -32,52 +55,147 @@ class DownloadedVelocityCSV:
             frame['date_index'] = ndi
 
             cs = CubicSpline(downloaded_frame['date_index'], downloaded_frame[' Velocity_Major'])
-            frame['velocity'] = frame['date_index'].apply(cs)
+            frame['velocity'] = cs(frame['date_index'].to_numpy())
             frame['velocity'] = frame['velocity'].round(decimals=3)
 
             self.filepath = write_df(frame, filepath)
 
 
-class DownloadVelocityJob(Job):  # super -> job name, result key, function/object, arguments
+class DownloadVelocityJob(MeasuredJob):  # super -> job name, result key, function/object, arguments
 
     def execute(self): return super().execute()
     def execute_callback(self, result): return super().execute_callback(result)
     def error_callback(self, result): return super().error_callback(result)
 
-    def __init__(self, fdd, ldd, ndd, ndi, wp):
+    def __init__(self, fdd, ldd, ndd, ndi, wp, station_cache: StationCache = None):
         result_key = id(wp)
         # arguments = tuple([global_class.FIRST_DOWNLOAD_DAY, global_class.LAST_DOWNLOAD_DAY, global_class.NORMALIZED_DOWNLOAD_DATES, global_class.NORMALIZED_DOWNLOAD_INDICES, wp.folder, wp.code])
-        arguments = tuple([fdd, ldd, ndd, ndi, wp.folder, wp.code])
+        arguments = tuple([fdd, ldd, ndd, ndi, wp.folder, wp.code, station_cache])
         super().__init__(wp.unique_name, result_key, DownloadedVelocityCSV, arguments)
 
 
+class InlineJobManager:  # runs each job as it is put, for work that puts jobs of its own inside a worker
+
+    def __init__(self):
+        self.results = {}
+
+    def put(self, job):
+        key, result = job.execute()
+        self.results[key] = result
+        return key
+
+    def wait(self): pass
+    def get(self, key): return self.results[key]
+
+
+class InterpolatedVelocityCSV:  # the interpolation's own jobs run in this worker, the job manager is never waited on
+
+    def __init__(self, iwp: InterpolatedWP):
+        iwp.interpolate(InlineJobManager())
+        self.filepath = iwp.folder.joinpath(Globals.WAYPOINT_DATAFILE_NAME)
+
+
+class InterpolatedVelocityJob(MeasuredJob):  # super -> job name, result key, function/object, arguments
+
+    def execute(self): return super().execute()
+    def execute_callback(self, result): return super().execute_callback(result)
+    def error_callback(self, result): return super().error_callback(result)
+
+    def __init__(self, iwp: InterpolatedWP):
+        result_key = iwp.unique_name + '_interpolation'
+        super().__init__(iwp.unique_name, result_key, InterpolatedVelocityCSV, tuple([iwp]))
+
+
+def normalized_frame(index_range):
+    frame = pd.DataFrame()
+    frame['date_index'] = index_range
+    frame['date_time'] = pd.to_datetime(frame['date_index'], unit='s').round('min')
+    return frame
+
+
 class SplineFitNormalizedVelocityCSV:
 
-    def __init__(self, index_range, velocity_file):
+    def __init__(self, index_range, velocity_file, dtype=None):
 
         self.filepath = None
         filepath = velocity_file.parent.joinpath(Globals.EDGE_DATAFILE_NAME)
 
-        if print_file_exists(filepath):
+        if cache_exists(filepath):
             self.filepath = filepath
         else:
-            velocity_frame = read_df(velocity_file)
+            velocity_frame = read_cache(velocity_file)
             cs = CubicSpline(velocity_frame['date_index'], velocity_frame['velocity'])
-            frame = pd.DataFrame()
-            frame['date_index'] = index_range
-            frame['date_time'] = pd.to_datetime(frame['date_index'], unit='s').round('min')
-            frame['velocity'] = frame['date_index'].apply(cs)
-            self.filepath = write_df(frame, filepath)
+            frame = normalized_frame(index_range)
+            frame['velocity'] = cs(frame['date_index'].to_numpy()).astype(dtype or float)
+            self.filepath = write_cache(frame, filepath)
 
 
-class SplineFitNormalizedVelocityJob(Job):  # super -> job name, result key, function/object, arguments
+class SplineFitNormalizedVelocityJob(MeasuredJob):  # super -> job name, result key, function/object, arguments
 
     def execute(self): return super().execute()
     def execute_callback(self, result): return super().execute_callback(result)
     def error_callback(self, result): return super().error_callback(result)
 
-    def __init__(self, index_range, waypoint: Waypoint):
-        result_key = id(waypoint)
+    def __init__(self, index_range, waypoint: Waypoint, dtype=None):
+        result_key = waypoint.unique_name + '_spline'  # distinct from the download job key for the same waypoint
         filepath = waypoint.folder.joinpath(Globals.WAYPOINT_DATAFILE_NAME)
-        arguments = tuple([index_range, filepath])
+        arguments = tuple([index_range, filepath, dtype])
         super().__init__(waypoint.unique_name, result_key, SplineFitNormalizedVelocityCSV, arguments)
+
+
+#  values of the earlier fit where its knots are the same, the rest fitted on the knots around each gap
+#  a cubic spline is disturbed for a few knots from a change, twice the seam of knots on either side is plenty
+def seeded_spline(index_range, knots: pd.DataFrame, seed, dtype=None):
+    old_knots, old_fit = read_cache(seed[0]), read_cache(seed[1])
+    if old_fit['velocity'].dtype != np.dtype(dtype or float):
+        return None
+    knot_index, knot_velocity = knots['date_index'].to_numpy(), knots['velocity'].to_numpy()
+    common, old_positions, new_positions = np.intersect1d(old_knots['date_index'].to_numpy(), knot_index, return_indices=True)
+    offset = index_offset(index_range, old_fit['date_index'].to_numpy())
+    if offset is None or not len(common) or not np.array_equal(old_knots['velocity'].to_numpy()[old_positions], knot_velocity[new_positions]):
+        return None
+    values, known = shifted(old_fit['velocity'].to_numpy(), offset, len(index_range))
+    fitted = known & trusted_positions(np.asarray(index_range), old_knots['date_index'].to_numpy()[[0, -1]], knot_index[[0, -1]])
+    values = values.astype(float)
+    margin = 2 * SEAM.total_seconds()
+    for first, last in runs(~fitted):
+        near = (knot_index >= index_range[first] - margin) & (knot_index <= index_range[last] + margin)
+        values[first:last + 1] = CubicSpline(knot_index[near], knot_velocity[near])(index_range[first:last + 1])
+    return values
+
+
+#  many waypoints in one job, the date columns are built once and shared time grids are fitted together
+#  seeds are the velocity and spline files of the same waypoints in an earlier run, their overlap is copied
+class SplineFitNormalizedVelocityBatch:
+
+    def __init__(self, index_range, velocity_files, dtype=None, seeds=None):
+
+        self.filepaths = [velocity_file.parent.joinpath(Globals.EDGE_DATAFILE_NAME) for velocity_file in velocity_files]
+        missing = [i for i, filepath in enumerate(self.filepaths) if not cache_exists(filepath)]
+        seeds = seeds or [None] * len(velocity_files)
+
+        if missing:
+            frames = {i: read_cache(velocity_files[i]) for i in missing}
+            velocities = {}
+            with section('spline'):
+                for i in [i for i in missing if seeds[i]]:
+                    velocities[i] = seeded_spline(index_range, frames[i], seeds[i], dtype)
+                cold = [i for i in missing if velocities.get(i) is None]
+                velocities.update(zip(cold, resample(index_range, [(frames[i]['date_index'].to_numpy(), frames[i]['velocity'].to_numpy()) for i in cold])))
+            template = normalized_frame(index_range)
+            for i in missing:
+                self.filepaths[i] = write_cache(template.assign(velocity=velocities[i].astype(dtype or float)), self.filepaths[i])
+
+
+class SplineFitNormalizedVelocityBatchJob(MeasuredJob):  # super -> job name, result key, function/object, arguments
+
+    def execute(self): return super().execute()
+    def execute_callback(self, result): return super().execute_callback(result)
+    def error_callback(self, result): return super().error_callback(result)
+
+    def __init__(self, index_range, waypoints: list, dtype=None, prefix='', seeds=None):
+        job_name = waypoints[0].unique_name + ' + ' + str(len(waypoints) - 1)
+        result_key = prefix + waypoints[0].unique_name + '_spline_batch'
+        filepaths = [waypoint.folder.joinpath(Globals.WAYPOINT_DATAFILE_NAME) for waypoint in waypoints]
+        arguments = tuple([index_range, filepaths, dtype, seeds])
+        super().__init__(job_name, result_key, SplineFitNormalizedVelocityBatch, arguments)
@@ -1,11 +1,16 @@
+import os
+
 from tt_globals.globals import Globals
 from tt_gpx.gpx import InterpolatedWP, EdgeNode
 from tt_file_tools.file_tools import print_file_exists
-from velocity import DownloadVelocityJob, SplineFitNormalizedVelocityJob
+from velocity import DownloadVelocityJob, SplineFitNormalizedVelocityBatchJob
+from station_cache import StationCache
+from noaa_downloads import NoaaCurrentClient, prefetch_stations, download_waypoints, station_codes
+from extension import PreviousRun, ExtendedStations, spline_seed
 
 
 # noinspection GrazieInspection
-def waypoint_processing(route, job_manager):
+def waypoint_processing(route, job_manager, dtype=None, station_cache: StationCache = None, client: NoaaCurrentClient = None, previous: PreviousRun = None):
 
     # ---------- TIDE STATION WAYPOINTS ----------
 
@@ -15,37 +20,40 @@ def waypoint_processing(route, job_manager):
     # for path in [job_manager.get(key).filepath for key in keys]:
     #     print_file_exists(path)
 
-    # ---------- INTERPOLATION WAYPOINTS ----------Ï
-
-    for iwp in filter(lambda w: isinstance(w, InterpolatedWP), route.waypoints):
-        print(f'\nDownloading data for interpolated waypoint "{iwp.name}"', flush=True)
-        fdd = Globals.FIRST_DOWNLOAD_DAY
-        ldd = Globals.LAST_DOWNLOAD_DAY
-        ndd = Globals.NORMALIZED_DOWNLOAD_DATES
-        ndi = Globals.NORMALIZED_DOWNLOAD_INDICES
-        keys = [job_manager.put(DownloadVelocityJob(fdd, ldd, ndd, ndi, wp)) for wp in iwp.data_waypoints]
-        job_manager.wait()
-        for path in [job_manager.get(key).filepath for key in keys]:
-            print_file_exists(path)
-
-        print(f'\nInterpolating the data to approximate velocity for INTERPOLATED WAYPOINTS', flush=True)
-        iwp.interpolate(job_manager)
-        print_file_exists(iwp.folder.joinpath(Globals.WAYPOINT_DATAFILE_NAME))
-
-    # ---------- REMAINING EDGE NODES ----------
+    # ---------- DOWNLOADS ----------
 
-    print(f'\nDownloading current data for non-interpolated EDGE NODE waypoints', flush=True)
     fdd = Globals.FIRST_DOWNLOAD_DAY
     ldd = Globals.LAST_DOWNLOAD_DAY
     ndd = Globals.NORMALIZED_DOWNLOAD_DATES
     ndi = Globals.NORMALIZED_DOWNLOAD_INDICES
-    keys = [job_manager.put(DownloadVelocityJob(fdd, ldd, ndd, ndi, wp)) for wp in filter(lambda w: isinstance(w, EdgeNode) and not isinstance(w, InterpolatedWP), route.waypoints)]
+
+    data_waypoints = download_waypoints(route)
+    if previous:  # days the earlier run downloaded are taken from its files
+        station_cache = ExtendedStations(previous.downloads(), station_cache)
+    if client:  # fill the station cache from threads so the download jobs below never wait on the network
+        prefetch_stations(station_codes(data_waypoints), fdd, ldd, station_cache, client)
+
+    print(f'\nDownloading data for INTERPOLATED WAYPOINTS and non-interpolated EDGE NODE waypoints', flush=True)
+    keys = [job_manager.put(DownloadVelocityJob(fdd, ldd, ndd, ndi, wp, station_cache)) for wp in data_waypoints]
     job_manager.wait()
     for path in [job_manager.get(key).filepath for key in keys]:
         print_file_exists(path)
 
+    # ---------- INTERPOLATION WAYPOINTS ----------
+
+    for iwp in filter(lambda w: isinstance(w, InterpolatedWP), route.waypoints):
+        print(f'\nInterpolating the data to approximate velocity for INTERPOLATED WAYPOINT "{iwp.name}"', flush=True)
+        iwp.interpolate(job_manager)
+        print_file_exists(iwp.folder.joinpath(Globals.WAYPOINT_DATAFILE_NAME))
+
+    # ---------- EDGE NODES ----------
+
     print(f'\nSpline fitting all EDGE NODE waypoints', flush=True)
-    keys = [job_manager.put(SplineFitNormalizedVelocityJob(Globals.DOWNLOAD_INDEX_RANGE, wp)) for wp in filter(lambda w: isinstance(w, EdgeNode), route.waypoints)]
+    edge_nodes = list(filter(lambda w: isinstance(w, EdgeNode), route.waypoints))
+    batch_size = max(1, -(-len(edge_nodes) // os.cpu_count()))  # one batch per processor
+    batches = [edge_nodes[i:i + batch_size] for i in range(0, len(edge_nodes), batch_size)]
+    seeds = [[spline_seed(previous, route.waypoints.index(wp)) for wp in batch] if previous else None for batch in batches]
+    keys = [job_manager.put(SplineFitNormalizedVelocityBatchJob(Globals.DOWNLOAD_INDEX_RANGE, batch, dtype, seeds=batch_seeds)) for batch, batch_seeds in zip(batches, seeds)]
     job_manager.wait()
-    for path in [job_manager.get(key).filepath for key in keys]:
+    for path in [path for key in keys for path in job_manager.get(key).filepaths]:
         print_file_exists(path)